@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Accounting of the AWS API calls of a run.
+
+botocore event hooks record every call of the clients of a session: the number
+of calls, retries, throttled attempts and errors per service and operation,
+and a histogram of the call latencies (retries and backoff included). The
+statistics of several accounts, possibly collected in other processes, are
+merged as plain dicts.
+"""
+
+import bisect
+import json
+import threading
+import time
+
+from rateLimiter import THROTTLING_ERROR_CODES
+
+
+# Upper bounds of the latency histogram buckets, in milliseconds; the last bucket is unbounded
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+START_TIME_CONTEXT_KEY = 'api_call_stats_start'
+
+
+def create_operation_stats():
+    """
+    Returns:
+        dict: The empty statistics of an operation.
+    """
+    return {
+        'calls': 0,
+        'retries': 0,
+        'throttled': 0,
+        'errors': 0,
+        'latency_total_ms': 0.0,
+        'latency_max_ms': 0.0,
+        'latency_histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+    }
+
+
+def get_latency_percentile(operation_stats, percentile):
+    """
+    Returns an upper bound of a latency percentile from the histogram of an operation.
+
+    Args:
+        operation_stats (dict): The statistics of an operation, see create_operation_stats.
+        percentile (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The upper bound of the histogram bucket holding the percentile, in milliseconds
+               (the maximum latency for the unbounded bucket).
+    """
+    rank = percentile / 100 * operation_stats['calls']
+    count = 0
+    for index, bucket_count in enumerate(operation_stats['latency_histogram']):
+        count += bucket_count
+        if count >= rank and count > 0:
+            return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else operation_stats['latency_max_ms']
+    return 0.0
+
+
+class ApiCallStats:
+    """
+    Thread-safe statistics of AWS API calls, keyed by service and operation.
+    """
+
+    def __init__(self):
+        self.operations = {}
+        self._lock = threading.Lock()
+
+    def register(self, events):
+        """
+        Registers the hooks on an event emitter, that of a session to record the calls of all its clients.
+
+        Args:
+            events (botocore.hooks.HierarchicalEmitter): The emitter, e.g. the 'events' of a boto3 session,
+                                                         or the 'event_emitter' component of a botocore session.
+        """
+        # First, so that handlers short-circuiting the call do not skip the timer
+        events.register_first('before-call', self.before_call)
+        events.register('needs-retry', self.needs_retry)
+        events.register('after-call', self.after_call)
+        events.register('after-call-error', self.after_call_error)
+
+    def get_operation_stats(self, event_name):
+        """
+        Returns the statistics of the operation of an event, called under the lock.
+
+        Args:
+            event_name (str): The event name, e.g. 'after-call.cloudwatch.GetMetricData'.
+
+        Returns:
+            dict: The statistics of the operation, see create_operation_stats.
+        """
+        _, service, operation = event_name.split('.', 2)
+        return self.operations.setdefault(f"{service}.{operation}", create_operation_stats())
+
+    def before_call(self, context, **kwargs):
+        """
+        Starts the timer of a call.
+        """
+        context[START_TIME_CONTEXT_KEY] = time.perf_counter()
+
+    def needs_retry(self, event_name, response, **kwargs):
+        """
+        Counts the throttled attempts of an operation.
+        """
+        if response is not None and response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+            with self._lock:
+                self.get_operation_stats(event_name)['throttled'] += 1
+
+    def after_call(self, event_name, parsed, context, **kwargs):
+        """
+        Records a call once its response, successful or not, is parsed.
+        """
+        self.record(event_name, context, parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                    'Error' in parsed)
+
+    def after_call_error(self, event_name, context, **kwargs):
+        """
+        Records a call that raised, e.g. a connection error once retries are exhausted.
+        """
+        self.record(event_name, context, 0, True)
+
+    def record(self, event_name, context, retries, error):
+        """
+        Records a call.
+
+        Args:
+            event_name (str): The event name, e.g. 'after-call.cloudwatch.GetMetricData'.
+            context (dict): The request context, holding the start time of the call.
+            retries (int): The number of retries of the call.
+            error (bool): Whether the call failed.
+        """
+        start_time = context.get(START_TIME_CONTEXT_KEY)
+        latency_ms = (time.perf_counter() - start_time) * 1000 if start_time is not None else 0.0
+        with self._lock:
+            operation_stats = self.get_operation_stats(event_name)
+            operation_stats['calls'] += 1
+            operation_stats['retries'] += retries
+            operation_stats['errors'] += int(error)
+            operation_stats['latency_total_ms'] += latency_ms
+            operation_stats['latency_max_ms'] = max(operation_stats['latency_max_ms'], latency_ms)
+            operation_stats['latency_histogram'][bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+
+    def merge(self, operations):
+        """
+        Adds the statistics of other calls, e.g. those of an account processed in another process.
+
+        Args:
+            operations (dict): Statistics keyed by 'service.Operation', see to_dict.
+        """
+        with self._lock:
+            for name, other in operations.items():
+                operation_stats = self.operations.setdefault(name, create_operation_stats())
+                for key in ['calls', 'retries', 'throttled', 'errors', 'latency_total_ms']:
+                    operation_stats[key] += other[key]
+                operation_stats['latency_max_ms'] = max(operation_stats['latency_max_ms'], other['latency_max_ms'])
+                operation_stats['latency_histogram'] = [
+                    count + other_count
+                    for count, other_count in zip(operation_stats['latency_histogram'], other['latency_histogram'])]
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: A copy of the statistics keyed by 'service.Operation', sorted by name.
+        """
+        with self._lock:
+            return {name: dict(operation_stats, latency_histogram=list(operation_stats['latency_histogram']))
+                    for name, operation_stats in sorted(self.operations.items())}
+
+    def print_summary(self, wall_time=None):
+        """
+        Prints a line per operation, and the totals.
+
+        Args:
+            wall_time (float, optional): The wall time of the run in seconds.
+        """
+        operations = self.to_dict()
+        header = "AWS API calls" + (f" (wall time {wall_time:.1f} s)" if wall_time is not None else "")
+        print(f"{header}:")
+        for name, operation_stats in operations.items():
+            calls = operation_stats['calls']
+            average = operation_stats['latency_total_ms'] / calls if calls else 0.0
+            print(f"  {name}: {calls} calls, {operation_stats['retries']} retries, "
+                  f"{operation_stats['throttled']} throttled, {operation_stats['errors']} errors, "
+                  f"latency avg {average:.0f} ms, p50 <= {get_latency_percentile(operation_stats, 50):.0f} ms, "
+                  f"p95 <= {get_latency_percentile(operation_stats, 95):.0f} ms, "
+                  f"max {operation_stats['latency_max_ms']:.0f} ms, "
+                  f"total {operation_stats['latency_total_ms'] / 1000:.1f} s")
+        total_calls = sum(operation_stats['calls'] for operation_stats in operations.values())
+        total_time = sum(operation_stats['latency_total_ms'] for operation_stats in operations.values()) / 1000
+        print(f"  Total: {total_calls} calls, {total_time:.1f} s spent in calls")
+
+    def write_json(self, path, wall_time=None):
+        """
+        Writes the statistics to a JSON file.
+
+        Args:
+            path (str): The path of the JSON file.
+            wall_time (float, optional): The wall time of the run in seconds.
+        """
+        with open(path, 'w') as json_file:
+            json.dump({
+                'wall_time_seconds': wall_time,
+                'latency_buckets_ms': LATENCY_BUCKETS_MS,
+                'operations': self.to_dict(),
+            }, json_file, indent=2)
@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""
+Local emulator of the Kafka, CloudWatch and Cost Explorer APIs used by pullMSKStats.
+
+An HTTP server answering ListClustersV2, ListNodes, ListMetrics,
+GetMetricStatistics, GetMetricData and GetCostAndUsage for a
+syntheticFleet.SyntheticFleet, in the wire protocols of the real services
+(rest-json for Kafka, json or query for CloudWatch, json for Cost Explorer),
+so that unmodified boto3 clients can target it with an endpoint_url. Requests
+and responses are translated with the botocore service models.
+
+Every request can be slowed down by a fixed latency plus a random jitter, and
+each operation can be throttled above a number of requests per second (TPS),
+with the error codes of the real services. Listing operations and GetMetricData
+are paginated like the real ones.
+
+Usage:
+    python awsEmulator.py --port 4566 --provisioned 200 --brokers 6 --latency 50 --tps 20
+
+    [my-account]
+    cluster_type = msk
+    endpoint_url = http://localhost:4566
+"""
+
+import argparse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+import botocore.session
+
+from syntheticFleet import SyntheticFleet, parse_time
+
+
+SERVICE_NAMES = ['kafka', 'cloudwatch', 'ce']
+THROTTLING_ERRORS = {
+    'kafka': ('TooManyRequestsException', 429),
+    'cloudwatch': ('Throttling', 400),
+    'ce': ('ThrottlingException', 400),
+}
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket admitting up to `rate` requests per second, without waiting.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        Returns:
+            bool: True if a token was taken, False if the request must be throttled.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def parse_value(shape, value):
+    """
+    Converts a decoded request value (JSON, query string or form) to its Python type.
+
+    Args:
+        shape (botocore.model.Shape): The shape of the value.
+        value: The decoded value, a dict or list for structures and lists.
+
+    Returns:
+        The value as boto3 would have been given it.
+    """
+    if shape.type_name == 'structure':
+        members = {}
+        for name, member_shape in shape.members.items():
+            wire_name = member_shape.serialization.get('name', name)
+            if wire_name in value:
+                members[name] = parse_value(member_shape, value[wire_name])
+        return members
+    if shape.type_name == 'list':
+        return [parse_value(shape.member, item) for item in value]
+    if shape.type_name == 'map':
+        return {key: parse_value(shape.value, item) for key, item in value.items()}
+    if shape.type_name == 'timestamp':
+        if isinstance(value, (int, float)) or re.fullmatch(r'\d+(\.\d+)?', str(value)):
+            return datetime.fromtimestamp(float(value), timezone.utc)
+        return parse_time(value)
+    if shape.type_name in ('integer', 'long'):
+        return int(value)
+    if shape.type_name in ('float', 'double'):
+        return float(value)
+    if shape.type_name == 'boolean':
+        return value if isinstance(value, bool) else value == 'true'
+    return value
+
+
+def parse_query_params(fields):
+    """
+    Nests the fields of a query protocol request, 'A.member.1.B=x' becoming {'A': {'member': {'1': {'B': 'x'}}}}.
+
+    Args:
+        fields (dict): The decoded form fields, a list of values per field.
+
+    Returns:
+        dict: The nested fields, lists being dicts keyed by 1-based indexes.
+    """
+    tree = {}
+    for key, values in fields.items():
+        node = tree
+        parts = key.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = values[0]
+    return tree
+
+
+def unflatten_query_lists(shape, value):
+    """
+    Turns the indexed members of the lists of nested query fields into lists, see parse_query_params.
+    """
+    if shape.type_name == 'structure':
+        return {key: unflatten_query_lists(shape.members[name], item)
+                for name, member_shape in shape.members.items()
+                for key, item in value.items() if key == member_shape.serialization.get('name', name)}
+    if shape.type_name == 'list':
+        items = value if shape.serialization.get('flattened') else value.get('member', {})
+        return [unflatten_query_lists(shape.member, items[index]) for index in sorted(items, key=int)]
+    return value
+
+
+def serialize_json_value(shape, value):
+    """
+    Converts a response value to its JSON form, timestamps as epoch seconds.
+
+    Args:
+        shape (botocore.model.Shape): The shape of the value.
+        value: The value, as a boto3 client would have returned it.
+
+    Returns:
+        The JSON-serializable value.
+    """
+    if shape.type_name == 'structure':
+        return {member_shape.serialization.get('name', name): serialize_json_value(member_shape, value[name])
+                for name, member_shape in shape.members.items() if value.get(name) is not None}
+    if shape.type_name == 'list':
+        return [serialize_json_value(shape.member, item) for item in value]
+    if shape.type_name == 'map':
+        return {key: serialize_json_value(shape.value, item) for key, item in value.items()}
+    if shape.type_name == 'timestamp':
+        return parse_time(value).timestamp()
+    return value
+
+
+def serialize_xml_value(shape, name, value):
+    """
+    Converts a response value to the XML of the query protocol.
+
+    Args:
+        shape (botocore.model.Shape): The shape of the value.
+        name (str): The element name.
+        value: The value, as a boto3 client would have returned it.
+
+    Returns:
+        str: The XML element.
+    """
+    if shape.type_name == 'structure':
+        content = "".join(
+            serialize_xml_value(member_shape, member_shape.serialization.get('name', member_name), value[member_name])
+            for member_name, member_shape in shape.members.items() if value.get(member_name) is not None)
+    elif shape.type_name == 'list':
+        items = "".join(serialize_xml_value(shape.member, shape.member.serialization.get('name', 'member'), item)
+                        for item in value)
+        if shape.serialization.get('flattened'):
+            return items
+        content = items
+    elif shape.type_name == 'timestamp':
+        content = parse_time(value).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    elif shape.type_name == 'boolean':
+        content = 'true' if value else 'false'
+    else:
+        content = escape(str(value))
+    return f"<{name}>{content}</{name}>"
+
+
+class AwsEmulator:
+    """
+    Answers AWS API requests for a synthetic fleet, with injected latency and throttling.
+    """
+
+    def __init__(self, fleet, latency=0.0, jitter=0.0, tps=None, operation_tps=None):
+        """
+        Args:
+            fleet (SyntheticFleet): The fleet answering the operations.
+            latency (float): Seconds added to every request.
+            jitter (float): Maximum random seconds added on top of the latency.
+            tps (float, optional): Requests per second admitted per operation, unlimited by default.
+            operation_tps (dict, optional): Requests per second of specific operations, keyed by name.
+        """
+        self.fleet = fleet
+        self.latency = latency
+        self.jitter = jitter
+        self.tps = tps
+        self.operation_tps = operation_tps or {}
+        self.buckets = {}
+        self.requests = {}
+        self.throttled = {}
+        self._lock = threading.Lock()
+
+        loader_session = botocore.session.get_session()
+        self.models = {name: loader_session.get_service_model(name) for name in SERVICE_NAMES}
+        self.json_targets = {model.metadata['targetPrefix']: name for name, model in self.models.items()
+                             if model.metadata.get('targetPrefix')}
+        # Kafka operations routed by method and URI template
+        self.rest_routes = []
+        for operation_name in self.models['kafka'].operation_names:
+            http = self.models['kafka'].operation_model(operation_name).http
+            path_pattern = re.sub(r'\{(\w+)\+?\}', r'(?P<\1>[^/]+)', http['requestUri'].split('?')[0])
+            self.rest_routes.append((http['method'], re.compile(f"{path_pattern}/?"), operation_name))
+
+    def throttle(self, operation_name):
+        """
+        Returns:
+            bool: True if a request of the operation exceeds its TPS and must be throttled.
+        """
+        rate = self.operation_tps.get(operation_name, self.tps)
+        with self._lock:
+            self.requests[operation_name] = self.requests.get(operation_name, 0) + 1
+            if rate is None:
+                return False
+            if operation_name not in self.buckets:
+                self.buckets[operation_name] = TokenBucket(rate)
+            bucket = self.buckets[operation_name]
+        if bucket.try_acquire():
+            return False
+        with self._lock:
+            self.throttled[operation_name] = self.throttled.get(operation_name, 0) + 1
+        return True
+
+    def resolve(self, method, path, headers, body):
+        """
+        Finds the service, operation, protocol and parameters of a request.
+
+        Returns:
+            tuple: The service name, the operation name, the protocol and the operation parameters.
+        """
+        target = headers.get('X-Amz-Target')
+        if target:
+            prefix, operation_name = target.split('.', 1)
+            service_name = self.json_targets[prefix]
+            operation_model = self.models[service_name].operation_model(operation_name)
+            params = json.loads(body or b'{}')
+            return service_name, operation_name, 'json', parse_value(operation_model.input_shape, params)
+
+        url = urlsplit(path)
+        if method == 'POST' and 'x-www-form-urlencoded' in headers.get('Content-Type', ''):
+            fields = parse_qs(body.decode('utf-8'), keep_blank_values=True)
+            operation_name = fields.pop('Action')[0]
+            fields.pop('Version', None)
+            input_shape = self.models['cloudwatch'].operation_model(operation_name).input_shape
+            params = unflatten_query_lists(input_shape, parse_query_params(fields))
+            return 'cloudwatch', operation_name, 'query', parse_value(input_shape, params)
+
+        for route_method, pattern, operation_name in self.rest_routes:
+            match = pattern.fullmatch(url.path)
+            if route_method == method and match:
+                input_shape = self.models['kafka'].operation_model(operation_name).input_shape
+                query = parse_qs(url.query)
+                params = {}
+                for name, member_shape in (input_shape.members.items() if input_shape else []):
+                    location = member_shape.serialization.get('location')
+                    wire_name = member_shape.serialization.get('name', name)
+                    if location == 'uri' and wire_name in match.groupdict():
+                        params[name] = unquote(match[wire_name])
+                    elif location == 'querystring' and wire_name in query:
+                        values = query[wire_name]
+                        params[name] = (parse_value(member_shape, values) if member_shape.type_name == 'list'
+                                        else parse_value(member_shape, values[0]))
+                if body:
+                    params.update(parse_value(input_shape, json.loads(body)))
+                return 'kafka', operation_name, 'rest-json', params
+        raise LookupError(f"No operation for {method} {url.path}")
+
+    def handle_request(self, method, path, headers, body):
+        """
+        Answers a request.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The request path, with its query string.
+            headers (dict): The request headers.
+            body (bytes): The request body.
+
+        Returns:
+            tuple: The HTTP status, the response headers and the response body.
+        """
+        if 'cbor' in headers.get('Content-Type', ''):
+            return self.error_response('json', 'cloudwatch', 'UnsupportedProtocol',
+                                       "The smithy-rpc-v2-cbor protocol is not supported", 400)
+        try:
+            service_name, operation_name, protocol, params = self.resolve(method, path, headers, body)
+        except (LookupError, ValueError) as e:
+            return 404, {'Content-Type': 'application/json'}, json.dumps({'message': str(e)}).encode('utf-8')
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if self.throttle(operation_name):
+            code, status = THROTTLING_ERRORS[service_name]
+            return self.error_response(protocol, service_name, code, "Rate exceeded", status)
+        try:
+            response = self.fleet.handle(operation_name, params)
+        except NotImplementedError as e:
+            return self.error_response(protocol, service_name, 'InvalidAction', str(e), 400)
+        return self.success_response(protocol, service_name, operation_name, response)
+
+    def success_response(self, protocol, service_name, operation_name, response):
+        operation_model = self.models[service_name].operation_model(operation_name)
+        if protocol == 'query':
+            output_shape = operation_model.output_shape
+            namespace = f"http://monitoring.amazonaws.com/doc/{self.models[service_name].api_version}/"
+            result = serialize_xml_value(output_shape, output_shape.serialization.get('resultWrapper',
+                                                                                      f"{operation_name}Result"),
+                                         response)
+            body = (f'<{operation_name}Response xmlns="{namespace}">{result}'
+                    f'<ResponseMetadata><RequestId>emulator</RequestId></ResponseMetadata>'
+                    f'</{operation_name}Response>')
+            return 200, {'Content-Type': 'text/xml'}, body.encode('utf-8')
+        content_type = 'application/json' if protocol == 'rest-json' else 'application/x-amz-json-1.0'
+        body = serialize_json_value(operation_model.output_shape, response) if operation_model.output_shape else {}
+        return 200, {'Content-Type': content_type}, json.dumps(body).encode('utf-8')
+
+    def error_response(self, protocol, service_name, code, message, status):
+        if protocol == 'query':
+            body = (f'<ErrorResponse><Error><Type>Sender</Type><Code>{code}</Code>'
+                    f'<Message>{escape(message)}</Message></Error><RequestId>emulator</RequestId></ErrorResponse>')
+            return status, {'Content-Type': 'text/xml'}, body.encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'x-amzn-ErrorType': code,
+                   # Read by clients of query-compatible JSON services such as CloudWatch
+                   'x-amzn-query-error': f"{code};Sender"}
+        return status, headers, json.dumps({'__type': code, 'message': message}).encode('utf-8')
+
+    def print_summary(self):
+        """
+        Prints the number of requests and throttled requests per operation.
+        """
+        with self._lock:
+            for operation_name, count in sorted(self.requests.items()):
+                print(f"  {operation_name}: {count} requests, {self.throttled.get(operation_name, 0)} throttled")
+
+
+def create_server(emulator, host='127.0.0.1', port=4566):
+    """
+    Creates a threaded HTTP server for an emulator.
+
+    Args:
+        emulator (AwsEmulator): The emulator answering the requests.
+        host (str): The address to listen on.
+        port (int): The port to listen on, 0 for any free port.
+
+    Returns:
+        ThreadingHTTPServer: The server, call serve_forever() (or run it in a thread) to start it.
+    """
+    class RequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def handle_method(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+            status, headers, response_body = emulator.handle_request(
+                self.command, self.path, dict(self.headers.items()), body)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(response_body)))
+            self.end_headers()
+            self.wfile.write(response_body)
+
+        do_GET = do_POST = do_PUT = do_DELETE = handle_method
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_operation_tps(values):
+    """
+    Parses --operation-tps values such as 'GetMetricData=50'.
+
+    Returns:
+        dict: The requests per second keyed by operation name.
+    """
+    operation_tps = {}
+    for value in values or []:
+        operation_name, _, rate = value.partition('=')
+        operation_tps[operation_name] = float(rate)
+    return operation_tps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local emulator of the Kafka, CloudWatch and Cost Explorer APIs")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=4566, help="Port to listen on (default: 4566)")
+    parser.add_argument("--provisioned", type=int, default=50, help="Number of provisioned clusters", metavar="N")
+    parser.add_argument("--brokers", type=int, default=3, help="Number of brokers per provisioned cluster",
+                        metavar="M")
+    parser.add_argument("--replaced-brokers", type=int, default=0, help="Number of brokers per provisioned cluster "
+                        "replaced by brokers with new IDs, so that broker IDs are not contiguous", metavar="N")
+    parser.add_argument("--serverless", type=int, default=5, help="Number of serverless clusters", metavar="N")
+    parser.add_argument("--topics", type=int, default=100, help="Number of topics per serverless cluster",
+                        metavar="K")
+    parser.add_argument("--max-datapoints", type=int, default=100800, help="GetMetricData datapoints per "
+                        "response, beyond which it is paginated (default: 100800)", metavar="N")
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds added to every request",
+                        metavar="MS")
+    parser.add_argument("--jitter", type=float, default=0, help="Maximum random milliseconds added on top "
+                        "of the latency", metavar="MS")
+    parser.add_argument("--tps", type=float, help="Requests per second admitted per operation, the others are "
+                        "throttled (default: unlimited)", metavar="N")
+    parser.add_argument("--operation-tps", action="append", help="Requests per second of an operation, "
+                        "e.g. GetMetricData=50 (repeatable)", metavar="OPERATION=N")
+    args = parser.parse_args()
+
+    fleet = SyntheticFleet(args.provisioned, args.brokers, args.serverless, args.topics,
+                           max_datapoints=args.max_datapoints, replaced_brokers=args.replaced_brokers)
+    emulator = AwsEmulator(fleet, latency=args.latency / 1000, jitter=args.jitter / 1000, tps=args.tps,
+                           operation_tps=parse_operation_tps(args.operation_tps))
+    server = create_server(emulator, args.host, args.port)
+    print(f"Emulating {len(fleet.clusters)} MSK clusters on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Requests:")
+        emulator.print_summary()
+
+
+if __name__ == "__main__":
+    main()
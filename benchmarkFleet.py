@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks of the collection functions on synthetic MSK fleets.
+
+Runs get_msk_cluster_data, get_cloudwatch_serverless_metric and get_aws_costs
+against a syntheticFleet.SyntheticFleet (no AWS account needed), and reports for
+each function the wall time (best and median of the repeats), the number of
+API calls and the peak memory allocated by Python (tracemalloc, measured in
+a separate run since tracing slows the code down).
+
+BENCHMARK_BUDGETS gives fleets of increasing size an API call, wall time and
+memory budget per function; --budget runs such a fleet and fails when a
+budget is exceeded, so that scaling regressions are caught
+(test_benchmarkFleet.py runs the smallest one).
+
+Usage:
+    python benchmarkFleet.py --provisioned 100 --brokers 6 --serverless 10 --topics 500 --workers 8
+    python benchmarkFleet.py --budget medium
+"""
+
+import argparse
+from contextlib import redirect_stdout
+import io
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+import pullMSKStats
+from apiCallStats import ApiCallStats
+from syntheticFleet import SyntheticFleet, create_fleet_session
+
+
+BUDGET_WORKERS = 4
+# Budgets of the benchmarks on fleets of increasing size, run with BUDGET_WORKERS workers and no latency.
+# The API calls of the synthetic fleet are deterministic, the wall time (median) and memory budgets leave
+# room for slower machines.
+BENCHMARK_BUDGETS = {
+    'small': {
+        'fleet': {'provisioned': 5, 'brokers': 3, 'serverless': 2, 'topics': 20},
+        'budgets': {
+            'get_msk_cluster_data': {'api calls': 9, 'median (s)': 1.0, 'peak memory (MB)': 32},
+            'get_cloudwatch_serverless_metric': {'api calls': 2, 'median (s)': 0.5, 'peak memory (MB)': 24},
+            'get_aws_costs': {'api calls': 1, 'median (s)': 0.5, 'peak memory (MB)': 24},
+        },
+    },
+    'medium': {
+        'fleet': {'provisioned': 50, 'brokers': 3, 'serverless': 5, 'topics': 100},
+        'budgets': {
+            'get_msk_cluster_data': {'api calls': 66, 'median (s)': 4.0, 'peak memory (MB)': 64},
+            'get_cloudwatch_serverless_metric': {'api calls': 2, 'median (s)': 0.5, 'peak memory (MB)': 24},
+            'get_aws_costs': {'api calls': 1, 'median (s)': 0.5, 'peak memory (MB)': 24},
+        },
+    },
+    'large': {
+        'fleet': {'provisioned': 200, 'brokers': 6, 'serverless': 10, 'topics': 500},
+        'budgets': {
+            'get_msk_cluster_data': {'api calls': 325, 'median (s)': 25.0, 'peak memory (MB)': 320},
+            'get_cloudwatch_serverless_metric': {'api calls': 4, 'median (s)': 1.5, 'peak memory (MB)': 32},
+            'get_aws_costs': {'api calls': 1, 'median (s)': 0.5, 'peak memory (MB)': 24},
+        },
+    },
+}
+
+
+def run_benchmark(name, fleet, function, repeat=3, verbose=False):
+    """
+    Measures a function called with a session served by a synthetic fleet.
+
+    Args:
+        name (str): The benchmark name.
+        fleet (SyntheticFleet): The fleet answering the calls.
+        function (callable): Called with a new session, e.g. lambda session: get_aws_costs(session).
+        repeat (int): The number of timed runs.
+        verbose (bool): If True, the output of the function is printed.
+
+    Returns:
+        dict: The benchmark name, the best and median wall times in seconds, the number of
+              API calls of a run and the peak memory allocated during a run in MB.
+    """
+    def run(session):
+        if verbose:
+            return function(session)
+        with redirect_stdout(io.StringIO()):
+            return function(session)
+
+    wall_times = []
+    api_calls = 0
+    for _ in range(repeat):
+        api_call_stats = ApiCallStats()
+        session = create_fleet_session(fleet, api_call_stats=api_call_stats)
+        start_time = time.perf_counter()
+        run(session)
+        wall_times.append(time.perf_counter() - start_time)
+        api_calls = sum(operation_stats['calls'] for operation_stats in api_call_stats.to_dict().values())
+
+    session = create_fleet_session(fleet)
+    tracemalloc.start()
+    try:
+        run(session)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'benchmark': name,
+        'best (s)': min(wall_times),
+        'median (s)': statistics.median(wall_times),
+        'api calls': api_calls,
+        'peak memory (MB)': peak_memory / (1024 * 1024),
+    }
+
+
+def run_benchmarks(fleet, workers=1, repeat=3, hourly=False, serverless_search=False, verbose=False):
+    """
+    Runs the benchmarks of the collection functions on a fleet.
+
+    Args:
+        fleet (SyntheticFleet): The fleet answering the calls.
+        workers (int): The number of clusters processed concurrently by get_msk_cluster_data.
+        repeat (int): The number of timed runs of each benchmark.
+        hourly (bool): If True, get_msk_cluster_data collects hourly series.
+        serverless_search (bool): If True, get_msk_cluster_data sums serverless metrics with SEARCH.
+        verbose (bool): If True, the output of the functions is printed.
+
+    Returns:
+        pd.DataFrame: One row per benchmark, see run_benchmark.
+    """
+    benchmarks = [('get_msk_cluster_data', lambda session: pullMSKStats.get_msk_cluster_data(
+        session, session.region_name, workers=workers, hourly=hourly, serverless_search=serverless_search))]
+    serverless_clusters = [name for name, cluster in fleet.clusters.items() if cluster['ClusterType'] == 'SERVERLESS']
+    if serverless_clusters:
+        benchmarks.append(('get_cloudwatch_serverless_metric', lambda session: (
+            pullMSKStats.get_cloudwatch_serverless_metric(
+                pullMSKStats.create_rate_limited_client(session, 'cloudwatch'), serverless_clusters[0],
+                'BytesInPerSec', False, hourly=hourly))))
+    benchmarks.append(('get_aws_costs', pullMSKStats.get_aws_costs))
+
+    return pd.DataFrame([run_benchmark(name, fleet, function, repeat, verbose) for name, function in benchmarks])
+
+
+def check_budgets(results, budgets):
+    """
+    Compares the results of benchmarks with their budgets.
+
+    Args:
+        results (pd.DataFrame): The benchmark results, see run_benchmarks.
+        budgets (dict): The maximum of each result column, keyed by benchmark name.
+
+    Returns:
+        list: A message per exceeded budget, empty if all the budgets are met.
+    """
+    violations = []
+    for result in results.to_dict(orient='records'):
+        for column, budget in budgets.get(result['benchmark'], {}).items():
+            if result[column] > budget:
+                violations.append(f"{result['benchmark']}: {column} {result[column]:g} "
+                                  f"exceeds its budget of {budget}")
+    return violations
+
+
+def run_budget(size, repeat=3, verbose=False):
+    """
+    Runs the benchmarks of a fleet of BENCHMARK_BUDGETS and checks them against its budgets.
+
+    Args:
+        size (str): The fleet size, a key of BENCHMARK_BUDGETS.
+        repeat (int): The number of timed runs of each benchmark.
+        verbose (bool): If True, the output of the functions is printed.
+
+    Returns:
+        tuple: The results (see run_benchmarks) and the exceeded budgets (see check_budgets).
+    """
+    budget = BENCHMARK_BUDGETS[size]
+    fleet = SyntheticFleet(budget['fleet']['provisioned'], budget['fleet']['brokers'], budget['fleet']['serverless'],
+                           budget['fleet']['topics'])
+    results = run_benchmarks(fleet, workers=BUDGET_WORKERS, repeat=repeat, verbose=verbose)
+    return results, check_budgets(results, budget['budgets'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the collection functions on a synthetic MSK fleet")
+    parser.add_argument("--provisioned", type=int, default=50, help="Number of provisioned clusters", metavar="N")
+    parser.add_argument("--brokers", type=int, default=3, help="Number of brokers per provisioned cluster",
+                        metavar="M")
+    parser.add_argument("--serverless", type=int, default=5, help="Number of serverless clusters", metavar="N")
+    parser.add_argument("--topics", type=int, default=100, help="Number of topics per serverless cluster",
+                        metavar="K")
+    parser.add_argument("--workers", type=int, default=1, help="Number of clusters processed concurrently",
+                        metavar="N")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per benchmark", metavar="N")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API call",
+                        metavar="SECONDS")
+    parser.add_argument("--hourly-series", action="store_true", help="Collect hourly series")
+    parser.add_argument("--serverless-search", action="store_true",
+                        help="Sum serverless topic metrics with SEARCH expressions")
+    parser.add_argument("--budget", choices=BENCHMARK_BUDGETS, help="Run the fleet of a budget size instead (with "
+                        f"{BUDGET_WORKERS} workers, ignoring the fleet options) and fail if one of its API call, "
+                        "wall time or memory budgets is exceeded")
+    parser.add_argument("--json", help="Write the results to a JSON file", metavar="FILE")
+    parser.add_argument("--verbose", action="store_true", help="Print the output of the benchmarked functions")
+    args = parser.parse_args()
+
+    violations = []
+    if args.budget:
+        for key, value in BENCHMARK_BUDGETS[args.budget]['fleet'].items():
+            setattr(args, key, value)
+        args.workers, args.latency, args.hourly_series, args.serverless_search = BUDGET_WORKERS, 0.0, False, False
+    print(f"Synthetic fleet: {args.provisioned} provisioned clusters x {args.brokers} brokers, "
+          f"{args.serverless} serverless clusters x {args.topics} topics")
+    if args.budget:
+        results, violations = run_budget(args.budget, repeat=args.repeat, verbose=args.verbose)
+    else:
+        fleet = SyntheticFleet(args.provisioned, args.brokers, args.serverless, args.topics, latency=args.latency)
+        results = run_benchmarks(fleet, workers=args.workers, repeat=args.repeat, hourly=args.hourly_series,
+                                 serverless_search=args.serverless_search, verbose=args.verbose)
+    print(results.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    for violation in violations:
+        print(f"❌ {violation}")
+    if args.budget and not violations:
+        print(f"All the {args.budget} fleet budgets are met")
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'fleet': {key: getattr(args, key) for key in ['provisioned', 'brokers', 'serverless', 'topics']},
+                       'options': {key: getattr(args, key) for key in ['workers', 'repeat', 'latency',
+                                                                       'hourly_series', 'serverless_search']},
+                       'results': results.to_dict(orient='records'), 'budget': args.budget,
+                       'violations': violations}, json_file, indent=2)
+        print(f"Results saved to {args.json}")
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of CloudWatch responses.
+
+Values are stored as JSON in a single SQLite file, keyed by a hash of the
+namespace, metric, dimensions, statistic, period and aligned time window of
+the query. The broker nodes of provisioned clusters are cached too, keyed by
+cluster ARN and version. Entries expire after a TTL, and the least recently
+used entries are evicted once the cache grows past its maximum size.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+CACHE_FILE_NAME = 'cloudwatch-cache.sqlite'
+DEFAULT_TTL_SECONDS = 24 * 3600  # 1 Day
+DEFAULT_MAX_SIZE_BYTES = 512 * 1024 * 1024  # 512 MB
+# Access times are only rewritten once older than this, in batches of ACCESS_BATCH_SIZE
+ACCESS_RESOLUTION_SECONDS = 60
+ACCESS_BATCH_SIZE = 256
+
+
+def normalize_query(query):
+    """
+    Normalizes CloudWatch query parameters so that equivalent queries compare equal.
+
+    Args:
+        query (dict): The query parameters, e.g. a MetricDataQuery.
+
+    Returns:
+        dict: The query without its 'Id', with 'Dimensions' sorted by name.
+    """
+    if isinstance(query, dict):
+        return {key: normalize_query(item) for key, item in query.items() if key != 'Id'}
+    if isinstance(query, list):
+        items = [normalize_query(item) for item in query]
+        if all(isinstance(item, dict) and 'Name' in item for item in items):
+            items.sort(key=lambda item: item['Name'])
+        return items
+    return query
+
+
+def build_cache_key(query, start_time=None, end_time=None):
+    """
+    Builds the cache key of a CloudWatch query over a time window.
+
+    Args:
+        query (dict): The query parameters, see normalize_query.
+        start_time (datetime, optional): The start of the queried window, None for a query without window.
+        end_time (datetime, optional): The end of the queried window, None for a query without window.
+
+    Returns:
+        str: A hexadecimal digest of the query and window.
+    """
+    key = {'Query': normalize_query(query), 'StartTime': start_time.isoformat() if start_time else None,
+           'EndTime': end_time.isoformat() if end_time else None}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class MetricCache:
+    """
+    A thread-safe SQLite cache of JSON values with a TTL and size-based LRU eviction.
+
+    SQLite locking also lets several processes share the same cache file. The total
+    size of the values is kept in a single-row table updated with every insert and
+    eviction, and the access times of hits are written in batches.
+    """
+
+    def __init__(self, cache_dir, ttl_seconds=DEFAULT_TTL_SECONDS, max_size_bytes=DEFAULT_MAX_SIZE_BYTES):
+        """
+        Opens (or creates) the cache file of a directory.
+
+        Args:
+            cache_dir (str): The directory holding the cache file, created if needed.
+            ttl_seconds (float): The age after which entries expire.
+            max_size_bytes (int): The total size of the stored values above which
+                                  the least recently used entries are evicted.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILE_NAME)
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._accesses = {}
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY, size INTEGER NOT NULL)")
+            self._connection.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl_seconds,))
+            # The only full scan, the total is then updated incrementally
+            self._connection.execute(
+                "INSERT OR REPLACE INTO totals (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM entries")
+
+    def get(self, key):
+        """
+        Returns the value of a key, or None if it is missing or expired.
+
+        Args:
+            key (str): The cache key, see build_cache_key.
+
+        Returns:
+            The JSON-decoded value, or None.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, accessed FROM entries WHERE key = ? AND created >= ?",
+                (key, now - self.ttl_seconds)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if now - row[1] > ACCESS_RESOLUTION_SECONDS:
+                self._accesses[key] = now
+                if len(self._accesses) >= ACCESS_BATCH_SIZE:
+                    with self._connection:
+                        self._flush_accesses()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (str): The cache key, see build_cache_key.
+            value: A JSON-serializable value (NaN is allowed).
+        """
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now))
+            self._connection.execute("UPDATE totals SET size = size + ? WHERE id = 0",
+                                     (len(data) - (row[0] if row else 0),))
+            total_size = self._connection.execute("SELECT size FROM totals WHERE id = 0").fetchone()[0]
+            if total_size > self.max_size_bytes:
+                # The eviction order needs the recent accesses
+                self._flush_accesses()
+                evicted_size = 0
+                evicted_keys = []
+                for entry_key, size in self._connection.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                    if total_size - evicted_size <= self.max_size_bytes:
+                        break
+                    evicted_keys.append((entry_key,))
+                    evicted_size += size
+                self._connection.executemany("DELETE FROM entries WHERE key = ?", evicted_keys)
+                self._connection.execute("UPDATE totals SET size = size - ? WHERE id = 0", (evicted_size,))
+
+    def _flush_accesses(self):
+        """
+        Writes the pending access times, called under the lock within a transaction.
+        """
+        if self._accesses:
+            self._connection.executemany("UPDATE entries SET accessed = ? WHERE key = ?",
+                                         [(accessed, key) for key, accessed in self._accesses.items()])
+            self._accesses = {}
+
+    def close(self):
+        """
+        Writes the pending access times and closes the cache file.
+        """
+        with self._lock:
+            with self._connection:
+                self._flush_accesses()
+            self._connection.close()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Catalog of the AWS/Kafka CloudWatch metrics, and deduplication of their queries.
+
+Each metric is published at a scope, which sets its dimensions:
+
+- cluster: "Cluster Name", e.g. GlobalTopicCount.
+- broker: "Cluster Name" and "Broker ID", the metrics of provisioned brokers.
+- topic: "Cluster Name" and "Topic", the metrics of MSK Serverless.
+- broker_topic: "Cluster Name", "Broker ID" and "Topic", with PER_TOPIC_PER_BROKER monitoring.
+
+The rows of a provisioned cluster are its brokers, so a cluster-scoped metric
+needed on every row is the same query repeated per broker. A MetricQueryPlanner
+gives a single Id to each distinct query, and maps its value back to every cell
+that needs it. The queries of a plan are grouped by metric request (metric,
+dimensions and period): GetMetricData takes a single statistic per query, so the
+Average and Maximum of a metric are adjacent queries, sent in the same call.
+"""
+
+import json
+
+from metricCache import normalize_query
+
+
+CLUSTER_SCOPE = 'cluster'
+BROKER_SCOPE = 'broker'
+TOPIC_SCOPE = 'topic'
+BROKER_TOPIC_SCOPE = 'broker_topic'
+SCOPE_DIMENSIONS = {
+    CLUSTER_SCOPE: ['Cluster Name'],
+    BROKER_SCOPE: ['Cluster Name', 'Broker ID'],
+    TOPIC_SCOPE: ['Cluster Name', 'Topic'],
+    BROKER_TOPIC_SCOPE: ['Cluster Name', 'Broker ID', 'Topic'],
+}
+# Scope of the metrics of provisioned clusters, the others are broker metrics
+PROVISIONED_METRIC_SCOPES = {
+    'ActiveControllerCount': CLUSTER_SCOPE,
+    'GlobalPartitionCount': CLUSTER_SCOPE,
+    'GlobalTopicCount': CLUSTER_SCOPE,
+    'OfflinePartitionsCount': CLUSTER_SCOPE,
+    'BytesInPerSec': BROKER_SCOPE,
+    'BytesOutPerSec': BROKER_SCOPE,
+    'ClientConnectionCount': BROKER_SCOPE,
+    'KafkaDataLogsDiskUsed': BROKER_SCOPE,
+    'LeaderCount': BROKER_SCOPE,
+    'MessagesInPerSec': BROKER_SCOPE,
+    'PartitionCount': BROKER_SCOPE,
+    'ReplicationBytesInPerSec': BROKER_SCOPE,
+    'ReplicationBytesOutPerSec': BROKER_SCOPE,
+}
+
+
+def get_metric_scope(metric_name, cluster_type='PROVISIONED'):
+    """
+    Returns the scope a metric is collected at.
+
+    Args:
+        metric_name (str): The CloudWatch metric name.
+        cluster_type (str): 'PROVISIONED' or 'SERVERLESS', whose metrics are all per topic.
+
+    Returns:
+        str: CLUSTER_SCOPE, BROKER_SCOPE or TOPIC_SCOPE.
+    """
+    if cluster_type.upper() != 'PROVISIONED':
+        return TOPIC_SCOPE
+    return PROVISIONED_METRIC_SCOPES.get(metric_name, BROKER_SCOPE)
+
+
+def get_scope_dimensions(scope, cluster_id, broker_id=None, topic=None):
+    """
+    Builds the CloudWatch dimensions of a metric at a scope.
+
+    Args:
+        scope (str): The scope, a key of SCOPE_DIMENSIONS.
+        cluster_id (str): The name of the MSK cluster.
+        broker_id (int, optional): The broker ID, for the broker scopes.
+        topic (str, optional): The topic name, for the topic scopes.
+
+    Returns:
+        list: The dimensions list.
+    """
+    values = {'Cluster Name': cluster_id, 'Broker ID': broker_id, 'Topic': topic}
+    return [{'Name': name, 'Value': str(values[name])} for name in SCOPE_DIMENSIONS[scope]]
+
+
+def get_query_statistic(query):
+    """
+    Returns:
+        str: The statistic of a MetricStat query, or 'Expression' for a math, SEARCH or Metrics Insights query.
+    """
+    return query['MetricStat']['Stat'] if 'MetricStat' in query else 'Expression'
+
+
+def build_request_key(query):
+    """
+    Returns:
+        str: The key of the metric request of a query, its metric, dimensions and period without the statistic.
+    """
+    request = normalize_query(query)
+    if 'MetricStat' in request:
+        request['MetricStat'] = {key: value for key, value in request['MetricStat'].items() if key != 'Stat'}
+    return json.dumps(request, sort_keys=True)
+
+
+def count_distinct_queries(queries):
+    """
+    Returns:
+        int: The number of distinct queries of a list, i.e. the number of Ids a MetricQueryPlanner gives them.
+    """
+    return len({json.dumps(normalize_query(query), sort_keys=True) for query in queries})
+
+
+class MetricQueryPlanner:
+    """
+    Gives a single Id to each distinct MetricDataQuery of a set of cells.
+
+    A cell planned with several queries (e.g. the topics of a serverless metric)
+    gets the sum of their values.
+    """
+
+    def __init__(self, prefix='m'):
+        """
+        Args:
+            prefix (str): The prefix of the query Ids, must be a lowercase letter.
+        """
+        self.prefix = prefix
+        self.cells = {}
+        self.requests = {}
+        self.planned_cells = 0
+        self._queries = {}
+        self._query_ids = {}
+
+    @property
+    def queries(self):
+        """
+        list: The distinct queries, the statistics of each metric request being adjacent.
+        """
+        return [self._queries[query_id] for statistics in self.requests.values() for query_id in statistics.values()]
+
+    def add(self, query, cell):
+        """
+        Plans the query of a cell, reusing the Id of an identical query.
+
+        Args:
+            query (dict): A MetricDataQuery, its Id is ignored.
+            cell: The cell that needs the value of the query, e.g. a (row, column) tuple.
+
+        Returns:
+            str: The Id of the query.
+        """
+        self.planned_cells += 1
+        key = json.dumps(normalize_query(query), sort_keys=True)
+        query_id = self._query_ids.get(key)
+        if query_id is None:
+            query_id = self._query_ids[key] = f"{self.prefix}{len(self._queries)}"
+            self._queries[query_id] = dict(query, Id=query_id)
+            self.requests.setdefault(build_request_key(query), {})[get_query_statistic(query)] = query_id
+        self.cells.setdefault(query_id, []).append(cell)
+        return query_id
+
+    def count_statistics(self):
+        """
+        Returns:
+            dict: The number of distinct queries per statistic.
+        """
+        counts = {}
+        for statistics in self.requests.values():
+            for statistic in statistics:
+                counts[statistic] = counts.get(statistic, 0) + 1
+        return counts
+
+    def map_values(self, values, combine=sum):
+        """
+        Maps the values of the queries back to their cells.
+
+        Args:
+            values (dict): The value of each query keyed by query Id.
+            combine (callable): Combines the list of values of a cell planned with several queries.
+
+        Returns:
+            dict: The value of each cell.
+        """
+        cell_values = {}
+        for query_id, value in values.items():
+            for cell in self.cells.get(query_id, []):
+                cell_values.setdefault(cell, []).append(value)
+        return {cell: items[0] if len(items) == 1 else combine(items) for cell, items in cell_values.items()}
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Local state store of hourly CloudWatch buckets for incremental collection.
+
+Each hourly series (one per query: cluster, broker, metric and statistic) is
+stored bucket by bucket in a SQLite file, together with the range of hours
+fetched successfully. The next run only fetches the hours after that range
+and reads the rest of its window back from the store.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from metricCache import normalize_query
+
+
+STORE_FILE_NAME = 'metric-state.sqlite'
+OVERLAP_SECONDS = 3600  # The last stored hour is fetched again, its datapoints may have been partial
+
+
+def build_series_key(query):
+    """
+    Builds the store key of the series of a CloudWatch query.
+
+    Args:
+        query (dict): The query parameters, e.g. a MetricDataQuery. Its 'Id' is ignored.
+
+    Returns:
+        str: A hexadecimal digest of the query.
+    """
+    return hashlib.sha256(json.dumps(normalize_query(query), sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class MetricStore:
+    """
+    A thread-safe SQLite store of hourly buckets, keyed by series.
+
+    Times are stored as POSIX timestamps of the bucket starts.
+    """
+
+    def __init__(self, store_dir):
+        """
+        Opens (or creates) the store file of a directory.
+
+        Args:
+            store_dir (str): The directory holding the store file, created if needed.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        self.path = os.path.join(store_dir, STORE_FILE_NAME)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT NOT NULL, time INTEGER NOT NULL, value REAL NOT NULL, PRIMARY KEY (key, time))")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                "key TEXT PRIMARY KEY, start_time INTEGER NOT NULL, end_time INTEGER NOT NULL)")
+
+    def get_fetch_start(self, key, start_time, end_time):
+        """
+        Returns the time from which a series must be fetched to cover a window.
+
+        Args:
+            key (str): The series key, see build_series_key.
+            start_time (int): The start of the window.
+            end_time (int): The end of the window.
+
+        Returns:
+            int: start_time if the stored range does not cover the start of the window,
+                 otherwise the end of the stored range minus OVERLAP_SECONDS.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT start_time, end_time FROM coverage WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] > start_time or row[1] < start_time:
+            return start_time
+        return max(start_time, min(row[1], end_time) - OVERLAP_SECONDS)
+
+    def load(self, key, start_time, end_time):
+        """
+        Returns the stored buckets of a series within a window.
+
+        Args:
+            key (str): The series key, see build_series_key.
+            start_time (int): The start of the window.
+            end_time (int): The end of the window.
+
+        Returns:
+            list: (time, value) pairs.
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT time, value FROM buckets WHERE key = ? AND time >= ? AND time < ?",
+                (key, start_time, end_time)).fetchall()
+
+    def save(self, key, fetch_start, start_time, end_time, buckets):
+        """
+        Stores the buckets fetched for a series and extends its stored range.
+
+        Buckets older than the window are dropped.
+
+        Args:
+            key (str): The series key, see build_series_key.
+            fetch_start (int): The start of the fetched range, see get_fetch_start.
+            start_time (int): The start of the window.
+            end_time (int): The end of the window and of the fetched range.
+            buckets (list): (time, value) pairs of the fetched datapoints.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO buckets (key, time, value) VALUES (?, ?, ?)",
+                [(key, time, value) for time, value in buckets])
+            self._connection.execute("DELETE FROM buckets WHERE key = ? AND time < ?", (key, start_time))
+            # A fetch from the start of the window replaces the stored range, otherwise it extends it
+            if fetch_start <= start_time:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO coverage (key, start_time, end_time) VALUES (?, ?, ?)",
+                    (key, start_time, end_time))
+            else:
+                self._connection.execute(
+                    "UPDATE coverage SET start_time = MAX(start_time, ?), end_time = ? WHERE key = ?",
+                    (start_time, end_time, key))
+
+    def close(self):
+        """
+        Closes the store file.
+        """
+        with self._lock:
+            self._connection.close()
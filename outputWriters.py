@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+Output writers for the DataFrames collected for an AWS account.
+
+Each writer takes the frames of an account keyed by sheet name (ClusterData,
+Costs, HourlySeries) and returns the paths it wrote:
+
+- xlsx: one workbook per account, one sheet per frame (the default).
+- csv: one file per account and frame.
+- jsonl: one JSON Lines file per account and frame.
+- arrow: one Arrow IPC (Feather v2) file per account and frame.
+- parquet: a dataset per frame, partitioned by account and region
+  (<frame>/account=<section>/region=<region>/data.parquet), which downstream
+  tools can read or memory-map directly.
+
+Row sinks write the same layout incrementally, as the frames of each cluster
+arrive (csv, jsonl, and parquet with one row group per write).
+
+The Arrow and Parquet writers require pyarrow.
+"""
+
+import importlib.util
+import os
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
+
+from stageProfiler import profile_stage
+
+
+OUTPUT_FORMATS = ['xlsx', 'csv', 'jsonl', 'arrow', 'parquet']
+STREAMING_FORMATS = ['csv', 'jsonl', 'parquet']
+PARQUET_FILE_NAME = 'data.parquet'
+
+
+def require_pyarrow(output_format):
+    """
+    Raises an error if pyarrow, needed by an output format, is not installed.
+
+    Args:
+        output_format (str): The output format.
+    """
+    if importlib.util.find_spec('pyarrow') is None:
+        raise RuntimeError(f"The {output_format} output format requires pyarrow, "
+                           f"install it with 'pip3 install pyarrow'")
+
+
+def to_columnar(frame):
+    """
+    Converts the mixed-type columns of a DataFrame into columnar-friendly types.
+
+    Rows of a cluster after the first one hold "" in the cluster-level columns. Those
+    become missing values, numeric columns become numeric and the others strings.
+
+    Args:
+        frame (pd.DataFrame): The frame to convert.
+
+    Returns:
+        pd.DataFrame: The converted frame.
+    """
+    frame = frame.copy()
+    for column in frame.columns:
+        if frame[column].dtype != object:
+            continue
+        values = frame[column].replace("", np.nan)
+        try:
+            frame[column] = pd.to_numeric(values)
+        except (TypeError, ValueError):
+            frame[column] = values.map(lambda value: value if pd.isna(value) else str(value))
+    frame.columns = [str(column) for column in frame.columns]
+    return frame
+
+
+def get_frame_regions(frame, region_label):
+    """
+    Returns the region of each row of a frame.
+
+    Args:
+        frame (pd.DataFrame): A ClusterData, Costs or HourlySeries frame.
+        region_label (str): The region used when the frame has no region column.
+
+    Returns:
+        pd.Series: The region of each row.
+    """
+    for column in ['Region', 'region']:
+        if column in frame.columns:
+            # The region is only written on the first row of each cluster
+            return frame[column].replace("", np.nan).ffill().fillna(region_label)
+    return pd.Series(region_label, index=frame.index)
+
+
+def write_xlsx(frames, output_dir, section, region_label):
+    """
+    Writes the frames of an account as the sheets of an Excel workbook.
+
+    Args:
+        frames (dict): The DataFrames to write keyed by sheet name.
+        output_dir (str): The output directory.
+        section (str): The section/account identifier.
+        region_label (str): The region, or 'multi-region'.
+
+    Returns:
+        list: The path of the workbook.
+    """
+    output_file = os.path.join(output_dir, f"{section}-{region_label}.xlsx")
+    with pd.ExcelWriter(output_file, engine='xlsxwriter') as excel_writer:
+        for sheet_name, frame in frames.items():
+            frame.to_excel(excel_writer=excel_writer, sheet_name=sheet_name, index=False)
+    return [output_file]
+
+
+def write_csv(frames, output_dir, section, region_label):
+    """
+    Writes each frame of an account to a CSV file.
+
+    Args:
+        frames (dict): The DataFrames to write keyed by sheet name.
+        output_dir (str): The output directory.
+        section (str): The section/account identifier.
+        region_label (str): The region, or 'multi-region'.
+
+    Returns:
+        list: The paths of the CSV files.
+    """
+    output_files = []
+    for sheet_name, frame in frames.items():
+        output_file = os.path.join(output_dir, f"{section}-{region_label}-{sheet_name}.csv")
+        frame.to_csv(output_file, index=False)
+        output_files.append(output_file)
+    return output_files
+
+
+def write_jsonl(frames, output_dir, section, region_label):
+    """
+    Writes each frame of an account to a JSON Lines file, one object per row.
+
+    Args:
+        frames (dict): The DataFrames to write keyed by sheet name.
+        output_dir (str): The output directory.
+        section (str): The section/account identifier.
+        region_label (str): The region, or 'multi-region'.
+
+    Returns:
+        list: The paths of the JSON Lines files.
+    """
+    output_files = []
+    for sheet_name, frame in frames.items():
+        output_file = os.path.join(output_dir, f"{section}-{region_label}-{sheet_name}.jsonl")
+        to_columnar(frame).to_json(output_file, orient='records', lines=True)
+        output_files.append(output_file)
+    return output_files
+
+
+def write_arrow(frames, output_dir, section, region_label):
+    """
+    Writes each frame of an account to an Arrow IPC file.
+
+    Args:
+        frames (dict): The DataFrames to write keyed by sheet name.
+        output_dir (str): The output directory.
+        section (str): The section/account identifier.
+        region_label (str): The region, or 'multi-region'.
+
+    Returns:
+        list: The paths of the Arrow files.
+    """
+    require_pyarrow('arrow')
+    output_files = []
+    for sheet_name, frame in frames.items():
+        output_file = os.path.join(output_dir, f"{section}-{region_label}-{sheet_name}.arrow")
+        to_columnar(frame).reset_index(drop=True).to_feather(output_file)
+        output_files.append(output_file)
+    return output_files
+
+
+def write_parquet(frames, output_dir, section, region_label):
+    """
+    Writes each frame of an account to a Parquet dataset partitioned by account and region.
+
+    A run replaces the partitions of its account and regions, and leaves the others in place.
+
+    Args:
+        frames (dict): The DataFrames to write keyed by sheet name.
+        output_dir (str): The output directory, holding one dataset directory per sheet name.
+        section (str): The section/account identifier.
+        region_label (str): The region, or 'multi-region'.
+
+    Returns:
+        list: The paths of the Parquet files.
+    """
+    require_pyarrow('parquet')
+    output_files = []
+    for sheet_name, frame in frames.items():
+        regions = get_frame_regions(frame, region_label)
+        frame = to_columnar(frame)
+        for region in regions.unique():
+            partition_dir = os.path.join(output_dir, sheet_name, f"account={section}", f"region={region}")
+            os.makedirs(partition_dir, exist_ok=True)
+            output_file = os.path.join(partition_dir, PARQUET_FILE_NAME)
+            frame[(regions == region).values].to_parquet(output_file, index=False)
+            output_files.append(output_file)
+    return output_files
+
+
+OUTPUT_WRITERS = {
+    'xlsx': write_xlsx,
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+    'arrow': write_arrow,
+    'parquet': write_parquet,
+}
+
+
+def write_output(frames, output_dir, section, region_label, output_format='xlsx'):
+    """
+    Writes the frames of an account in an output format.
+
+    Args:
+        frames (dict): The DataFrames to write keyed by sheet name, e.g. 'ClusterData'.
+        output_dir (str): The output directory.
+        section (str): The section/account identifier.
+        region_label (str): The region, or 'multi-region'.
+        output_format (str): One of OUTPUT_FORMATS.
+
+    Returns:
+        list: The paths written.
+    """
+    return OUTPUT_WRITERS[output_format](frames, output_dir, section, region_label)
+
+
+class RowSink(ABC):
+    """
+    Base class of the sinks writing the frames of an account incrementally.
+
+    Frames are appended to the output of their sheet name as they are written, from any
+    thread. The columns of the first frame of a sheet fix the columns of the later ones.
+    """
+
+    def __init__(self, output_dir, section, region_label, float_columns=None):
+        """
+        Args:
+            output_dir (str): The output directory.
+            section (str): The section/account identifier.
+            region_label (str): The region, or 'multi-region'.
+            float_columns (dict, optional): The columns holding floats, keyed by sheet name. Their type
+                                            is not inferred from the first rows, which may all be integers.
+        """
+        self.output_dir = output_dir
+        self.section = section
+        self.region_label = region_label
+        self.float_columns = float_columns or {}
+        self.columns = {}
+        self.output_files = []
+        self._lock = threading.Lock()
+
+    def write(self, sheet_name, frame):
+        """
+        Appends a frame to the output of a sheet.
+
+        Args:
+            sheet_name (str): The sheet name, e.g. 'ClusterData'.
+            frame (pd.DataFrame): The rows to append.
+        """
+        if frame.empty:
+            return
+        with profile_stage('output'), self._lock:
+            if sheet_name not in self.columns:
+                self.columns[sheet_name] = list(frame.columns)
+            self.append(sheet_name, frame.reindex(columns=self.columns[sheet_name]))
+
+    @abstractmethod
+    def append(self, sheet_name, frame):
+        """
+        Appends a frame with the columns of its sheet, called under the sink lock.
+        """
+
+    def close(self):
+        """
+        Closes the outputs of the sink.
+
+        Returns:
+            list: The paths written.
+        """
+        return self.output_files
+
+
+class CsvSink(RowSink):
+    """
+    Appends the rows of each sheet to a CSV file, the header is written with the first rows.
+    """
+
+    def append(self, sheet_name, frame):
+        output_file = os.path.join(self.output_dir, f"{self.section}-{self.region_label}-{sheet_name}.csv")
+        first_write = output_file not in self.output_files
+        if first_write:
+            self.output_files.append(output_file)
+        frame.to_csv(output_file, mode='w' if first_write else 'a', header=first_write, index=False)
+
+
+class JsonlSink(RowSink):
+    """
+    Appends the rows of each sheet to a JSON Lines file.
+    """
+
+    def append(self, sheet_name, frame):
+        output_file = os.path.join(self.output_dir, f"{self.section}-{self.region_label}-{sheet_name}.jsonl")
+        first_write = output_file not in self.output_files
+        if first_write:
+            self.output_files.append(output_file)
+        lines = to_columnar(frame).to_json(orient='records', lines=True)
+        with open(output_file, 'w' if first_write else 'a') as output:
+            output.write(lines if lines.endswith('\n') else lines + '\n')
+
+
+class ParquetSink(RowSink):
+    """
+    Appends the rows of each sheet as row groups of the Parquet files partitioned by account
+    and region, see write_parquet. The first rows of a sheet fix its schema, but for its float columns.
+    """
+
+    def __init__(self, output_dir, section, region_label, float_columns=None):
+        require_pyarrow('parquet')
+        super().__init__(output_dir, section, region_label, float_columns)
+        self.schemas = {}
+        self.writers = {}
+
+    def append(self, sheet_name, frame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        regions = get_frame_regions(frame, self.region_label)
+        frame = to_columnar(frame)
+        if sheet_name not in self.schemas:
+            schema = pa.Schema.from_pandas(frame, preserve_index=False)
+            # A metric left at 0 in the first rows would make its column int64, and the later floats fail
+            for name in self.float_columns.get(sheet_name, []):
+                if name in schema.names:
+                    schema = schema.set(schema.get_field_index(name), pa.field(name, pa.float64()))
+            self.schemas[sheet_name] = schema
+        schema = self.schemas[sheet_name]
+        # Conform the rows to the schema of the sheet, the cluster-level columns of a
+        # chunk may for instance be all missing.
+        for field in schema:
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                frame[field.name] = frame[field.name].map(lambda value: None if pd.isna(value) else str(value))
+            else:
+                frame[field.name] = pd.to_numeric(frame[field.name], errors='coerce')
+
+        for region in regions.unique():
+            partition = (sheet_name, region)
+            if partition not in self.writers:
+                partition_dir = os.path.join(self.output_dir, sheet_name, f"account={self.section}", f"region={region}")
+                os.makedirs(partition_dir, exist_ok=True)
+                output_file = os.path.join(partition_dir, PARQUET_FILE_NAME)
+                self.writers[partition] = pq.ParquetWriter(output_file, schema)
+                self.output_files.append(output_file)
+            table = pa.Table.from_pandas(frame[(regions == region).values], schema=schema, preserve_index=False)
+            self.writers[partition].write_table(table)
+
+    def close(self):
+        with profile_stage('output'), self._lock:
+            for writer in self.writers.values():
+                writer.close()
+        return self.output_files
+
+
+ROW_SINKS = {
+    'csv': CsvSink,
+    'jsonl': JsonlSink,
+    'parquet': ParquetSink,
+}
+
+
+def open_sink(output_dir, section, region_label, output_format='csv', float_columns=None):
+    """
+    Opens a row sink writing the frames of an account incrementally.
+
+    Args:
+        output_dir (str): The output directory.
+        section (str): The section/account identifier.
+        region_label (str): The region, or 'multi-region'.
+        output_format (str): One of STREAMING_FORMATS.
+        float_columns (dict, optional): The columns holding floats, keyed by sheet name, see RowSink.
+
+    Returns:
+        RowSink: The sink, to be closed once every frame is written.
+    """
+    return ROW_SINKS[output_format](output_dir, section, region_label, float_columns)
@@ -6,14 +6,31 @@ Refactored for improved readability and maintainability.
 """
 
 import boto3
+import botocore.session
+from botocore.credentials import AssumeRoleCredentialFetcher, DeferredRefreshableCredentials
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+import numpy as np
 import os
 import pandas as pd
 
+from apiCallStats import ApiCallStats
+from metricCache import MetricCache, build_cache_key
+from metricCatalog import (CLUSTER_SCOPE, MetricQueryPlanner, count_distinct_queries, get_metric_scope,
+                           get_scope_dimensions)
+from metricStore import MetricStore, build_series_key
+from outputWriters import open_sink, write_output
+from rateLimiter import create_rate_limited_client
+from responseRecorder import ResponseRecorder, ResponseReplayer, get_recording_path
+from runManifest import CHECKPOINT_DIR_NAME, RunManifest, get_unit_name
+from stageProfiler import profile_stage
+
 
 # Constants
 METRIC_COLLECTION_PERIOD_DAYS = 7
 AGGREGATION_DURATION_SECONDS = 3600  # 1 Hour
+MAX_METRIC_DATA_QUERIES = 500  # GetMetricData limit per call
+MAX_METRIC_DATA_POINTS = 100800  # GetMetricData limit of datapoints per call
 
 # Metrics
 CLUSTER_INFO = ["Region", 'ClusterName', 'Availability', 'Authentication', "KafkaVersion", "EnhancedMonitoring"]
@@ -23,10 +40,92 @@ PEAK_METRICS = AVERAGE_METRICS + [
     'ClientConnectionCount', 'PartitionCount', 'GlobalTopicCount',
     'LeaderCount', 'ReplicationBytesOutPerSec', 'ReplicationBytesInPerSec'
 ]
+# Metrics summed across brokers for the cluster-wide peak of the hourly series mode
+CLUSTER_PEAK_METRICS = ['BytesInPerSec', 'BytesOutPerSec', 'MessagesInPerSec']
+# Statistics of the hourly Average series of AVERAGE_METRICS
+SERIES_STATISTICS = ['p50', 'p90', 'p95', 'p99', 'stddev', 'busy hour']
 AVERAGE_METRICS_SERVERLESS = ['BytesInPerSec', 'BytesOutPerSec', 'MessagesInPerSec']
 PEAK_METRICS_SERVERLESS = ['BytesInPerSec', 'BytesOutPerSec', 'MessagesInPerSec']
+ROLE_SESSION_NAME = 'kafka-metrics-extractor'
+# Dynamic label of the series of a Metrics Insights query grouped by broker
+BROKER_ID_LABEL = "${PROP('Dim.Broker ID')}"
+# For MSK Serverless, the dimension key for the cluster identifier is 'Cluster Name'.
+SERVERLESS_CLUSTER_DIMENSION = 'Cluster Name'
+
+
+class EndpointSession(boto3.Session):
+    """
+    A boto3 session whose clients target a custom endpoint, e.g. a local awsEmulator.
+
+    The refresh_credentials callback of an assumed role session returns fresh credentials
+    with their expiry_time, for the clients of the async engine.
+    """
+
+    def __init__(self, endpoint_url=None, refresh_credentials=None, **kwargs):
+        super().__init__(**kwargs)
+        self.endpoint_url = endpoint_url
+        self.refresh_credentials = refresh_credentials
+
+    def client(self, service_name, *args, **kwargs):
+        if self.endpoint_url and 'endpoint_url' not in kwargs:
+            kwargs['endpoint_url'] = self.endpoint_url
+        return super().client(service_name, *args, **kwargs)
 
 
+def create_session(region_name=None, role_arn=None, external_id=None, profile=None, api_call_stats=None,
+                   endpoint_url=None, recorder=None):
+    """
+    Creates a boto3 session, optionally from a named profile and/or an assumed role.
+
+    Assumed role credentials are refreshed through STS before they expire, so long
+    running collections are not interrupted.
+
+    Args:
+        region_name (str, optional): The AWS region, defaults to the environment's region.
+        role_arn (str, optional): The ARN of the role to assume.
+        external_id (str, optional): The external ID required by the role's trust policy.
+        profile (str, optional): The named profile providing the (source) credentials.
+        api_call_stats (ApiCallStats, optional): Records the calls of the clients created from the session.
+        endpoint_url (str, optional): The endpoint of the Kafka, CloudWatch and Cost Explorer clients
+                                      created from the session, e.g. 'http://localhost:4566'. STS is
+                                      still called on AWS to assume the role.
+        recorder (ResponseRecorder or ResponseReplayer, optional): Records the responses of the clients
+                                                                   created from the session, or answers
+                                                                   their calls from a recording.
+
+    Returns:
+        boto3.Session: The AWS session.
+    """
+    session = EndpointSession(endpoint_url=endpoint_url, profile_name=profile, region_name=region_name)
+    if not role_arn:
+        if api_call_stats is not None:
+            api_call_stats.register(session.events)
+        if recorder is not None:
+            recorder.register(session.events, session.region_name)
+        return session
+
+    extra_args = {'RoleSessionName': ROLE_SESSION_NAME}
+    if external_id:
+        extra_args['ExternalId'] = external_id
+    fetcher = AssumeRoleCredentialFetcher(
+        client_creator=session._session.create_client,
+        source_credentials=session.get_credentials(),
+        role_arn=role_arn,
+        extra_args=extra_args,
+    )
+    role_session = botocore.session.Session()
+    role_session._credentials = DeferredRefreshableCredentials(
+        method='assume-role', refresh_using=fetcher.fetch_credentials)
+    role_session = EndpointSession(endpoint_url=endpoint_url, refresh_credentials=fetcher.fetch_credentials,
+                                   botocore_session=role_session, region_name=session.region_name)
+    if api_call_stats is not None:
+        api_call_stats.register(role_session.events)
+    if recorder is not None:
+        recorder.register(role_session.events, role_session.region_name)
+    return role_session
+
+
+@profile_stage('discovery')
 def get_msk_clusters(session):
     """
     Retrieves active MSK clusters using the AWS Kafka client.
@@ -38,7 +137,7 @@ def get_msk_clusters(session):
         dict: A dictionary containing active MSK clusters,
               or an empty dictionary if no active clusters are found.
     """
-    kafka_client = session.client('kafka')
+    kafka_client = create_rate_limited_client(session, 'kafka')
     clusters = {}
     paginator = kafka_client.get_paginator('list_clusters_v2')
     for page in paginator.paginate():
@@ -48,12 +147,349 @@ def get_msk_clusters(session):
     return {'msk_running_instances': clusters}
 
 
+def get_broker_nodes(node_infos, details):
+    """
+    Extracts the broker nodes of a PROVISIONED cluster from the NodeInfoList of list_nodes.
+
+    Args:
+        node_infos (list): The NodeInfo objects returned by list_nodes.
+        details (dict): The cluster description returned by list_clusters_v2.
+
+    Returns:
+        list: A {'NodeId', 'InstanceType'} dict per broker node, ordered by broker ID.
+    """
+    default_instance_type = details.get('Provisioned', {}).get('BrokerNodeGroupInfo', {}).get('InstanceType', "N/A")
+    nodes = []
+    for node_info in node_infos:
+        # ZooKeeper and KRaft controller nodes have no broker info
+        if 'BrokerNodeInfo' not in node_info:
+            continue
+        instance_type = node_info.get('InstanceType') or default_instance_type
+        # Same format as the instance type of the broker node group
+        if instance_type != "N/A" and not instance_type.startswith('kafka.'):
+            instance_type = f"kafka.{instance_type}"
+        nodes.append({'NodeId': int(node_info['BrokerNodeInfo']['BrokerId']), 'InstanceType': instance_type})
+    return sorted(nodes, key=lambda node: node['NodeId'])
+
+
+def list_msk_broker_nodes(kafka_client, cluster_id, details, cache=None):
+    """
+    Lists the broker nodes of a PROVISIONED cluster. Their IDs are not necessarily 1 to
+    NumberOfBrokerNodes, e.g. once brokers were removed from the cluster.
+
+    Args:
+        kafka_client (boto3.client): The Kafka client.
+        cluster_id (str): The name of the MSK cluster.
+        details (dict): The cluster description returned by list_clusters_v2.
+        cache (MetricCache, optional): Serves the nodes of the same cluster version when it holds them.
+
+    Returns:
+        list: The broker nodes, see get_broker_nodes, or None if they cannot be listed.
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = build_cache_key({'Operation': 'ListNodes', 'ClusterArn': details['ClusterArn'],
+                                     'CurrentVersion': details.get('CurrentVersion')})
+        nodes = cache.get(cache_key)
+        if nodes is not None:
+            return nodes
+
+    try:
+        paginator = kafka_client.get_paginator('list_nodes')
+        node_infos = [node_info for page in paginator.paginate(ClusterArn=details['ClusterArn'])
+                      for node_info in page.get('NodeInfoList', [])]
+    except Exception as e:
+        print(f"Error listing the nodes of cluster {cluster_id}, assuming broker IDs 1 to "
+              f"{details['Provisioned']['NumberOfBrokerNodes']}: {e}")
+        return None
+    nodes = get_broker_nodes(node_infos, details)
+    if not nodes:
+        return None
+    if cache_key is not None:
+        cache.put(cache_key, nodes)
+    return nodes
+
+
+def get_serverless_topics(metrics, cluster_id):
+    """
+    Extracts the topic names from list_metrics entries of a serverless MSK cluster.
+
+    Args:
+        metrics (list): The 'Metrics' entries of a list_metrics page.
+        cluster_id (str): The name of the MSK Serverless cluster.
+
+    Returns:
+        dict: The topic names found in the 'Topic' dimension of the cluster's metrics,
+              as a set per metric name.
+    """
+    topics = {}
+    for metric in metrics:
+        # A metric entry can have multiple dimensions. We are looking for 'Topic'.
+        has_topic_dimension = False
+        topic_value = None
+        # Verify it's for the correct cluster (list_metrics filter should handle this, but good to be sure)
+        is_correct_cluster = False
+
+        for dim in metric.get('Dimensions', []):
+            if dim['Name'] == SERVERLESS_CLUSTER_DIMENSION and dim['Value'] == cluster_id:
+                is_correct_cluster = True
+            if dim['Name'] == 'Topic':
+                has_topic_dimension = True
+                topic_value = dim['Value']
+
+        if is_correct_cluster and has_topic_dimension and topic_value:
+            topics.setdefault(metric['MetricName'], set()).add(topic_value)
+    return topics
+
+
+def build_serverless_topics_request(cluster_id, recently_active=False):
+    """
+    Builds the list_metrics parameters discovering every metric and topic of a serverless MSK cluster.
+
+    Args:
+        cluster_id (str): The name of the MSK Serverless cluster.
+        recently_active (bool): If True, only list metrics with data in the past three hours.
+                                Faster on large clusters, but skips topics idle for three hours.
+
+    Returns:
+        dict: The keyword arguments for list_metrics.
+    """
+    list_metrics_params = {
+        'Namespace': 'AWS/Kafka',  # MSK Serverless metrics are in this namespace
+        'Dimensions': [{'Name': SERVERLESS_CLUSTER_DIMENSION, 'Value': cluster_id}]
+    }
+    if recently_active:
+        list_metrics_params['RecentlyActive'] = 'PT3H'
+    return list_metrics_params
+
+
+def discover_serverless_topics(cloudwatch_client, cluster_id, recently_active=False):
+    """
+    Discovers the topics of every metric of a serverless MSK cluster in a single list_metrics pass.
+
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        cluster_id (str): The name of the MSK Serverless cluster.
+        recently_active (bool): If True, only list metrics with data in the past three hours.
+
+    Returns:
+        dict: The topic names of the cluster as a set per metric name.
+    """
+    topics = {}
+    paginator = cloudwatch_client.get_paginator('list_metrics')
+    for page in paginator.paginate(**build_serverless_topics_request(cluster_id, recently_active)):
+        for metric_name, metric_topics in get_serverless_topics(page.get('Metrics', []), cluster_id).items():
+            topics.setdefault(metric_name, set()).update(metric_topics)
+    return topics
+
+
+def build_serverless_metric_queries(cluster_id, metric_name, topics, is_peak, time_period=METRIC_COLLECTION_PERIOD_DAYS,
+                                    period=None):
+    """
+    Builds one GetMetricData query per topic of a serverless MSK cluster.
+
+    Args:
+        cluster_id (str): The name of the MSK Serverless cluster.
+        metric_name (str): The name of the metric to collect.
+        topics (set): The topic names of the cluster.
+        is_peak (bool): If True, query the Maximum statistic, otherwise the Average.
+        time_period (int): The number of days in the past to collect metrics for.
+        period (int, optional): The datapoint period in seconds, defaults to the whole time_period.
+
+    Returns:
+        list: The MetricDataQuery objects, ordered by topic name.
+    """
+    # By default the 'Period' for MetricStat covers the entire time_period to get a single aggregated value.
+    # It must be in seconds and a multiple of 60.
+    period = period or int(time_period * 24 * 60 * 60)  # time_period in seconds
+    statistic_to_fetch = 'Maximum' if is_peak else 'Average'
+    metric_data_queries = []
+
+    for i, topic_name in enumerate(sorted(topics)):  # Sort the set for stable unique ID generation
+        # MetricDataQuery Id must start with a lowercase letter and contain only lowercase letters, numbers, and underscore.
+        query_id = f"query_{metric_name.lower().replace('-', '_').replace('.', '_')}_{i}"
+        metric_data_queries.append({
+            'Id': query_id,
+            'MetricStat': {
+                'Metric': {
+                    'Namespace': 'AWS/Kafka',
+                    'MetricName': metric_name,
+                    'Dimensions': [
+                        {'Name': SERVERLESS_CLUSTER_DIMENSION, 'Value': cluster_id},
+                        {'Name': 'Topic', 'Value': topic_name}
+                    ]
+                },
+                'Period': period,
+                'Stat': statistic_to_fetch,
+            },
+            'ReturnData': True,  # We want data back for this query
+        })
+    return metric_data_queries
+
+
+def sum_serverless_metric_results(metric_data_results, batch_queries, is_peak, start_time, end_time):
+    """
+    Sums the per-topic values of a GetMetricData response for a serverless MSK cluster.
+
+    Args:
+        metric_data_results (list): The 'MetricDataResults' of the response.
+        batch_queries (list): The queries sent in the request, used to name topics without data.
+        is_peak (bool): Whether the Maximum or the Average statistic was requested.
+        start_time (datetime): The start of the queried period.
+        end_time (datetime): The end of the queried period.
+
+    Returns:
+        float: The sum of the first value of each topic.
+    """
+    statistic_to_fetch = 'Maximum' if is_peak else 'Average'
+    aggregated_sum_of_metric_values = 0.0
+
+    for result in metric_data_results:
+        if result.get('Values') and len(result['Values']) > 0:
+            # We expect one value because 'Period' covers the whole time range.
+            aggregated_sum_of_metric_values += result['Values'][0]
+        else:
+            # No data found for this specific topic/metric combination in the time range.
+            # This can happen if a topic had no activity for that metric during the period.
+            current_query_id = result['Id']
+            topic_for_result = "Unknown"  # Fallback
+            for q_debug_nd in batch_queries:
+                if q_debug_nd['Id'] == current_query_id:
+                    for dim_nd in q_debug_nd['MetricStat']['Metric']['Dimensions']:
+                        if dim_nd['Name'] == 'Topic':
+                            topic_for_result = dim_nd['Value']
+                            break
+                    break
+            print(
+                f"Info: No data found for QueryId {result['Id']} (Topic: {topic_for_result}, Stat: {statistic_to_fetch}) for period {start_time} to {end_time}.")
+
+    return aggregated_sum_of_metric_values
+
+
+def build_serverless_cache_key(cluster_id, metric_name, is_peak, period, recently_active, start_time, end_time):
+    """
+    Builds the cache key of a serverless MSK cluster metric summed across its topics.
+
+    Args:
+        cluster_id (str): The name of the MSK Serverless cluster.
+        metric_name (str): The name of the metric.
+        is_peak (bool): Whether the topics' Maximum or Average is summed.
+        period (int): The datapoint period in seconds.
+        recently_active (bool): Whether topic discovery is limited to recently active topics.
+        start_time (datetime): The start of the queried window.
+        end_time (datetime): The end of the queried window.
+
+    Returns:
+        str: The cache key.
+    """
+    return build_cache_key({
+        'Metric': {
+            'Namespace': 'AWS/Kafka',
+            'MetricName': metric_name,
+            'Dimensions': [{'Name': SERVERLESS_CLUSTER_DIMENSION, 'Value': cluster_id}],
+        },
+        'Period': period,
+        'Stat': 'Maximum' if is_peak else 'Average',
+        'SumBy': 'Topic',
+        'RecentlyActive': recently_active,
+    }, start_time, end_time)
+
+
+def get_cached_serverless_topics(cloudwatch_client, cluster_id, metric_name, topic_cache=None, recently_active=False):
+    """
+    Returns the topics of a serverless MSK cluster metric, discovering the cluster's topics on first use.
+
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        cluster_id (str): The name of the MSK Serverless cluster.
+        metric_name (str): The name of the metric.
+        topic_cache (dict, optional): discover_serverless_topics results keyed by cluster.
+        recently_active (bool): If True, topic discovery only lists metrics with data in the past three hours.
+
+    Returns:
+        set: The topic names, empty if none are found.
+
+    Raises:
+        botocore.exceptions.ClientError: If discovery fails once retries are exhausted,
+                                         rather than silently summing no topics.
+    """
+    # We list all the metrics of the cluster once, then extract topic names
+    # from the dimensions of the metrics named metric_name.
+    if topic_cache is None:
+        topic_cache = {}
+
+    if cluster_id not in topic_cache:
+        topic_cache[cluster_id] = discover_serverless_topics(cloudwatch_client, cluster_id, recently_active)
+    topics = topic_cache[cluster_id].get(metric_name, set())
+
+    if not topics:
+        print(f"No topics found for cluster {cluster_id} and metric {metric_name} with a 'Topic' dimension.")
+    return topics
+
+
+def get_cloudwatch_serverless_series(cloudwatch_client, cluster_id, metric_name, is_peak,
+                                     time_period=METRIC_COLLECTION_PERIOD_DAYS, topic_cache=None,
+                                     recently_active=False, cache=None, store=None):
+    """
+    Collects the hourly series of a serverless MSK cluster metric, summed hour by hour across its topics.
+
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        cluster_id (str): The name of the MSK Serverless cluster.
+        metric_name (str): The name of the metric to collect.
+        is_peak (bool): If True, sum the topics' hourly Maximum, otherwise their hourly Average.
+        time_period (int): The number of days in the past to collect metrics for.
+        topic_cache (dict, optional): discover_serverless_topics results keyed by cluster.
+        recently_active (bool): If True, topic discovery only lists metrics with data in the past three hours.
+        cache (MetricCache, optional): Serves the summed series without topic discovery when it holds it.
+        store (MetricStore, optional): Incremental state store of the topics' hourly buckets.
+
+    Returns:
+        np.ndarray: The summed hourly series, or None if no topics are found.
+
+    Raises:
+        botocore.exceptions.ClientError: If a call fails once retries are exhausted.
+        RuntimeError: If the datapoints of some topics are incomplete, see check_metric_data_statuses.
+    """
+    cache_key = None
+    if cache is not None:
+        start_time, end_time, _ = get_series_window(time_period)
+        cache_key = build_serverless_cache_key(cluster_id, metric_name, is_peak, AGGREGATION_DURATION_SECONDS,
+                                               recently_active, start_time, end_time)
+        cached_series = cache.get(cache_key)
+        if cached_series is not None:
+            # An empty series is cached for a cluster without topics
+            return np.array(cached_series, dtype=float) if cached_series else None
+
+    topics = get_cached_serverless_topics(cloudwatch_client, cluster_id, metric_name, topic_cache, recently_active)
+    if not topics:
+        if cache_key is not None:
+            cache.put(cache_key, [])
+        return None
+
+    metric_data_queries = build_serverless_metric_queries(cluster_id, metric_name, topics, is_peak, time_period,
+                                                          period=AGGREGATION_DURATION_SECONDS)
+    statuses = {}
+    topic_series = get_cloudwatch_metric_series(cloudwatch_client, metric_data_queries, time_period,
+                                                statuses=statuses, store=store)
+    check_metric_data_statuses(statuses, f"metric {metric_name} of cluster {cluster_id}")
+    series = sum_metric_series(list(topic_series.values()))
+    if cache_key is not None:
+        cache.put(cache_key, series.tolist())
+    return series
+
+
 def get_cloudwatch_serverless_metric(
         cloudwatch_client,
         cluster_id: str,  # For MSK Serverless, this should be the Cluster ARN
         metric_name: str,
         is_peak: bool,
-        time_period: int = METRIC_COLLECTION_PERIOD_DAYS
+        time_period: int = METRIC_COLLECTION_PERIOD_DAYS,
+        topic_cache: dict = None,
+        recently_active: bool = False,
+        hourly: bool = False,
+        cache: MetricCache = None,
+        store: MetricStore = None
 ):
     """
     Collects CloudWatch metrics for a serverless MSK cluster at the topic level
@@ -73,166 +509,172 @@ def get_cloudwatch_serverless_metric(
                  If False, the function sums the average value (Average statistic) of the metric from each topic.
         time_period: The number of days in the past to collect metrics for.
                      Defaults to METRIC_COLLECTION_PERIOD_DAYS (e.g., 7 days).
+        topic_cache: Optional dict of discover_serverless_topics results keyed by cluster, filled on
+                     first use, so that all the metrics of a cluster share a single topic discovery.
+        recently_active: If True, topic discovery only lists metrics with data in the past three hours.
+        hourly: If True, the topics' hourly series are summed hour by hour, and the average or the
+                maximum of the summed series is returned. The peak is then the true cluster peak
+                rather than the sum of each topic's peak.
+        cache: Optional MetricCache. The summed value is served from it without topic discovery
+               when it holds it, and stored in it otherwise.
+        store: Optional MetricStore of the topics' hourly buckets, used in the hourly mode.
 
     Returns:
         A float representing the summed metric value for the cluster.
-        Returns 0.0 if no topics are found, no data is available for any topic, or an error occurs.
+        Returns 0.0 if no topics are found or no data is available for any topic.
+
+    Raises:
+        botocore.exceptions.ClientError: If a call fails once the client's retries are exhausted,
+                                         rather than returning an undercounted partial sum.
+        RuntimeError: If the datapoints of some topics are incomplete, see check_metric_data_statuses.
     """
-    end_time = datetime.now(timezone.utc)
-    start_time = end_time - timedelta(days=time_period)
-    period = int(time_period * 24 * 60 * 60)  # time_period in seconds
+    start_time, end_time = get_metric_window(time_period, cache)
     # end_time = datetime.date.today() + datetime.timedelta(days=1)
     # start_time = end_time - datetime.timedelta(days=time_period)
 
-    # For MSK Serverless, the dimension key for the cluster identifier is 'Cluster Arn'.
-    # The 'cluster_id' parameter is expected to be this ARN.
-    cluster_dimension_key = 'Cluster Name'
-
-    # --- 1. Discover topics by listing metrics for the cluster ---
-    # We list metrics matching the metric_name and cluster_id, then extract topic names
-    # from the dimensions of these metrics.
-    topics = set()
-    paginator = cloudwatch_client.get_paginator('list_metrics')
-
-    try:
-        list_metrics_params = {
-            'Namespace': 'AWS/Kafka',  # MSK Serverless metrics are in this namespace
-            'MetricName': metric_name,
-            'Dimensions': [{'Name': cluster_dimension_key, 'Value': cluster_id}]
-            # 'Dimensions': [{'Name': cluster_dimension_key, 'Value': 'arn:aws:kafka:us-east-1:829250931565:cluster/ohad-serverless/a1bace2f-cab4-4e7c-b0e2-5fafec1ee0ce-s2'}]
-        }
-
-        # print(f"DEBUG: Listing metrics with params: {list_metrics_params}") # Uncomment for debugging
-
-        for page in paginator.paginate(**list_metrics_params):
-            for metric in page.get('Metrics', []):
-                # A metric entry can have multiple dimensions. We are looking for 'Topic'.
-                has_topic_dimension = False
-                topic_value = None
-                # Verify it's for the correct cluster (list_metrics filter should handle this, but good to be sure)
-                is_correct_cluster = False
-
-                for dim in metric.get('Dimensions', []):
-                    if dim['Name'] == cluster_dimension_key and dim['Value'] == cluster_id:
-                        is_correct_cluster = True
-                    if dim['Name'] == 'Topic':
-                        has_topic_dimension = True
-                        topic_value = dim['Value']
-
-                if is_correct_cluster and has_topic_dimension and topic_value:
-                    topics.add(topic_value)
+    if hourly:
+        series = get_cloudwatch_serverless_series(cloudwatch_client, cluster_id, metric_name, is_peak, time_period,
+                                                  topic_cache=topic_cache, recently_active=recently_active,
+                                                  cache=cache, store=store)
+        return reduce_metric_series(series, is_peak) if series is not None else 0.0
 
-    except Exception as e:
-        # More specific error handling (e.g., botocore.exceptions.ClientError) is recommended in production.
-        print(f"Error listing metrics to discover topics for cluster {cluster_id}, metric {metric_name}: {e}")
-        return 0.0
+    cache_key = None
+    if cache is not None:
+        cache_key = build_serverless_cache_key(cluster_id, metric_name, is_peak, int(time_period * 24 * 60 * 60),
+                                               recently_active, start_time, end_time)
+        cached_value = cache.get(cache_key)
+        if cached_value is not None:
+            return cached_value
 
+    # --- 1. Discover topics by listing metrics for the cluster ---
+    topics = get_cached_serverless_topics(cloudwatch_client, cluster_id, metric_name, topic_cache, recently_active)
     if not topics:
-        print(f"No topics found for cluster {cluster_id} and metric {metric_name} with a 'Topic' dimension.")
+        # Cached as well, so that reruns skip the topic discovery
+        if cache_key is not None:
+            cache.put(cache_key, 0.0)
         return 0.0
 
     # print(f"DEBUG: Found topics for cluster {cluster_id}: {topics}") # Uncomment for debugging
 
     # --- 2. Prepare MetricDataQuery for each topic ---
     # We will request a single data point (Average or Maximum) for the entire time_period for each topic.
-    metric_data_queries = []
-
-    # The 'Period' for MetricStat should cover the entire time_period to get a single aggregated value.
-    # It must be in seconds and a multiple of 60.
-    statistic_to_fetch = 'Maximum' if is_peak else 'Average'
-
-    for i, topic_name in enumerate(list(topics)):  # Convert set to list for unique ID generation
-        # MetricDataQuery Id must start with a lowercase letter and contain only lowercase letters, numbers, and underscore.
-        query_id = f"query_{metric_name.lower().replace('-', '_').replace('.', '_')}_{i}"
-        metric_data_queries.append({
-            'Id': query_id,
-            'MetricStat': {
-                'Metric': {
-                    'Namespace': 'AWS/Kafka',
-                    'MetricName': metric_name,
-                    'Dimensions': [
-                        {'Name': cluster_dimension_key, 'Value': cluster_id},
-                        {'Name': 'Topic', 'Value': topic_name}
-                    ]
-                },
-                'Period': period,
-                'Stat': statistic_to_fetch,
-            },
-            'ReturnData': True,  # We want data back for this query
-        })
+    metric_data_queries = build_serverless_metric_queries(cluster_id, metric_name, topics, is_peak, time_period)
 
     if not metric_data_queries:  # Should be caught by "if not topics"
         return 0.0
 
+
     # --- 3. Fetch metric data using GetMetricData ---
     # GetMetricData can handle up to 500 MetricDataQuery objects in a single call.
     # Batching is implemented for robustness if there are many topics.
+    # Throttled calls are retried by the client (see rateLimiter). A batch that still fails
+    # fails the whole metric: a partial sum would silently undercount the cluster.
     aggregated_sum_of_metric_values = 0.0
-    max_queries_per_call = 500
-
-    for i in range(0, len(metric_data_queries), max_queries_per_call):
-        batch_queries = metric_data_queries[i:i + max_queries_per_call]
-        try:
-            # print(f"DEBUG: Calling GetMetricData with StartTime={start_time}, EndTime={end_time}") # Uncomment for debugging
-            # for q_debug in batch_queries: print(f"DEBUG: Query: {q_debug}") # Uncomment for debugging
-
-            response = cloudwatch_client.get_metric_data(
-                MetricDataQueries=batch_queries,
-                StartTime=start_time,
-                EndTime=end_time,
-                ScanBy='TimestampAscending'  # Order doesn't matter much for a single datapoint result
-            )
-
-            # print(f"DEBUG: GetMetricData response: {response}") # Uncomment for debugging
-
-            for result in response.get('MetricDataResults', []):
-                if result.get('Values') and len(result['Values']) > 0:
-                    # We expect one value because 'Period' covers the whole time range.
-                    value_from_topic = result['Values'][0]
-                    aggregated_sum_of_metric_values += value_from_topic
-
-                    # # For detailed debugging of which topic yielded what value:
-                    # current_query_id = result['Id']
-                    # topic_for_result = "Unknown"
-                    # for q_assoc in batch_queries:
-                    #     if q_assoc['Id'] == current_query_id:
-                    #         for dim_assoc in q_assoc['MetricStat']['Metric']['Dimensions']:
-                    #             if dim_assoc['Name'] == 'Topic':
-                    #                 topic_for_result = dim_assoc['Value']
-                    #                 break
-                    #         break
-                    # print(f"DEBUG: Data for QueryId {result['Id']} (Topic: {topic_for_result}, Stat: {statistic_to_fetch}): Value = {value_from_topic}")
 
-                else:
-                    # No data found for this specific topic/metric combination in the time range.
-                    # This can happen if a topic had no activity for that metric during the period.
-                    current_query_id = result['Id']
-                    topic_for_result = "Unknown"  # Fallback
-                    for q_debug_nd in batch_queries:
-                        if q_debug_nd['Id'] == current_query_id:
-                            for dim_nd in q_debug_nd['MetricStat']['Metric']['Dimensions']:
-                                if dim_nd['Name'] == 'Topic':
-                                    topic_for_result = dim_nd['Value']
-                                    break
-                            break
-                    print(
-                        f"Info: No data found for QueryId {result['Id']} (Topic: {topic_for_result}, Stat: {statistic_to_fetch}) for period {start_time} to {end_time}.")
-
-        except Exception as e:  # More specific error handling is better in production
-            print(f"Error during get_metric_data call for a batch: {e}")
-            # Depending on requirements, you might want to:
-            # - Continue and sum whatever data was retrieved.
-            # - Return the partial sum obtained so far.
-            # - Return 0.0 or None to indicate failure.
-            # - Raise the exception.
-            # Current behavior: sums what it can, prints error, continues.
-            # If a call fails, the sum might be incomplete. For critical applications,
-            # consider more robust error handling like retries or returning an error indicator.
+    for i in range(0, len(metric_data_queries), MAX_METRIC_DATA_QUERIES):
+        batch_queries = metric_data_queries[i:i + MAX_METRIC_DATA_QUERIES]
+        # print(f"DEBUG: Calling GetMetricData with StartTime={start_time}, EndTime={end_time}") # Uncomment for debugging
+        # for q_debug in batch_queries: print(f"DEBUG: Query: {q_debug}") # Uncomment for debugging
+
+        # Every page of the batch is read, a topic left with partial data fails the metric
+        metric_data_results = get_metric_data_results(cloudwatch_client, batch_queries, start_time, end_time)
+
+        # print(f"DEBUG: GetMetricData results: {metric_data_results}") # Uncomment for debugging
 
+        check_metric_data_statuses(get_metric_data_statuses(metric_data_results),
+                                   f"metric {metric_name} of cluster {cluster_id}")
+        aggregated_sum_of_metric_values += sum_serverless_metric_results(
+            metric_data_results, batch_queries, is_peak, start_time, end_time)
+
+    if cache_key is not None:
+        cache.put(cache_key, aggregated_sum_of_metric_values)
     return aggregated_sum_of_metric_values
 
 
-def get_cloudwatch_metric(cloudwatch_client, cluster_id, metric_name, is_peak, node, time_period=METRIC_COLLECTION_PERIOD_DAYS):
+def get_cloudwatch_serverless_metrics(cloudwatch_client, cluster_id, metrics, time_period=METRIC_COLLECTION_PERIOD_DAYS,
+                                      recently_active=False, hourly=False, as_series=False, cache=None,
+                                      store=None):
+    """
+    Collects several metrics of a serverless MSK cluster with a single topic discovery.
+
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        cluster_id (str): The name of the MSK Serverless cluster.
+        metrics (list): (metric_name, is_peak) pairs to collect.
+        time_period (int): The number of days in the past to collect metrics for.
+        recently_active (bool): If True, topic discovery only lists metrics with data in the past three hours.
+        hourly (bool): If True, sum the topics' hourly series, see get_cloudwatch_serverless_metric.
+        as_series (bool): If True, return the summed hourly series (or None) rather than values.
+        cache (MetricCache, optional): The response cache.
+        store (MetricStore, optional): The incremental state store of the hourly modes.
+
+    Returns:
+        list: The summed value (or series) of each metric, in the order of `metrics`.
+    """
+    topic_cache = {}
+    if as_series:
+        return [get_cloudwatch_serverless_series(cloudwatch_client, cluster_id, metric_name, is_peak, time_period,
+                                                 topic_cache=topic_cache, recently_active=recently_active,
+                                                 cache=cache, store=store)
+                for metric_name, is_peak in metrics]
+    return [get_cloudwatch_serverless_metric(cloudwatch_client, cluster_id, metric_name, is_peak, time_period,
+                                             topic_cache=topic_cache, recently_active=recently_active,
+                                             hourly=hourly, cache=cache, store=store)
+            for metric_name, is_peak in metrics]
+
+
+def build_serverless_search_query(query_id, cluster_id, metric_name, is_peak, time_period=METRIC_COLLECTION_PERIOD_DAYS,
+                                  period=None):
+    """
+    Builds a GetMetricData query summing a metric over all the topics of a serverless
+    MSK cluster on the CloudWatch side, with a SEARCH expression.
+
+    It returns the same value as get_cloudwatch_serverless_metric without topic discovery
+    or one query per topic. CloudWatch caps the number of time series a SEARCH can match;
+    when the cap is hit the result carries a 'MaxMetricsExceeded' message.
+
+    Args:
+        query_id (str): The query Id, must start with a lowercase letter.
+        cluster_id (str): The name of the MSK Serverless cluster.
+        metric_name (str): The name of the metric to collect.
+        is_peak (bool): If True, sum the Maximum statistic of each topic, otherwise the Average.
+        time_period (int): The number of days in the past to collect metrics for.
+        period (int, optional): The datapoint period in seconds, defaults to the whole time_period.
+
+    Returns:
+        dict: A MetricDataQuery.
+    """
+    period = period or int(time_period * 24 * 60 * 60)
+    statistic = 'Maximum' if is_peak else 'Average'
+    search = (f'{{AWS/Kafka,"{SERVERLESS_CLUSTER_DIMENSION}",Topic}} '
+              f'MetricName="{metric_name}" "{SERVERLESS_CLUSTER_DIMENSION}"="{cluster_id}"')
+    return {
+        'Id': query_id,
+        'Expression': f"SUM(SEARCH('{search}', '{statistic}', {period}))",
+        'ReturnData': True,
+    }
+
+
+def get_broker_metric_dimensions(cluster_id, metric_name, node):
+    """
+    Builds the CloudWatch dimensions for a PROVISIONED cluster metric, at the scope of the
+    metric in the metric catalog: cluster-scoped metrics have no Broker ID dimension, whatever
+    the node.
+
+    Args:
+        cluster_id (str): The name of the MSK cluster.
+        metric_name (str): The name of the CloudWatch metric.
+        node (int, optional): The ID of the broker node, or None for cluster level.
+
+    Returns:
+        list: The dimensions list for the metric.
+    """
+    scope = get_metric_scope(metric_name) if node is not None else CLUSTER_SCOPE
+    return get_scope_dimensions(scope, cluster_id, broker_id=node)
+
+
+def get_cloudwatch_metric(cloudwatch_client, cluster_id, metric_name, is_peak, node, time_period=METRIC_COLLECTION_PERIOD_DAYS,
+                          cache=None):
     """
     Fetches CloudWatch metrics for a given MSK cluster (and optionally node).
 
@@ -243,226 +685,1740 @@ def get_cloudwatch_metric(cloudwatch_client, cluster_id, metric_name, is_peak, n
         is_peak (bool):  If True, retrieve peak value, otherwise retrieve average.
         node (int, optional): The ID of the broker node (for PROVISIONED clusters). Defaults to None.
         time_period (int): The time period in days over which to collect metrics.
+        cache (MetricCache, optional): Serves the value when it holds it, and stores it otherwise.
 
     Returns:
         float: The peak or average value of the metric, or 0 if no data is available.
     """
-    end_time = datetime.now(timezone.utc)
-    start_time = end_time - timedelta(days=time_period)
+    start_time, end_time = get_metric_window(time_period, cache)
 
     # Calculate period dynamically
     period = int(time_period * 24 * 60 * 60)  # time_period in seconds
 
-    dimensions = [{'Name': 'Cluster Name', 'Value': cluster_id}]
-    if node is not None and metric_name != 'GlobalTopicCount':
-        dimensions.append({'Name': 'Broker ID', 'Value': str(node)})
-
     statistics = ['Maximum'] if is_peak else ['Average']
 
+    request = {
+        'Namespace': 'AWS/Kafka',
+        'MetricName': metric_name,
+        'Dimensions': get_broker_metric_dimensions(cluster_id, metric_name, node),
+        'Period': period,
+        'Statistics': statistics,
+    }
+    cache_key = build_cache_key(request, start_time, end_time) if cache is not None else None
+    if cache_key is not None:
+        cached_value = cache.get(cache_key)
+        if cached_value is not None:
+            return cached_value
+
     response = cloudwatch_client.get_metric_statistics(
-        Namespace='AWS/Kafka',
-        MetricName=metric_name,
-        Dimensions=dimensions,
         StartTime=start_time.isoformat(),
         EndTime=end_time.isoformat(),
-        Period=period,
-        Statistics=statistics
+        **request
     )
     # Check for empty Datapoints
     if not response.get('Datapoints'):
-        return 0
-
-    if is_peak:
-        return response['Datapoints'][0]['Maximum']
+        value = 0
+    elif is_peak:
+        value = response['Datapoints'][0]['Maximum']
     else:
-        return response['Datapoints'][0]['Average']
+        value = response['Datapoints'][0]['Average']
 
+    if cache_key is not None:
+        cache.put(cache_key, value)
+    return value
 
-def create_dataframe():
+
+def build_broker_metric_query(query_id, cluster_id, metric_name, is_peak, node, time_period=METRIC_COLLECTION_PERIOD_DAYS,
+                              period=None):
     """
-    Creates an empty Pandas DataFrame with the specified columns.
+    Builds a GetMetricData query equivalent to a get_cloudwatch_metric call.
+
+    Args:
+        query_id (str): The query Id, must start with a lowercase letter.
+        cluster_id (str): The name of the MSK cluster.
+        metric_name (str): The name of the CloudWatch metric to retrieve.
+        is_peak (bool): If True, query the peak value, otherwise the average.
+        node (int, optional): The ID of the broker node.
+        time_period (int): The time period in days over which to collect metrics.
+        period (int, optional): The datapoint period in seconds, defaults to the whole time_period.
 
     Returns:
-        pd.DataFrame: An empty DataFrame with columns for cluster info,
-                      instance info, and metrics.
+        dict: A MetricDataQuery.
     """
-    columns = CLUSTER_INFO.copy()
-    columns += INSTANCE_INFO
-    columns += [f"{metric} (avg)" for metric in AVERAGE_METRICS]
-    columns += [f"{metric} (max)" for metric in PEAK_METRICS]
-    return pd.DataFrame(columns=columns)
-
+    return {
+        'Id': query_id,
+        'MetricStat': {
+            'Metric': {
+                'Namespace': 'AWS/Kafka',
+                'MetricName': metric_name,
+                'Dimensions': get_broker_metric_dimensions(cluster_id, metric_name, node)
+            },
+            'Period': period or int(time_period * 24 * 60 * 60),
+            'Stat': 'Maximum' if is_peak else 'Average',
+        },
+        'ReturnData': True,
+    }
 
 
-def get_msk_cluster_data(session, region):
+def build_broker_insights_query(query_id, cluster_id, metric_name, is_peak, time_period=METRIC_COLLECTION_PERIOD_DAYS,
+                                period=None):
     """
-    Retrieves MSK cluster information and metrics, and organizes it into a Pandas DataFrame.
+    Builds a GetMetricData Metrics Insights query returning a metric of every broker of a
+    PROVISIONED cluster, instead of one build_broker_metric_query per broker.
+
+    The query is grouped by "Broker ID", each series of the result being labelled with its
+    broker ID. Cluster-scoped metrics are not grouped and return a single series.
 
     Args:
-        session (boto3.Session): The AWS session to use.
-        region (str): The AWS region.
+        query_id (str): The query Id, must start with a lowercase letter.
+        cluster_id (str): The name of the MSK cluster.
+        metric_name (str): The name of the CloudWatch metric to retrieve.
+        is_peak (bool): If True, query the peak value (MAX), otherwise the average (AVG).
+        time_period (int): The time period in days over which to collect metrics.
+        period (int, optional): The datapoint period in seconds, defaults to the whole time_period.
 
     Returns:
-        pd.DataFrame: A DataFrame containing MSK cluster data.
+        dict: A MetricDataQuery.
     """
-    cloudwatch_client = session.client('cloudwatch')
-    running_instances = get_msk_clusters(session)['msk_running_instances'] # corrected function call
-    cluster_df = create_dataframe()
-    rows = []
+    function = 'MAX' if is_peak else 'AVG'
+    if get_metric_scope(metric_name) == CLUSTER_SCOPE:
+        schema, group_by = '"AWS/Kafka", "Cluster Name"', ''
+    else:
+        schema, group_by = '"AWS/Kafka", "Cluster Name", "Broker ID"', ' GROUP BY "Broker ID"'
+    return {
+        'Id': query_id,
+        'Expression': (f'SELECT {function}({metric_name}) FROM SCHEMA({schema}) '
+                       f'WHERE "Cluster Name" = \'{cluster_id}\'{group_by}'),
+        'Period': period or int(time_period * 24 * 60 * 60),
+        'Label': BROKER_ID_LABEL,
+        'ReturnData': True,
+    }
+
+
+def get_cloudwatch_insights_values(cloudwatch_client, insights_queries, time_period=METRIC_COLLECTION_PERIOD_DAYS,
+                                   hourly=False, executor=None, cache=None, statuses=None):
+    """
+    Runs Metrics Insights queries through GetMetricData, and returns the value (or the hourly
+    series) of every series of each query.
 
-    for cluster_id, details in running_instances.items():
-        cluster_type = details.get('ClusterType', 'CLUSTERLESS').upper()
-        print(f'Processing cluster account: {cluster_id}')
-        cluster_info_written = False
-        base_info = []
-
-        if not cluster_info_written:
-            auth_string = "N/A"  # Default value
-            az_distribution = "N/A"
-            kafka_version = "N/A"
-            enhanced_monitoring = "N/A"
-            number_of_broker_nodes = 1  # for serverless
-            instance_type = "N/A"
-            volume_size = 0
-
-            # Get the cluster's auth configuration
-            if cluster_type == 'PROVISIONED':
-                auth_config = details['Provisioned']['ClientAuthentication']
-                az_distribution = details['Provisioned']["BrokerNodeGroupInfo"]["BrokerAZDistribution"]
-                if az_distribution == "DEFAULT":
-                    az_distribution = "Multiple AZ"
-                elif az_distribution == "SINGLE":
-                    az_distribution = "Single AZ"
-                kafka_version = details['Provisioned']['CurrentBrokerSoftwareInfo']['KafkaVersion'],
-                enhanced_monitoring = details['Provisioned']['EnhancedMonitoring']
-                number_of_broker_nodes = details['Provisioned']['NumberOfBrokerNodes']
-                instance_type = details.get('Provisioned', {}).get('BrokerNodeGroupInfo', {}).get('InstanceType', "N/A")
-                volume_size =  details.get('Provisioned', {}).get('BrokerNodeGroupInfo', {}).get('StorageInfo', {}).get('EbsStorageInfo', {}).get('VolumeSize', 0)
-            else:
-                auth_config = details['Serverless']['ClientAuthentication']
-                az_distribution = "Multiple AZ"
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        insights_queries (list): The queries to run, see build_broker_insights_query.
+        time_period (int): The time period in days over which to collect metrics.
+        hourly (bool): If True, the queries have an AGGREGATION_DURATION_SECONDS period and their
+                       series are aligned on the grid of get_cloudwatch_metric_series.
+        executor (concurrent.futures.Executor, optional): Runs the batches concurrently when given.
+        cache (MetricCache, optional): Serves the queries it holds, only the others are sent.
+                                       Results of complete queries are stored.
+        statuses (dict, optional): Filled with the StatusCode of each query Id sent, see get_cloudwatch_metric_data.
 
-            # Simplify auth info into a string
-            auth_types = []
-            if auth_config.get('Sasl', {}).get('Iam', {}).get('Enabled'):
-                auth_types.append("SASL/IAM")
-            if auth_config.get('Sasl', {}).get('Scram', {}).get('Enabled'):
-                auth_types.append("SASL/SCRAM")
-            if auth_config.get('Tls', {}).get('Enabled'):
-                auth_types.append("TLS")
-            auth_string = ', '.join(auth_types) if auth_types else "None"
-
-            # Shared info to write only once
-            base_info = [
-                region,
-                cluster_id,
-                az_distribution,
-                auth_string,
-                kafka_version,
-                enhanced_monitoring
-            ]
-        number_of_nodes = number_of_broker_nodes if cluster_type == 'PROVISIONED' else 1
-        for node_id in range(1, number_of_nodes + 1):
-            # Empty version of the same size
-            row = []
-            if cluster_info_written:
-                row += [""] * len(CLUSTER_INFO)
-            else:
-                row += base_info
-                cluster_info_written = True
-
-            row += [
-                node_id,
-                instance_type,
-                volume_size
-            ]
+    Returns:
+        dict: Per query Id, the first value (or a NumPy array per hour, NaN where there is no
+              datapoint) of each series keyed by its label.
+    """
+    if hourly:
+        start_time, end_time, number_of_buckets = get_series_window(time_period)
+    else:
+        start_time, end_time = get_metric_window(time_period, cache)
+    cached_values, insights_queries, cache_keys = get_cached_metric_values(
+        cache, insights_queries, start_time, end_time)
+
+    def fetch_batch(batch_queries):
+        return get_metric_data_results(cloudwatch_client, batch_queries, start_time, end_time)
+
+    batches = [insights_queries[i:i + MAX_METRIC_DATA_QUERIES]
+               for i in range(0, len(insights_queries), MAX_METRIC_DATA_QUERIES)]
+    batch_results = executor.map(fetch_batch, batches) if executor else map(fetch_batch, batches)
+    metric_data_results = [result for results in batch_results for result in results]
+
+    values = {query['Id']: {} for query in insights_queries}
+    for result in metric_data_results:
+        if hourly:
+            series = np.full(number_of_buckets, np.nan)
+            fill_metric_series(series, result, start_time)
+            values[result['Id']][result.get('Label')] = series
+        else:
+            values[result['Id']][result.get('Label')] = result['Values'][0] if result.get('Values') else 0
+
+    query_statuses = get_metric_data_statuses(metric_data_results)
+    if statuses is not None:
+        statuses.update(query_statuses)
+    for query_id, key in cache_keys.items():
+        if query_statuses.get(query_id) == 'Complete':
+            cache.put(key, {label: value.tolist() if hourly else value for label, value in values[query_id].items()})
+    for query_id, label_values in cached_values.items():
+        values[query_id] = {label: np.array(value, dtype=float) if hourly else value
+                            for label, value in label_values.items()}
+    return values
+
+
+def get_cloudwatch_metric_data(cloudwatch_client, metric_data_queries, time_period=METRIC_COLLECTION_PERIOD_DAYS,
+                               executor=None, messages=None, cache=None, statuses=None):
+    """
+    Runs MetricDataQuery objects through GetMetricData in batches of up to
+    MAX_METRIC_DATA_QUERIES and returns the first value of each query.
+
+    Every page of a batch is read, see get_metric_data_results.
 
-            # only works for PROVISIONED
-            if cluster_type == 'PROVISIONED':
-                pass
-                row += [get_cloudwatch_metric(cloudwatch_client, cluster_id, metric, False, node_id) for metric in
-                        AVERAGE_METRICS]
-                row += [get_cloudwatch_metric(cloudwatch_client, cluster_id, metric, True, node_id) for metric in
-                        PEAK_METRICS]
-            else:
-                row += [get_cloudwatch_serverless_metric(cloudwatch_client, cluster_id, metric, False, node_id) for metric in
-                        AVERAGE_METRICS]
-                row += [get_cloudwatch_serverless_metric(cloudwatch_client, cluster_id, metric, True, node_id) for metric in
-                        PEAK_METRICS]
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        metric_data_queries (list): The queries to run, each with a unique Id.
+        time_period (int): The time period in days over which to collect metrics.
+        executor (concurrent.futures.Executor, optional): Runs the batches concurrently when given.
+        messages (dict, optional): Filled with the message codes CloudWatch returned for
+                                   each query Id, e.g. 'MaxMetricsExceeded'.
+        cache (MetricCache, optional): Serves the queries it holds, only the others are sent.
+                                       Values of complete queries without messages are stored.
+        statuses (dict, optional): Filled with the StatusCode of each query Id sent, 'Complete'
+                                   once all its datapoints were returned, see check_metric_data_statuses.
 
-            rows.append(row)
+    Returns:
+        dict: The value of each query keyed by query Id, 0 when there is no data.
+    """
+    start_time, end_time = get_metric_window(time_period, cache)
+    cached_values, metric_data_queries, cache_keys = get_cached_metric_values(
+        cache, metric_data_queries, start_time, end_time)
+
+    def fetch_batch(batch_queries):
+        return get_metric_data_results(cloudwatch_client, batch_queries, start_time, end_time)
+
+    batches = [metric_data_queries[i:i + MAX_METRIC_DATA_QUERIES]
+               for i in range(0, len(metric_data_queries), MAX_METRIC_DATA_QUERIES)]
+    batch_results = executor.map(fetch_batch, batches) if executor else map(fetch_batch, batches)
+    metric_data_results = [result for results in batch_results for result in results]
+
+    query_messages = {}
+    query_statuses = get_metric_data_statuses(metric_data_results)
+    values = get_first_metric_values(metric_data_queries, metric_data_results, query_messages)
+    if messages is not None:
+        messages.update(query_messages)
+    if statuses is not None:
+        statuses.update(query_statuses)
+    for query_id, key in cache_keys.items():
+        if query_id not in query_messages and query_statuses.get(query_id) == 'Complete':
+            cache.put(key, values[query_id])
+    values.update(cached_values)
+    return values
+
+
+def get_first_metric_values(metric_data_queries, metric_data_results, messages=None):
+    """
+    Maps GetMetricData results back to their queries.
 
-    return pd.DataFrame(rows, columns=cluster_df.columns)
+    Args:
+        metric_data_queries (list): The queries that were sent.
+        metric_data_results (iterable): The results of the queries, see get_metric_data_results.
+        messages (dict, optional): Filled with the message codes of each query Id.
 
+    Returns:
+        dict: The first value of each query keyed by query Id, 0 when there is no data.
+    """
+    values = {query['Id']: 0 for query in metric_data_queries}
+    for result in metric_data_results:
+        if result.get('Values'):
+            values[result['Id']] = result['Values'][0]
+        if messages is not None and result.get('Messages'):
+            messages[result['Id']] = [message['Code'] for message in result['Messages']]
+    return values
 
 
-def get_aws_costs(session):
+def get_metric_data_results(cloudwatch_client, metric_data_queries, start_time, end_time):
     """
-    Fetches AWS MSK cost data from Cost Explorer.
+    Runs a batch of MetricDataQuery objects through GetMetricData, following NextToken pagination.
 
     Args:
-        session (boto3.Session): The AWS session to use.
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        metric_data_queries (list): The queries to run, at most MAX_METRIC_DATA_QUERIES.
+        start_time (datetime): The start of the queried window.
+        end_time (datetime): The end of the queried window.
 
     Returns:
-        pd.DataFrame: A DataFrame containing MSK cost data,
-                      or an empty DataFrame on error.
+        list: One result per query Id, see merge_metric_data_pages.
     """
-    try:
-        cost_explorer = session.client('ce')
-        now = datetime.now()
-        start = (now.replace(day=1) - timedelta(days=1)).replace(day=1).strftime('%Y-%m-%d')
-        end = (now.replace(day=1) - timedelta(days=1)).strftime('%Y-%m-%d')
-
-        pricing_data = cost_explorer.get_cost_and_usage(
-            TimePeriod={'Start': start, 'End': end},
-            Granularity='MONTHLY',
-            Filter={
-                "And": [
-                    {"Dimensions": {'Key': 'REGION', 'Values': [session.region_name]}},
-                    {"Dimensions": {'Key': 'SERVICE', 'Values': ['Amazon Managed Streaming for Apache Kafka']}}
-                ]
-            },
-            Metrics=['UnblendedCost'],
-            GroupBy=[{'Type': 'DIMENSION', 'Key': 'USAGE_TYPE'}]
-        )
-
-        data = [
-            {"time_period": res["TimePeriod"]["Start"], "usage_type": group["Keys"][0],
-             "cost": float(group["Metrics"]["UnblendedCost"]["Amount"])}
-            for res in pricing_data['ResultsByTime'] for group in res['Groups']
-        ]
-        cost_df = pd.DataFrame(data)
-        total_cost = cost_df["cost"].sum()
-        total_row = pd.DataFrame([{"time_period": "TOTAL", "usage_type": "ALL", "cost": total_cost}])
-        cost_df = pd.concat([cost_df, total_row], ignore_index=True)
-        return cost_df
+    paginator = cloudwatch_client.get_paginator('get_metric_data')
+    return merge_metric_data_pages(paginator.paginate(
+        MetricDataQueries=metric_data_queries,
+        StartTime=start_time,
+        EndTime=end_time,
+        ScanBy='TimestampAscending'
+    ))
+
+
+def merge_metric_data_pages(pages):
+    """
+    Merges the pages of a GetMetricData call into a single result per query Id.
+
+    A query whose datapoints do not fit in one page has a 'PartialData' result in every page
+    but its last one. Its timestamps, values and messages are concatenated, in page order,
+    and the StatusCode of its last result is kept. Queries returning several series (Metrics
+    Insights queries with a GROUP BY) have a result per series, told apart by their labels.
+
+    Args:
+        pages (iterable): The GetMetricData responses, in NextToken order.
+
+    Returns:
+        list: The merged 'MetricDataResults', in the order the query Ids (and labels) first appear.
+    """
+    results = {}
+    for page in pages:
+        for result in page.get('MetricDataResults', []):
+            merged = results.setdefault((result['Id'], result.get('Label')), {
+                'Id': result['Id'], 'Label': result.get('Label'), 'Timestamps': [], 'Values': [], 'Messages': []})
+            merged['Timestamps'] += result.get('Timestamps', [])
+            merged['Values'] += result.get('Values', [])
+            merged['Messages'] += result.get('Messages', [])
+            merged['StatusCode'] = result.get('StatusCode', 'Complete')
+    return list(results.values())
+
+
+def get_metric_data_statuses(metric_data_results):
+    """
+    Returns the StatusCode of each query of merged GetMetricData results.
+
+    Args:
+        metric_data_results (iterable): The results, see merge_metric_data_pages.
+
+    Returns:
+        dict: 'Complete', 'PartialData', 'InternalError' or 'Forbidden' keyed by query Id, the first
+              status other than 'Complete' for queries with several results.
+    """
+    statuses = {}
+    for result in metric_data_results:
+        if statuses.get(result['Id'], 'Complete') == 'Complete':
+            statuses[result['Id']] = result['StatusCode']
+    return statuses
+
+
+def check_metric_data_statuses(statuses, description):
+    """
+    Raises an error if some queries did not return all their datapoints.
+
+    A query left with 'PartialData' after every page was read, or failed with 'InternalError'
+    or 'Forbidden', would make its value (and any sum it is part of) silently undercounted.
+
+    Args:
+        statuses (dict): The StatusCode of each query Id, see get_metric_data_statuses.
+        description (str): What the queries collect, for the error message.
+
+    Raises:
+        RuntimeError: If the StatusCode of a query is not 'Complete'.
+    """
+    incomplete = {query_id: status for query_id, status in statuses.items() if status != 'Complete'}
+    if incomplete:
+        raise RuntimeError(f"Incomplete GetMetricData results for {description}: "
+                           + ", ".join(f"{query_id} ({status})" for query_id, status in sorted(incomplete.items())))
+
+
+# The time the windows of the account being processed end at, pinned by process_aws_account
+_collection_time = None
+
+
+def get_collection_time():
+    """
+    Returns:
+        datetime: The time the collection windows end at, the time pinned for the account
+                  being processed (that of the interrupted run when it is resumed), or now.
+    """
+    return _collection_time if _collection_time is not None else datetime.now(timezone.utc)
+
+
+def get_metric_window(time_period=METRIC_COLLECTION_PERIOD_DAYS, cache=None):
+    """
+    Returns the window of the whole-period statistics, which ends now (see get_collection_time).
+
+    With a cache the window ends at the last full hour instead, so that runs
+    within the same hour query (and share) the same window.
+
+    Args:
+        time_period (int): The time period in days over which to collect metrics.
+        cache (MetricCache, optional): The response cache in use.
+
+    Returns:
+        tuple: The start time and the end time.
+    """
+    end_time = get_collection_time()
+    if cache is not None:
+        end_time = end_time.replace(minute=0, second=0, microsecond=0)
+    return end_time - timedelta(days=time_period), end_time
+
+
+def get_cached_metric_values(cache, metric_data_queries, start_time, end_time):
+    """
+    Looks up MetricDataQuery objects in a response cache.
+
+    Args:
+        cache (MetricCache, optional): The response cache, or None.
+        metric_data_queries (list): The queries to look up.
+        start_time (datetime): The start of the queried window.
+        end_time (datetime): The end of the queried window.
+
+    Returns:
+        tuple: The cached values keyed by query Id, the queries missing from the cache,
+               and the cache key of each missing query Id.
+    """
+    if cache is None:
+        return {}, metric_data_queries, {}
+
+    cached_values = {}
+    missing_queries = []
+    missing_keys = {}
+    for query in metric_data_queries:
+        key = build_cache_key(query, start_time, end_time)
+        value = cache.get(key)
+        if value is None:
+            missing_queries.append(query)
+            missing_keys[query['Id']] = key
+        else:
+            cached_values[query['Id']] = value
+    return cached_values, missing_queries, missing_keys
+
+
+def get_series_window(time_period=METRIC_COLLECTION_PERIOD_DAYS):
+    """
+    Returns the window of the hourly series, which ends at the last full hour.
+
+    Args:
+        time_period (int): The time period in days over which to collect metrics.
+
+    Returns:
+        tuple: The start time, the end time and the number of AGGREGATION_DURATION_SECONDS buckets.
+    """
+    end_time = get_collection_time().replace(minute=0, second=0, microsecond=0)
+    start_time = end_time - timedelta(days=time_period)
+    number_of_buckets = int((end_time - start_time).total_seconds()) // AGGREGATION_DURATION_SECONDS
+    return start_time, end_time, number_of_buckets
+
+
+def get_cloudwatch_metric_series(cloudwatch_client, metric_data_queries, time_period=METRIC_COLLECTION_PERIOD_DAYS,
+                                 executor=None, messages=None, cache=None, store=None, statuses=None):
+    """
+    Runs hourly MetricDataQuery objects through GetMetricData and aligns their
+    datapoints on a common grid of AGGREGATION_DURATION_SECONDS buckets.
+
+    The window ends at the last full hour. Batches are sized so that a single
+    response usually holds every datapoint of its queries; further pages are
+    read otherwise, see get_metric_data_results.
+
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        metric_data_queries (list): The queries to run, with an AGGREGATION_DURATION_SECONDS period.
+        time_period (int): The time period in days over which to collect metrics.
+        executor (concurrent.futures.Executor, optional): Runs the batches concurrently when given.
+        messages (dict, optional): Filled with the message codes CloudWatch returned for each query Id.
+        cache (MetricCache, optional): Serves the series it holds, only the other queries are sent.
+                                       Series of complete queries without messages are stored.
+        store (MetricStore, optional): Incremental state store. Only the hours after the range
+                                       stored for a query are fetched, the rest of the window is read
+                                       from the store. Buckets of complete queries without messages are stored.
+        statuses (dict, optional): Filled with the StatusCode of each query Id sent, see get_cloudwatch_metric_data.
+
+    Returns:
+        dict: A NumPy array per query Id, one value per hour and NaN where there is no datapoint.
+    """
+    start_time, end_time, number_of_buckets = get_series_window(time_period)
+    cached_series, metric_data_queries, cache_keys = get_cached_metric_values(
+        cache, metric_data_queries, start_time, end_time)
+    window_start, window_end = int(start_time.timestamp()), int(end_time.timestamp())
+
+    series = {query['Id']: np.full(number_of_buckets, np.nan) for query in metric_data_queries}
+    # Queries are grouped by the time they must be fetched from, all of them share
+    # the start of the window without a store.
+    fetch_groups = {}
+    store_keys = {}
+    for query in metric_data_queries:
+        fetch_start = window_start
+        if store is not None:
+            store_keys[query['Id']] = key = build_series_key(query)
+            fetch_start = store.get_fetch_start(key, window_start, window_end)
+            for bucket_time, value in store.load(key, window_start, fetch_start):
+                series[query['Id']][(bucket_time - window_start) // AGGREGATION_DURATION_SECONDS] = value
+        fetch_groups.setdefault(fetch_start, []).append(query)
+
+    batches = []
+    for fetch_start, queries in fetch_groups.items():
+        fetch_buckets = (window_end - fetch_start) // AGGREGATION_DURATION_SECONDS
+        batch_size = max(1, min(MAX_METRIC_DATA_QUERIES, MAX_METRIC_DATA_POINTS // max(1, fetch_buckets)))
+        batches += [(fetch_start, queries[i:i + batch_size]) for i in range(0, len(queries), batch_size)]
+
+    def fetch_batch(batch):
+        fetch_start, batch_queries = batch
+        return get_metric_data_results(cloudwatch_client, batch_queries,
+                                       datetime.fromtimestamp(fetch_start, timezone.utc), end_time)
+
+    batch_results = executor.map(fetch_batch, batches) if executor else map(fetch_batch, batches)
+
+    query_messages = {}
+    query_statuses = {}
+    for results in batch_results:
+        query_statuses.update(get_metric_data_statuses(results))
+        for result in results:
+            if result.get('Messages'):
+                query_messages[result['Id']] = [message['Code'] for message in result['Messages']]
+            fill_metric_series(series[result['Id']], result, start_time)
+
+    if messages is not None:
+        messages.update(query_messages)
+    if statuses is not None:
+        statuses.update(query_statuses)
+    # Incomplete series are neither cached nor stored, the next run fetches them again
+    complete = {query_id for query_id, status in query_statuses.items()
+                if status == 'Complete' and query_id not in query_messages}
+    for query_id, key in cache_keys.items():
+        if query_id in complete:
+            cache.put(key, series[query_id].tolist())
+    for fetch_start, queries in fetch_groups.items():
+        first_bucket = (fetch_start - window_start) // AGGREGATION_DURATION_SECONDS
+        for query in queries:
+            if query['Id'] in store_keys and query['Id'] in complete:
+                fetched = series[query['Id']][first_bucket:]
+                buckets = [(fetch_start + int(index) * AGGREGATION_DURATION_SECONDS, float(fetched[index]))
+                           for index in np.flatnonzero(~np.isnan(fetched))]
+                store.save(store_keys[query['Id']], fetch_start, window_start, window_end, buckets)
+    series.update({query_id: np.array(values, dtype=float) for query_id, values in cached_series.items()})
+    return series
+
+
+def fill_metric_series(series, result, start_time):
+    """
+    Writes the datapoints of a GetMetricData result into an hourly series, those outside it are dropped.
+
+    Args:
+        series (np.ndarray): The series, one value per AGGREGATION_DURATION_SECONDS bucket.
+        result (dict): The merged result of a query, see merge_metric_data_pages.
+        start_time (datetime): The start of the first bucket.
+    """
+    if not result.get('Values'):
+        return
+    timestamps = np.array([timestamp.timestamp() for timestamp in result['Timestamps']])
+    buckets = ((timestamps - start_time.timestamp()) // AGGREGATION_DURATION_SECONDS).astype(int)
+    in_window = (buckets >= 0) & (buckets < len(series))
+    series[buckets[in_window]] = np.asarray(result['Values'], dtype=float)[in_window]
+
+
+def sum_metric_series(series_list):
+    """
+    Sums aligned hourly series, hour by hour.
+
+    Args:
+        series_list (list): NumPy arrays of the same length, NaN where there is no datapoint.
+
+    Returns:
+        np.ndarray: The summed series, NaN for the hours without any datapoint.
+    """
+    stacked = np.vstack(series_list)
+    summed = np.nansum(stacked, axis=0)
+    summed[np.isnan(stacked).all(axis=0)] = np.nan
+    return summed
+
+
+def reduce_metric_series(series, is_peak):
+    """
+    Reduces an hourly series to a single value.
+
+    Args:
+        series (np.ndarray): The hourly series, NaN where there is no datapoint.
+        is_peak (bool): If True, return the maximum, otherwise the average.
+
+    Returns:
+        float: The maximum or average of the series, 0 if it has no datapoints.
+    """
+    if np.isnan(series).all():
+        return 0
+    return float(np.nanmax(series) if is_peak else np.nanmean(series))
+
+
+def compute_series_statistics(series_matrix, start_time):
+    """
+    Computes distribution statistics of hourly series, vectorized over all the rows at once.
+
+    The busy hour is the hour of the day (UTC) with the highest average across the
+    window, its value is that average.
+
+    Args:
+        series_matrix (np.ndarray): One hourly series per row, NaN where there is no datapoint.
+        start_time (datetime): The time of the first hourly bucket.
+
+    Returns:
+        dict: An array of values per statistic in SERIES_STATISTICS, 0 for rows without datapoints.
+    """
+    statistics = {name: np.zeros(len(series_matrix)) for name in SERIES_STATISTICS}
+    has_data = ~np.isnan(series_matrix).all(axis=1)
+    series_matrix = series_matrix[has_data]
+    if not len(series_matrix):
+        return statistics
+
+    percentiles = np.nanpercentile(series_matrix, [50, 90, 95, 99], axis=1)
+    for name, values in zip(['p50', 'p90', 'p95', 'p99'], percentiles):
+        statistics[name][has_data] = values
+    statistics['stddev'][has_data] = np.nanstd(series_matrix, axis=1)
+
+    first_hour = start_time.hour
+    hours_of_day = (first_hour + np.arange(series_matrix.shape[1])) % 24
+    # Average per hour of the day, hours of the day without any datapoint are ignored
+    sums = np.zeros((len(series_matrix), 24))
+    counts = np.zeros((len(series_matrix), 24))
+    np.add.at(sums.T, hours_of_day, np.nan_to_num(series_matrix).T)
+    np.add.at(counts.T, hours_of_day, (~np.isnan(series_matrix)).T)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        profile = np.where(counts > 0, sums / counts, -np.inf)
+    statistics['busy hour'][has_data] = profile.max(axis=1)
+    return statistics
+
+
+def create_dataframe(cluster_peaks=False, series_statistics=False):
+    """
+    Creates an empty Pandas DataFrame with the specified columns.
+
+    Args:
+        cluster_peaks (bool): If True, add the cluster-wide peak columns of the hourly series mode.
+        series_statistics (bool): If True, add the SERIES_STATISTICS columns of the AVERAGE_METRICS.
+
+    Returns:
+        pd.DataFrame: An empty DataFrame with columns for cluster info,
+                      instance info, and metrics.
+    """
+    columns = CLUSTER_INFO.copy()
+    columns += INSTANCE_INFO
+    columns += [f"{metric} (avg)" for metric in AVERAGE_METRICS]
+    columns += [f"{metric} (max)" for metric in PEAK_METRICS]
+    if cluster_peaks:
+        columns += [f"Cluster {metric} (max)" for metric in CLUSTER_PEAK_METRICS]
+    if series_statistics:
+        columns += [f"{metric} ({name})" for metric in AVERAGE_METRICS for name in SERIES_STATISTICS]
+    return pd.DataFrame(columns=columns)
+
+
+
+def build_msk_cluster_rows(region, cluster_id, details, nodes=None):
+    """
+    Builds the DataFrame rows of a single MSK cluster, one per broker node.
+
+    Metric cells are left at 0 and returned separately so that the caller can
+    decide how to fetch them.
+
+    Args:
+        region (str): The AWS region.
+        cluster_id (str): The name of the MSK cluster.
+        details (dict): The cluster description returned by list_clusters_v2.
+        nodes (list, optional): The broker nodes of a PROVISIONED cluster, see list_msk_broker_nodes.
+                                Defaults to broker IDs 1 to NumberOfBrokerNodes.
+
+    Returns:
+        tuple: The rows of the cluster and a list of
+               (row_index, column_index, metric_name, is_peak, node_id) metric cells.
+    """
+    cluster_type = details.get('ClusterType', 'CLUSTERLESS').upper()
+    cluster_info_written = False
+    base_info = []
+    rows = []
+    metric_cells = []
+
+    if not cluster_info_written:
+        auth_string = "N/A"  # Default value
+        az_distribution = "N/A"
+        kafka_version = "N/A"
+        enhanced_monitoring = "N/A"
+        number_of_broker_nodes = 1  # for serverless
+        instance_type = "N/A"
+        volume_size = 0
+
+        # Get the cluster's auth configuration
+        if cluster_type == 'PROVISIONED':
+            auth_config = details['Provisioned']['ClientAuthentication']
+            az_distribution = details['Provisioned']["BrokerNodeGroupInfo"]["BrokerAZDistribution"]
+            if az_distribution == "DEFAULT":
+                az_distribution = "Multiple AZ"
+            elif az_distribution == "SINGLE":
+                az_distribution = "Single AZ"
+            kafka_version = details['Provisioned']['CurrentBrokerSoftwareInfo']['KafkaVersion'],
+            enhanced_monitoring = details['Provisioned']['EnhancedMonitoring']
+            number_of_broker_nodes = details['Provisioned']['NumberOfBrokerNodes']
+            instance_type = details.get('Provisioned', {}).get('BrokerNodeGroupInfo', {}).get('InstanceType', "N/A")
+            volume_size =  details.get('Provisioned', {}).get('BrokerNodeGroupInfo', {}).get('StorageInfo', {}).get('EbsStorageInfo', {}).get('VolumeSize', 0)
+        else:
+            auth_config = details['Serverless']['ClientAuthentication']
+            az_distribution = "Multiple AZ"
+
+        # Simplify auth info into a string
+        auth_types = []
+        if auth_config.get('Sasl', {}).get('Iam', {}).get('Enabled'):
+            auth_types.append("SASL/IAM")
+        if auth_config.get('Sasl', {}).get('Scram', {}).get('Enabled'):
+            auth_types.append("SASL/SCRAM")
+        if auth_config.get('Tls', {}).get('Enabled'):
+            auth_types.append("TLS")
+        auth_string = ', '.join(auth_types) if auth_types else "None"
+
+        # Shared info to write only once
+        base_info = [
+            region,
+            cluster_id,
+            az_distribution,
+            auth_string,
+            kafka_version,
+            enhanced_monitoring
+        ]
+    if cluster_type == 'PROVISIONED' and nodes:
+        broker_nodes = [(node['NodeId'], node['InstanceType']) for node in nodes]
+    else:
+        number_of_nodes = number_of_broker_nodes if cluster_type == 'PROVISIONED' else 1
+        broker_nodes = [(node_id, instance_type) for node_id in range(1, number_of_nodes + 1)]
+    for node_id, node_instance_type in broker_nodes:
+        # Empty version of the same size
+        row = []
+        if cluster_info_written:
+            row += [""] * len(CLUSTER_INFO)
+        else:
+            row += base_info
+            cluster_info_written = True
+
+        # Every broker has an EBS volume of the size of the broker node group
+        row += [
+            node_id,
+            node_instance_type,
+            volume_size
+        ]
+
+        metrics = [(metric, False) for metric in AVERAGE_METRICS] + [(metric, True) for metric in PEAK_METRICS]
+        for metric, is_peak in metrics:
+            metric_cells.append((len(rows), len(row), metric, is_peak, node_id))
+            row.append(0)
+
+        rows.append(row)
+
+    return rows, metric_cells
+
+
+@profile_stage('metrics')
+def plan_msk_cluster(cloudwatch_client, region, cluster_id, details, recently_active_topics=False,
+                     serverless_search=False, hourly=False, cache=None, store=None, metrics_insights=False,
+                     kafka_client=None, nodes=None):
+    """
+    Builds the rows of a single MSK cluster and the GetMetricData queries of its metric cells,
+    to be merged into the query plan of its region, see add_cluster_plan.
+
+    The broker nodes of provisioned clusters are listed here (see list_msk_broker_nodes), and the
+    topics of serverless clusters are discovered here (a single list_metrics pass), unless the
+    cache holds the sums of all their metrics.
+
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        region (str): The AWS region.
+        cluster_id (str): The name of the MSK cluster.
+        details (dict): The cluster description returned by list_clusters_v2.
+        recently_active_topics (bool): See get_msk_cluster_data.
+        serverless_search (bool): See get_msk_cluster_data.
+        hourly (bool): See get_msk_cluster_data.
+        cache (MetricCache, optional): See get_msk_cluster_data.
+        store (MetricStore, optional): See get_msk_cluster_data.
+        metrics_insights (bool): See get_msk_cluster_data.
+        kafka_client (boto3.client, optional): The Kafka client listing the broker nodes. Without it,
+                                               the broker IDs are 1 to NumberOfBrokerNodes.
+        nodes (list, optional): The broker nodes already listed, see list_msk_broker_nodes.
+
+    Returns:
+        dict: The plan of the cluster: its 'type', 'rows' and metric 'cells' (see build_msk_cluster_rows),
+              the 'values' of the (row, column) cells known without a query, the 'metric_queries' and
+              'insights_queries' of the others, the cache key (or None) of the cells summing serverless
+              topics in 'sum_keys', the 'search_metrics' of the SEARCH cells, the number of
+              discovered 'topics' and the broker 'nodes'.
+    """
+    cluster_type = details.get('ClusterType', 'CLUSTERLESS').upper()
+    period = AGGREGATION_DURATION_SECONDS if hourly else None
+    if cluster_type == 'PROVISIONED' and nodes is None and kafka_client is not None:
+        nodes = list_msk_broker_nodes(kafka_client, cluster_id, details, cache=cache)
+    rows, cluster_cells = build_msk_cluster_rows(region, cluster_id, details, nodes)
+    cluster_plan = {'type': cluster_type, 'rows': rows, 'cells': cluster_cells, 'values': {}, 'metric_queries': [],
+                    'insights_queries': [], 'sum_keys': {}, 'search_metrics': {}, 'topics': None, 'nodes': nodes}
+
+    # With Metrics Insights, a query per metric and statistic returns the series of every
+    # broker, labelled with its broker ID. The incremental store keeps per-broker series,
+    # so it still uses per-broker queries.
+    if cluster_type == 'PROVISIONED' and metrics_insights and store is None:
+        for row_index, column_index, metric, is_peak, node_id in cluster_cells:
+            # Cluster-level metrics have a single series, repeated on every broker row
+            label = None if get_metric_scope(metric) == CLUSTER_SCOPE else str(node_id)
+            cluster_plan['insights_queries'].append(
+                (build_broker_insights_query(None, cluster_id, metric, is_peak, period=period),
+                 (row_index, column_index), label))
+    elif cluster_type == 'PROVISIONED':
+        for row_index, column_index, metric, is_peak, node_id in cluster_cells:
+            cluster_plan['metric_queries'].append(
+                (build_broker_metric_query(None, cluster_id, metric, is_peak, node_id, period=period),
+                 (row_index, column_index)))
+    elif serverless_search:
+        for row_index, column_index, metric, is_peak, _ in cluster_cells:
+            cluster_plan['metric_queries'].append(
+                (build_serverless_search_query(None, cluster_id, metric, is_peak, period=period),
+                 (row_index, column_index)))
+            cluster_plan['search_metrics'][(row_index, column_index)] = (metric, is_peak)
+    else:
+        # Serverless sums are the sum of one query per topic, cached as a whole
+        if hourly:
+            start_time, end_time, _ = get_series_window()
+        else:
+            start_time, end_time = get_metric_window(cache=cache)
+        uncached_cells = []
+        for row_index, column_index, metric, is_peak, _ in cluster_cells:
+            cell = (row_index, column_index)
+            key = None
+            if cache is not None:
+                key = build_serverless_cache_key(
+                    cluster_id, metric, is_peak, period or int(METRIC_COLLECTION_PERIOD_DAYS * 24 * 60 * 60),
+                    recently_active_topics, start_time, end_time)
+                value = cache.get(key)
+                if value is not None:
+                    # An empty series is cached for a metric without topics
+                    if not hourly:
+                        cluster_plan['values'][cell] = value
+                    elif value:
+                        cluster_plan['values'][cell] = np.array(value, dtype=float)
+                    continue
+            uncached_cells.append((cell, metric, is_peak, key))
+
+        topics = discover_serverless_topics(cloudwatch_client, cluster_id, recently_active_topics) \
+            if uncached_cells else {}
+        cluster_plan['topics'] = len(set().union(*topics.values())) if topics else 0
+        for cell, metric, is_peak, key in uncached_cells:
+            metric_topics = topics.get(metric, set())
+            if not metric_topics:
+                # Without topics, the sum is 0 (no series in the hourly modes), cached like the other sums
+                if not hourly:
+                    cluster_plan['values'][cell] = 0.0
+                if key is not None:
+                    cache.put(key, [] if hourly else 0.0)
+                continue
+            for query in build_serverless_metric_queries(cluster_id, metric, metric_topics, is_peak, period=period):
+                cluster_plan['metric_queries'].append((query, cell))
+            cluster_plan['sum_keys'][cell] = key
+        missing_metrics = sorted({metric for _, metric, _, _ in uncached_cells if not topics.get(metric)})
+        for metric in missing_metrics:
+            print(f"No topics found for cluster {cluster_id} and metric {metric} with a 'Topic' dimension.")
+    return cluster_plan
+
+
+def create_query_plan():
+    """
+    Returns:
+        dict: An empty query plan: the 'metrics' and Metrics Insights 'insights' MetricQueryPlanner
+              of a region, and the plan of each of its 'clusters' (see plan_msk_cluster).
+    """
+    return {'metrics': MetricQueryPlanner('m'), 'insights': MetricQueryPlanner('q'), 'clusters': {}}
+
+
+def add_cluster_plan(plan, cluster_id, cluster_plan):
+    """
+    Merges the queries of a cluster into the query plan of its region, identical queries sharing an Id.
+
+    The cells of the region planners are (cluster_id, row_index, column_index) tuples, and the
+    (cluster_id, row_index, column_index, label) tuples of the Metrics Insights series.
+
+    Args:
+        plan (dict): The query plan of the region, see create_query_plan.
+        cluster_id (str): The name of the MSK cluster.
+        cluster_plan (dict): The plan of the cluster, see plan_msk_cluster. Its 'query_ids'
+                             are set to the Ids of the queries of each (row, column) cell.
+    """
+    query_ids = {}
+    for query, (row_index, column_index) in cluster_plan['metric_queries']:
+        query_ids.setdefault((row_index, column_index), []).append(
+            plan['metrics'].add(query, (cluster_id, row_index, column_index)))
+    for query, (row_index, column_index), label in cluster_plan['insights_queries']:
+        query_ids.setdefault((row_index, column_index), []).append(
+            plan['insights'].add(query, (cluster_id, row_index, column_index, label)))
+    cluster_plan['query_ids'] = query_ids
+    plan['clusters'][cluster_id] = cluster_plan
+
+
+@profile_stage('metrics')
+def fetch_query_plan(cloudwatch_client, plan, hourly=False, executor=None, cache=None, store=None):
+    """
+    Runs the queries of a query plan, packed into batches of up to MAX_METRIC_DATA_QUERIES.
+
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        plan (dict): The query plan, see create_query_plan.
+        hourly (bool): See get_msk_cluster_data.
+        executor (concurrent.futures.Executor, optional): Runs the batches concurrently when given.
+        cache (MetricCache, optional): See get_msk_cluster_data.
+        store (MetricStore, optional): See get_msk_cluster_data.
+
+    Returns:
+        dict: The 'values' of the (row, column) cells of each cluster, the 'messages' and 'statuses'
+              of each query Id.
+    """
+    messages = {}
+    statuses = {}
+    metric_queries = plan['metrics'].queries
+    if hourly:
+        results = get_cloudwatch_metric_series(cloudwatch_client, metric_queries, executor=executor,
+                                               messages=messages, cache=cache, store=store, statuses=statuses)
+    else:
+        results = get_cloudwatch_metric_data(cloudwatch_client, metric_queries, executor=executor,
+                                             messages=messages, cache=cache, statuses=statuses)
+    insights_results = get_cloudwatch_insights_values(cloudwatch_client, plan['insights'].queries, hourly=hourly,
+                                                      executor=executor, cache=cache, statuses=statuses)
+
+    values = {cluster_id: {} for cluster_id in plan['clusters']}
+    # Cells planned with several queries are the sum of serverless topics
+    combine = sum_metric_series if hourly else sum
+    for (cluster_id, row_index, column_index), value in plan['metrics'].map_values(results, combine).items():
+        values[cluster_id][(row_index, column_index)] = value
+    for query_id, label_values in insights_results.items():
+        for cluster_id, row_index, column_index, label in plan['insights'].cells[query_id]:
+            value = next(iter(label_values.values()), None) if label is None else label_values.get(label)
+            if value is not None:
+                values[cluster_id][(row_index, column_index)] = value
+    return {'values': values, 'messages': messages, 'statuses': statuses}
+
+
+@profile_stage('metrics')
+def assemble_msk_cluster(cloudwatch_client, cluster_id, cluster_plan, fetched, recently_active_topics=False,
+                         hourly=False, series_statistics=False, cache=None, store=None):
+    """
+    Fills the rows of a single MSK cluster with the results of the query plan of its region.
+
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client, for the per-topic fallback of SEARCH totals.
+        cluster_id (str): The name of the MSK cluster.
+        cluster_plan (dict): The plan of the cluster, see add_cluster_plan.
+        fetched (dict): The results of the query plan, see fetch_query_plan.
+        recently_active_topics (bool): See get_msk_cluster_data.
+        hourly (bool): See get_msk_cluster_data.
+        series_statistics (bool): See get_msk_cluster_data.
+        cache (MetricCache, optional): See get_msk_cluster_data.
+        store (MetricStore, optional): See get_msk_cluster_data.
+
+    Returns:
+        tuple: The DataFrame of the cluster, one row per broker, and in the hourly modes a float32
+               matrix of the Average series per AVERAGE_METRICS name (an empty dict otherwise).
+
+    Raises:
+        RuntimeError: If some queries of the cluster are incomplete, see check_metric_data_statuses.
+    """
+    cluster_df = create_dataframe(cluster_peaks=hourly, series_statistics=series_statistics)
+    rows = cluster_plan['rows']
+    messages = fetched['messages']
+    # Values (or hourly series) of each (row, column) cell
+    cell_values = dict(cluster_plan['values'])
+    cell_values.update(fetched['values'][cluster_id])
+
+    # Serverless sums of topics, cached once all their queries are complete
+    for cell, key in cluster_plan['sum_keys'].items():
+        if not hourly:
+            cell_values[cell] = float(cell_values.get(cell, 0))
+        if key is not None and cell in cell_values and all(
+                fetched['statuses'].get(query_id, 'Complete') == 'Complete' and query_id not in messages
+                for query_id in cluster_plan['query_ids'][cell]):
+            cache.put(key, cell_values[cell].tolist() if hourly else cell_values[cell])
+
+    # SEARCH totals that matched too many topics are recomputed per topic
+    fallback_queries = set()
+    fallback_metrics = []
+    for cell, metric in cluster_plan['search_metrics'].items():
+        query_ids = cluster_plan['query_ids'][cell]
+        if any('MaxMetricsExceeded' in messages.get(query_id, []) for query_id in query_ids):
+            fallback_queries.update(query_ids)
+            fallback_metrics.append((cell, metric))
+    if fallback_metrics:
+        print(f"Too many topics for SEARCH on cluster {cluster_id}, falling back to per-topic queries")
+        fallback_cells, metrics = zip(*fallback_metrics)
+        results = get_cloudwatch_serverless_metrics(cloudwatch_client, cluster_id, metrics,
+                                                    recently_active=recently_active_topics, as_series=hourly,
+                                                    cache=cache, store=store)
+        cell_values.update(zip(fallback_cells, results))
+    # Values replaced by the fallback do not need to be complete
+    cluster_query_ids = {query_id for query_ids in cluster_plan['query_ids'].values() for query_id in query_ids}
+    check_metric_data_statuses({query_id: fetched['statuses'][query_id]
+                                for query_id in cluster_query_ids - fallback_queries
+                                if query_id in fetched['statuses']}, f"cluster {cluster_id}")
+
+    if not hourly:
+        for (row_index, column_index), value in cell_values.items():
+            rows[row_index][column_index] = value
+        return pd.DataFrame(rows, columns=cluster_df.columns), {}
+
+    start_time, _, number_of_buckets = get_series_window()
+    empty_series = np.full(number_of_buckets, np.nan)
+    for (row_index, column_index), series in cell_values.items():
+        is_peak = cluster_df.columns[column_index].endswith('(max)')
+        rows[row_index][column_index] = reduce_metric_series(series, is_peak) if series is not None else 0
+
+    # Cluster-wide peaks go on the first row, with the cluster info
+    for metric in CLUSTER_PEAK_METRICS:
+        column_index = cluster_df.columns.get_loc(f"{metric} (max)")
+        series = [cell_values.get((row_index, column_index)) for row_index in range(len(rows))]
+        series = [broker_series for broker_series in series if broker_series is not None]
+        rows[0].append(reduce_metric_series(sum_metric_series(series), True) if series else 0)
+    for row in rows[1:]:
+        row += [""] * len(CLUSTER_PEAK_METRICS)
+
+    average_series = {}
+    for metric in AVERAGE_METRICS:
+        column_index = cluster_df.columns.get_loc(f"{metric} (avg)")
+        # Serverless metrics without topics have no series
+        row_series = [cell_values.get((row_index, column_index)) for row_index in range(len(rows))]
+        average_series[metric] = np.array(
+            [series if series is not None else empty_series for series in row_series]
+        ).reshape(len(rows), number_of_buckets)
+
+    if series_statistics:
+        metric_statistics = {metric: compute_series_statistics(average_series[metric], start_time)
+                             for metric in AVERAGE_METRICS}
+        for row_index, row in enumerate(rows):
+            row += [metric_statistics[metric][name][row_index]
+                    for metric in AVERAGE_METRICS for name in SERIES_STATISTICS]
+
+    average_series = {metric: matrix.astype(np.float32) for metric, matrix in average_series.items()}
+    return pd.DataFrame(rows, columns=cluster_df.columns), average_series
+
+
+def collect_msk_cluster(cloudwatch_client, region, cluster_id, details, recently_active_topics=False,
+                        serverless_search=False, hourly=False, series_statistics=False, cache=None, store=None,
+                        metrics_insights=False, kafka_client=None, nodes=None):
+    """
+    Collects the information and metrics of a single MSK cluster, with a query plan of its own.
+
+    Args:
+        cloudwatch_client (boto3.client): The CloudWatch client.
+        region (str): The AWS region.
+        cluster_id (str): The name of the MSK cluster.
+        details (dict): The cluster description returned by list_clusters_v2.
+        recently_active_topics (bool): See get_msk_cluster_data.
+        serverless_search (bool): See get_msk_cluster_data.
+        hourly (bool): See get_msk_cluster_data.
+        series_statistics (bool): See get_msk_cluster_data.
+        cache (MetricCache, optional): See get_msk_cluster_data.
+        store (MetricStore, optional): See get_msk_cluster_data.
+        metrics_insights (bool): See get_msk_cluster_data.
+        kafka_client (boto3.client, optional): See plan_msk_cluster.
+        nodes (list, optional): See plan_msk_cluster.
+
+    Returns:
+        tuple: The DataFrame and the Average series of the cluster, see assemble_msk_cluster.
+    """
+    plan = create_query_plan()
+    add_cluster_plan(plan, cluster_id, plan_msk_cluster(
+        cloudwatch_client, region, cluster_id, details, recently_active_topics=recently_active_topics,
+        serverless_search=serverless_search, hourly=hourly, cache=cache, store=store,
+        metrics_insights=metrics_insights, kafka_client=kafka_client, nodes=nodes))
+    fetched = fetch_query_plan(cloudwatch_client, plan, hourly=hourly, cache=cache, store=store)
+    return assemble_msk_cluster(cloudwatch_client, cluster_id, plan['clusters'][cluster_id], fetched,
+                                recently_active_topics=recently_active_topics, hourly=hourly,
+                                series_statistics=series_statistics, cache=cache, store=store)
+
+
+def estimate_metric_data_calls(number_of_queries, hourly=False):
+    """
+    Estimates the number of GetMetricData calls of a number of queries, before the cache and pagination.
+
+    Args:
+        number_of_queries (int): The number of queries.
+        hourly (bool): If True, the queries return hourly series, batched as in get_cloudwatch_metric_series.
+
+    Returns:
+        tuple: The number of calls and the number of queries per call.
+    """
+    batch_size = MAX_METRIC_DATA_QUERIES
+    if hourly:
+        _, _, number_of_buckets = get_series_window()
+        batch_size = max(1, min(MAX_METRIC_DATA_QUERIES, MAX_METRIC_DATA_POINTS // max(1, number_of_buckets)))
+    return -(-number_of_queries // batch_size), batch_size
+
+
+def print_query_plan(region, plan, hourly=False):
+    """
+    Prints the query plan of a region and its estimated number of calls, see --explain.
+
+    Args:
+        region (str): The AWS region.
+        plan (dict): The query plan of the region, see create_query_plan.
+        hourly (bool): See get_msk_cluster_data.
+    """
+    print(f"Query plan of region {region} ({len(plan['clusters'])} clusters):")
+    for cluster_id, cluster_plan in plan['clusters'].items():
+        query_ids = {query_id for ids in cluster_plan['query_ids'].values() for query_id in ids}
+        line = (f"  {cluster_id} ({cluster_plan['type']}): {len(cluster_plan['cells'])} metric cells, "
+                f"{len(query_ids)} queries")
+        if cluster_plan['topics'] is not None:
+            line += f", {cluster_plan['topics']} topics"
+        if len(cluster_plan['values']):
+            line += f", {len(cluster_plan['values'])} cells known without a query"
+        print(line)
+
+    calls = 0
+    for name, planner in (('GetMetricData', plan['metrics']), ('Metrics Insights', plan['insights'])):
+        if not planner.requests:
+            continue
+        planner_calls, batch_size = estimate_metric_data_calls(len(planner.queries), hourly)
+        calls += planner_calls
+        statistics = ', '.join(f"{statistic} {count}" for statistic, count in planner.count_statistics().items())
+        print(f"  {name} queries: {planner.planned_cells} planned, {len(planner.queries)} distinct "
+              f"({planner.planned_cells - len(planner.queries)} duplicates) for {len(planner.requests)} "
+              f"metric requests ({statistics}), packed into {planner_calls} batches of up to {batch_size} queries")
+    topic_discoveries = sum(1 for cluster_plan in plan['clusters'].values() if cluster_plan['topics'])
+    node_listings = sum(1 for cluster_plan in plan['clusters'].values() if cluster_plan['type'] == 'PROVISIONED')
+    print(f"  Estimated calls: {calls} GetMetricData (before the cache and pagination), 1 GetCostAndUsage, "
+          f"{node_listings} ListNodes node listings and {topic_discoveries} ListMetrics topic discoveries "
+          f"made while planning")
+
+
+def query_plan_fits(plan, cluster_plan, max_batches, hourly=False):
+    """
+    Checks whether the queries of a cluster fit into a query plan of a bounded number of batches.
+
+    Args:
+        plan (dict): The query plan, see create_query_plan.
+        cluster_plan (dict): The plan of the cluster, see plan_msk_cluster.
+        max_batches (int): The number of GetMetricData batches per planner of the query plan.
+        hourly (bool): See get_msk_cluster_data.
+
+    Returns:
+        bool: True if the plan still has at most max_batches batches per planner with the cluster's queries.
+    """
+    _, batch_size = estimate_metric_data_calls(0, hourly)
+    for planner, queries in ((plan['metrics'], cluster_plan['metric_queries']),
+                             (plan['insights'], cluster_plan['insights_queries'])):
+        if len(planner.queries) + count_distinct_queries([item[0] for item in queries]) > max_batches * batch_size:
+            return False
+    return True
+
+
+def iter_msk_cluster_data(session, region, workers=1, recently_active_topics=False, serverless_search=False,
+                          hourly=False, series_statistics=False, cache=None, store=None, manifest=None,
+                          metrics_insights=False, explain=False, stream=False):
+    """
+    Collects the MSK clusters of a region, yielding each cluster as soon as it is done.
+
+    The queries of all the clusters are planned first (see plan_msk_cluster), merged into a
+    single query plan deduplicating identical queries, and fetched in maximal GetMetricData
+    batches. With `stream`, consecutive clusters are grouped into query plans of at most
+    `workers` batches per planner instead, and the clusters of each group are yielded as soon
+    as it is fetched. The plans, batches and clusters run on a pool of `workers` threads sharing
+    the same (thread-safe) CloudWatch client, and clusters are yielded in the order of the serial
+    run. Clusters that fail are reported and skipped, so that the others are kept; if a plan
+    cannot be fetched, its clusters are collected one by one.
+
+    Args:
+        session (boto3.Session): The AWS session to use.
+        region (str): The AWS region.
+        workers (int): The number of concurrent worker threads.
+        recently_active_topics (bool): See get_msk_cluster_data.
+        serverless_search (bool): See get_msk_cluster_data.
+        hourly (bool): See get_msk_cluster_data.
+        series_statistics (bool): See get_msk_cluster_data.
+        cache (MetricCache, optional): See get_msk_cluster_data.
+        store (MetricStore, optional): See get_msk_cluster_data.
+        manifest (RunManifest, optional): See get_msk_cluster_data.
+        metrics_insights (bool): See get_msk_cluster_data.
+        explain (bool): If True, print the query plan of the region instead of fetching it, nothing is yielded.
+        stream (bool): If True, fetch the clusters in groups rather than the whole region at once, so that
+                       the first clusters are yielded early and the results of a single group are held.
+
+    Yields:
+        tuple: The DataFrame and the Average series of each cluster, see assemble_msk_cluster.
+    """
+    hourly = hourly or series_statistics or store is not None
+    cloudwatch_client = create_rate_limited_client(session, 'cloudwatch')
+    kafka_client = create_rate_limited_client(session, 'kafka')
+    running_instances = get_msk_clusters(session)['msk_running_instances'] # corrected function call
+    plan_options = {'recently_active_topics': recently_active_topics, 'serverless_search': serverless_search,
+                    'hourly': hourly, 'cache': cache, 'store': store, 'metrics_insights': metrics_insights,
+                    'kafka_client': kafka_client}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for cluster_id, details in running_instances.items():
+            completed = manifest.load(get_unit_name(region, cluster_id)) if manifest is not None else None
+            if completed is not None:
+                print(f'Skipping cluster account: {cluster_id} (completed in a previous run)')
+                futures.append((cluster_id, completed))
+                continue
+            print(f'Processing cluster account: {cluster_id}')
+            futures.append((cluster_id, executor.submit(
+                plan_msk_cluster, cloudwatch_client, region, cluster_id, details, **plan_options)))
+
+        def collect_group(plan, group):
+            """
+            Fetches the query plan of a group of clusters and yields them in order.
+            """
+            try:
+                fetched = fetch_query_plan(cloudwatch_client, plan, hourly=hourly, executor=executor, cache=cache,
+                                           store=store)
+            except Exception as e:
+                print(f"Error fetching the query plan of region {region}: {e}, collecting its clusters one by one")
+                fetched = None
+            cluster_futures = {}
+            for cluster_id, cluster_plan in plan['clusters'].items():
+                if fetched is None:
+                    cluster_futures[cluster_id] = executor.submit(
+                        collect_msk_cluster, cloudwatch_client, region, cluster_id, running_instances[cluster_id],
+                        series_statistics=series_statistics, nodes=cluster_plan['nodes'], **plan_options)
+                else:
+                    cluster_futures[cluster_id] = executor.submit(
+                        assemble_msk_cluster, cloudwatch_client, cluster_id, cluster_plan, fetched,
+                        recently_active_topics=recently_active_topics, hourly=hourly,
+                        series_statistics=series_statistics, cache=cache, store=store)
+
+            for cluster_id, completed, error in group:
+                if completed is not None:
+                    yield completed
+                    continue
+                try:
+                    if error is not None:
+                        raise error
+                    result = cluster_futures[cluster_id].result()
+                except Exception as e:
+                    print(f"Error processing cluster {cluster_id}: {e}")
+                    if manifest is not None:
+                        manifest.mark_failed(get_unit_name(region, cluster_id))
+                    continue
+                if manifest is not None:
+                    manifest.save(get_unit_name(region, cluster_id), result)
+                yield result
+
+        # Clusters are merged into the plan in order, so that the plan does not depend on timing
+        plan = create_query_plan()
+        group = []
+        for cluster_id, future in futures:
+            if isinstance(future, tuple):
+                group.append((cluster_id, future, None))
+                continue
+            try:
+                cluster_plan = future.result()
+            except Exception as e:
+                group.append((cluster_id, None, e))
+                continue
+            if stream and plan['clusters'] and not query_plan_fits(plan, cluster_plan, workers, hourly):
+                yield from collect_group(plan, group)
+                plan = create_query_plan()
+                group = []
+            add_cluster_plan(plan, cluster_id, cluster_plan)
+            group.append((cluster_id, None, None))
+        if explain:
+            print_query_plan(region, plan, hourly)
+            return
+        yield from collect_group(plan, group)
+
+
+def get_msk_cluster_data(session, region, workers=1, recently_active_topics=False, serverless_search=False,
+                         hourly=False, series_statistics=False, series_store=None, cache=None, store=None,
+                         manifest=None, metrics_insights=False):
+    """
+    Retrieves MSK cluster information and metrics, and organizes it into a Pandas DataFrame.
+
+    Network calls for the clusters run on a pool of `workers` threads sharing the
+    same (thread-safe) CloudWatch client. Rows keep the order of the serial run.
+
+    Args:
+        session (boto3.Session): The AWS session to use.
+        region (str): The AWS region.
+        workers (int): The number of concurrent worker threads.
+        recently_active_topics (bool): If True, serverless topic discovery only lists
+                                       metrics with data in the past three hours.
+        serverless_search (bool): If True, serverless totals are summed by CloudWatch SEARCH
+                                  expressions, falling back to per-topic queries for clusters
+                                  with too many topics.
+        hourly (bool): If True, metrics are collected as aligned hourly series and reduced
+                       locally. Serverless peaks become true cluster peaks, and cluster-wide
+                       peaks of CLUSTER_PEAK_METRICS summed across brokers are added.
+        series_statistics (bool): If True (implies hourly), add the SERIES_STATISTICS columns
+                                  computed from the hourly Average series of AVERAGE_METRICS.
+        series_store (dict, optional): Filled in the hourly modes with the 'timestamps' of the
+                                       hourly buckets and, per AVERAGE_METRICS name, a float32
+                                       matrix of the Average series with one row per DataFrame row.
+        cache (MetricCache, optional): The on-disk CloudWatch response cache.
+        store (MetricStore, optional): The incremental state store of hourly buckets (implies hourly).
+                                       Averages and peaks are recomputed from the stored buckets,
+                                       and only the hours after the last run are fetched.
+        manifest (RunManifest, optional): The run manifest. Clusters it records as completed are
+                                          read back from it, the others are recorded once collected.
+        metrics_insights (bool): If True, the broker metrics of PROVISIONED clusters are collected
+                                 with a Metrics Insights query per metric and statistic grouped by
+                                 broker, instead of a query per broker. Not used with a store.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing MSK cluster data.
+    """
+    hourly = hourly or series_statistics or store is not None
+    cluster_frames = []
+    series_frames = []
+    for cluster_df, average_series in iter_msk_cluster_data(
+            session, region, workers=workers, recently_active_topics=recently_active_topics,
+            serverless_search=serverless_search, hourly=hourly, series_statistics=series_statistics,
+            cache=cache, store=store, manifest=manifest, metrics_insights=metrics_insights):
+        cluster_frames.append(cluster_df)
+        series_frames.append(average_series)
+
+    cluster_df = create_dataframe(cluster_peaks=hourly, series_statistics=series_statistics)
+    if cluster_frames:
+        cluster_df = pd.concat(cluster_frames, ignore_index=True)
+
+    if hourly and series_store is not None:
+        start_time, _, number_of_buckets = get_series_window()
+        series_store.update(get_series_store(series_frames, start_time, number_of_buckets))
+    return cluster_df
+
+
+def get_series_store(average_series, start_time, number_of_buckets):
+    """
+    Stacks the Average series of several clusters into a series store.
+
+    Args:
+        average_series (list): The Average series of each cluster, see collect_msk_cluster.
+        start_time (datetime): The time of the first hourly bucket.
+        number_of_buckets (int): The number of hourly buckets.
+
+    Returns:
+        dict: The 'timestamps' of the hourly buckets and, per AVERAGE_METRICS name,
+              a float32 matrix with one row per cluster DataFrame row.
+    """
+    series_store = {'timestamps': pd.date_range(start_time, periods=number_of_buckets,
+                                                freq=f"{AGGREGATION_DURATION_SECONDS}s")}
+    for metric in AVERAGE_METRICS:
+        series_store[metric] = np.vstack(
+            [cluster_series[metric] for cluster_series in average_series] or
+            [np.empty((0, number_of_buckets), dtype=np.float32)])
+    return series_store
+
+
+def build_series_dataframe(cluster_df, series_store):
+    """
+    Builds the hourly series export of a cluster DataFrame, one row per broker and metric.
+
+    Args:
+        cluster_df (pd.DataFrame): The DataFrame returned by get_msk_cluster_data.
+        series_store (dict): The series store filled by get_msk_cluster_data.
+
+    Returns:
+        pd.DataFrame: The Region, ClusterName, NodeId and Metric of each series,
+                      followed by one column per hourly bucket.
+    """
+    if not series_store or cluster_df.empty:
+        return pd.DataFrame()
+
+    # Cluster info is only written on the first row of each cluster
+    keys = cluster_df[['Region', 'ClusterName']].replace("", np.nan).ffill()
+    keys['NodeId'] = cluster_df['NodeId']
+    frames = []
+    for metric in AVERAGE_METRICS:
+        values = pd.DataFrame(series_store[metric], columns=series_store['timestamps'].strftime('%Y-%m-%d %H:%M'))
+        frames.append(pd.concat([keys.assign(Metric=metric), values], axis=1))
+    # Group the metrics of each broker together, in the order of the cluster DataFrame
+    return pd.concat(frames).sort_index(kind='stable').reset_index(drop=True)
+
+
+def build_cost_and_usage_request(region):
+    """
+    Builds the Cost Explorer get_cost_and_usage parameters for MSK costs of the previous month.
+
+    Args:
+        region (str): The AWS region.
+
+    Returns:
+        dict: The keyword arguments for get_cost_and_usage.
+    """
+    now = datetime.now()
+    start = (now.replace(day=1) - timedelta(days=1)).replace(day=1).strftime('%Y-%m-%d')
+    end = (now.replace(day=1) - timedelta(days=1)).strftime('%Y-%m-%d')
+
+    return {
+        'TimePeriod': {'Start': start, 'End': end},
+        'Granularity': 'MONTHLY',
+        'Filter': {
+            "And": [
+                {"Dimensions": {'Key': 'REGION', 'Values': [region]}},
+                {"Dimensions": {'Key': 'SERVICE', 'Values': ['Amazon Managed Streaming for Apache Kafka']}}
+            ]
+        },
+        'Metrics': ['UnblendedCost'],
+        'GroupBy': [{'Type': 'DIMENSION', 'Key': 'USAGE_TYPE'}]
+    }
+
+
+def build_cost_dataframe(pricing_data):
+    """
+    Converts a get_cost_and_usage response into a DataFrame with a TOTAL row.
+
+    Args:
+        pricing_data (dict): The get_cost_and_usage response.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing MSK cost data.
+    """
+    data = [
+        {"time_period": res["TimePeriod"]["Start"], "usage_type": group["Keys"][0],
+         "cost": float(group["Metrics"]["UnblendedCost"]["Amount"])}
+        for res in pricing_data['ResultsByTime'] for group in res['Groups']
+    ]
+    cost_df = pd.DataFrame(data)
+    total_cost = cost_df["cost"].sum()
+    total_row = pd.DataFrame([{"time_period": "TOTAL", "usage_type": "ALL", "cost": total_cost}])
+    cost_df = pd.concat([cost_df, total_row], ignore_index=True)
+    return cost_df
+
+
+@profile_stage('costs')
+def get_aws_costs(session):
+    """
+    Fetches AWS MSK cost data from Cost Explorer.
+
+    Args:
+        session (boto3.Session): The AWS session to use.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing MSK cost data,
+                      or an empty DataFrame on error.
+    """
+    try:
+        cost_explorer = create_rate_limited_client(session, 'ce')
+        pricing_data = cost_explorer.get_cost_and_usage(**build_cost_and_usage_request(session.region_name))
+        return build_cost_dataframe(pricing_data)
 
     except Exception as e:
         print(f"Error querying AWS Cost Explorer: {e}")
         return pd.DataFrame()
 
 
+def get_region_costs(session, manifest=None):
+    """
+    Fetches the AWS MSK cost data of a region, or reads it back from a run manifest.
+
+    Args:
+        session (boto3.Session): The AWS session to use, bound to a region.
+        manifest (RunManifest, optional): The run manifest. Non-empty costs are recorded in it.
 
-def process_aws_account(section, output_dir):
+    Returns:
+        pd.DataFrame: A DataFrame containing MSK cost data, see get_aws_costs.
     """
-    Processes MSK metrics and cost data for an AWS account, and saves it to an Excel file.
+    unit = get_unit_name(session.region_name)
+    costs_df = manifest.load(unit) if manifest is not None else None
+    if costs_df is None:
+        costs_df = get_aws_costs(session)
+        # Errors give empty costs, which are fetched again by the next run
+        if manifest is not None and not costs_df.empty:
+            manifest.save(unit, costs_df)
+    return costs_df
+
+
+def collect_region_data(session, workers=1, engine='threads', collect_options=None):
+    """
+    Collects MSK cluster data and cost data for the region of a session.
 
     Args:
-        section (str):  The section/account identifier.
-        output_dir (str): The directory where the Excel file should be saved.
+        session (boto3.Session): The AWS session to use, bound to a region.
+        workers (int): The number of concurrent worker threads,
+                       or the number of in-flight requests for the async engine.
+        engine (str): 'threads' for the boto3 thread pool, 'async' for the aiobotocore event loop.
+        collect_options (dict, optional): Extra keyword arguments for get_msk_cluster_data.
+
+    Returns:
+        tuple: The cluster DataFrame, the costs DataFrame and the hourly series DataFrame,
+               the latter empty unless series statistics are collected.
+    """
+    collect_options = collect_options or {}
+    if engine == 'async':
+        import pullMSKStatsAsync
+        # The async engine does not collect hourly series nor use Metrics Insights, pullStats rejects those options
+        async_options = {key: value for key, value in collect_options.items()
+                         if key not in ('hourly', 'series_statistics', 'metrics_insights')}
+        cluster_df, costs_df = pullMSKStatsAsync.get_account_data(session, concurrency=workers, **async_options)
+        return cluster_df, costs_df, pd.DataFrame()
+
+    series_store = {} if collect_options.get('series_statistics') else None
+    cluster_df = get_msk_cluster_data(session, session.region_name, workers=workers, series_store=series_store,
+                                      **collect_options)
+    costs_df = get_region_costs(session, collect_options.get('manifest'))
+    return cluster_df, costs_df, build_series_dataframe(cluster_df, series_store)
+
+
+def collect_regions_data(regions, workers=1, engine='threads', session_options=None, collect_options=None):
+    """
+    Collects MSK cluster data and cost data for several regions in parallel and merges them.
+
+    Regions that fail are reported and left out of the result.
+
+    Args:
+        regions (list): The AWS regions to collect.
+        workers (int): The number of concurrent worker threads per region,
+                       or the number of in-flight requests for the async engine.
+        engine (str): 'threads' for the boto3 thread pool, 'async' for the aiobotocore event loop.
+        session_options (dict, optional): Keyword arguments for create_session.
+        collect_options (dict, optional): Extra keyword arguments for get_msk_cluster_data.
+
+    Returns:
+        tuple: The cluster DataFrame, the costs DataFrame with a leading 'region' column,
+               and the hourly series DataFrame.
+    """
+    # boto3 sessions are not thread-safe, create them all before fanning out
+    sessions = [create_session(region_name=region, **(session_options or {})) for region in regions]
+    cluster_frames = []
+    costs_frames = []
+    series_frames = []
+
+    with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+        futures = [executor.submit(collect_region_data, session, workers, engine, collect_options) for session in sessions]
+        for region, future in zip(regions, futures):
+            try:
+                cluster_df, costs_df, series_df = future.result()
+            except Exception as e:
+                print(f"Error processing region {region}: {e}")
+                if (collect_options or {}).get('manifest') is not None:
+                    collect_options['manifest'].mark_failed(region)
+                continue
+            cluster_frames.append(cluster_df)
+            series_frames.append(series_df)
+            if not costs_df.empty:
+                costs_frames.append(costs_df.assign(region=region)[['region'] + list(costs_df.columns)])
+
+    cluster_df = pd.concat(cluster_frames, ignore_index=True) if cluster_frames else create_dataframe()
+    costs_df = pd.concat(costs_frames, ignore_index=True) if costs_frames else pd.DataFrame()
+    series_df = pd.concat(series_frames, ignore_index=True) if series_frames else pd.DataFrame()
+    return cluster_df, costs_df, series_df
+
+
+def stream_region_data(session, sink, workers=1, engine='threads', collect_options=None, region_column=False):
+    """
+    Collects MSK cluster data and cost data for the region of a session, writing each
+    cluster to a row sink as soon as it is done.
+
+    Args:
+        session (boto3.Session): The AWS session to use, bound to a region.
+        sink (outputWriters.RowSink): The sink the frames are written to.
+        workers (int): The number of concurrent worker threads,
+                       or the number of in-flight requests for the async engine.
+        engine (str): 'threads' for the boto3 thread pool, 'async' for the aiobotocore event loop.
+                      The async engine collects the whole region before writing it.
+        collect_options (dict, optional): Extra keyword arguments for get_msk_cluster_data.
+        region_column (bool): If True, the costs get a leading 'region' column.
+    """
+    collect_options = collect_options or {}
+    if engine == 'async':
+        cluster_df, costs_df, series_df = collect_region_data(session, workers, engine, collect_options)
+        sink.write('ClusterData', cluster_df)
+        sink.write('HourlySeries', series_df)
+    else:
+        for cluster_df, average_series in iter_msk_cluster_data(session, session.region_name, workers=workers,
+                                                                stream=True, **collect_options):
+            sink.write('ClusterData', cluster_df)
+            if collect_options.get('series_statistics'):
+                start_time, _, number_of_buckets = get_series_window()
+                series_store = get_series_store([average_series], start_time, number_of_buckets)
+                sink.write('HourlySeries', build_series_dataframe(cluster_df, series_store))
+        costs_df = get_region_costs(session, collect_options.get('manifest'))
+
+    if region_column and not costs_df.empty:
+        costs_df = costs_df.assign(region=session.region_name)[['region'] + list(costs_df.columns)]
+    sink.write('Costs', costs_df)
+
+
+def stream_regions_data(regions, sink, workers=1, engine='threads', session_options=None, collect_options=None):
+    """
+    Collects MSK cluster data and cost data for several regions in parallel, writing each
+    cluster to a row sink as soon as it is done.
+
+    Regions that fail are reported, the clusters they already wrote are kept.
+
+    Args:
+        regions (list): The AWS regions to collect.
+        sink (outputWriters.RowSink): The sink the frames are written to.
+        workers (int): The number of concurrent worker threads per region,
+                       or the number of in-flight requests for the async engine.
+        engine (str): 'threads' for the boto3 thread pool, 'async' for the aiobotocore event loop.
+        session_options (dict, optional): Keyword arguments for create_session.
+        collect_options (dict, optional): Extra keyword arguments for get_msk_cluster_data.
+    """
+    # boto3 sessions are not thread-safe, create them all before fanning out
+    sessions = [create_session(region_name=region, **(session_options or {})) for region in regions]
+
+    with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+        futures = [executor.submit(stream_region_data, session, sink, workers, engine, collect_options, True)
+                   for session in sessions]
+        for region, future in zip(regions, futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error processing region {region}: {e}")
+                if (collect_options or {}).get('manifest') is not None:
+                    collect_options['manifest'].mark_failed(region)
+
+
+def resolve_regions(regions, session):
     """
-    print(f'Processing AWS account: {section}')
-    session = boto3.Session()
-    output_file = os.path.join(output_dir, f"{section}-{session.region_name}.xlsx")
-    excel_writer = pd.ExcelWriter(output_file, engine='xlsxwriter')
+    Expands the 'all' keyword of a regions list into the regions where MSK is available.
+
+    Args:
+        regions (list): AWS region names, or ['all'].
+        session (boto3.Session): The AWS session whose partition is used.
 
-    cluster_df = get_msk_cluster_data(session, session.region_name)
-    cluster_df.to_excel(excel_writer=excel_writer, sheet_name='ClusterData', index=False)
+    Returns:
+        list: The AWS regions to collect.
+    """
+    if [region.lower() for region in regions] == ['all']:
+        return session.get_available_regions('kafka')
+    return regions
 
-    costs_df = get_aws_costs(session)
-    if not costs_df.empty:
-        costs_df.to_excel(excel_writer=excel_writer, sheet_name='Costs', index=False)
 
-    excel_writer.close()
-    print(f'Results saved to {output_file}')
+def process_aws_account(section, output_dir, workers=1, engine='threads', regions=None,
+                        role_arn=None, external_id=None, profile=None, collect_options=None, cache_options=None,
+                        state_dir=None, output_format='xlsx', stream=False, resume=False, endpoint_url=None,
+                        record_dir=None, replay_dir=None, explain=False):
+    """
+    Processes MSK metrics and cost data for an AWS account, and saves it to an Excel file
+    (or in another output format, see outputWriters).
 
+    Args:
+        section (str):  The section/account identifier.
+        output_dir (str): The directory where the output should be saved.
+        workers (int): The number of concurrent worker threads used per region,
+                       or the number of in-flight requests for the async engine.
+        engine (str): 'threads' for the boto3 thread pool, 'async' for the aiobotocore event loop.
+        regions (list, optional): The AWS regions to collect in parallel into a single workbook,
+                                  or ['all']. Defaults to the region of the environment.
+        role_arn (str, optional): The ARN of a role to assume in the account.
+        external_id (str, optional): The external ID required to assume the role.
+        profile (str, optional): The named profile to take credentials from.
+        collect_options (dict, optional): Extra keyword arguments for get_msk_cluster_data.
+        cache_options (dict, optional): Keyword arguments for MetricCache. When given, CloudWatch
+                                        responses are served from and stored in the on-disk cache.
+        state_dir (str, optional): The directory of the incremental state store. When given, metrics
+                                   are collected as hourly series and only the hours after the
+                                   previous run are fetched.
+        output_format (str): 'xlsx', 'csv', 'jsonl', 'arrow' or 'parquet', see outputWriters.OUTPUT_FORMATS.
+        stream (bool): If True, each cluster is written as soon as it is done, so that the clusters
+                       collected before a failure are kept. Requires a streaming output format
+                       ('csv', 'jsonl' or 'parquet').
+        resume (bool): If True, resume the previous run of the account from its run manifest in the
+                       CHECKPOINT_DIR_NAME directory of output_dir: an account whose output was written
+                       is skipped, and the clusters and costs it completed are not fetched again.
+        endpoint_url (str, optional): The endpoint of the AWS clients, e.g. that of a local awsEmulator.
+        record_dir (str, optional): The directory where the AWS responses of the account are recorded,
+                                    see responseRecorder.
+        replay_dir (str, optional): The directory of a previous recording, the account's AWS calls are
+                                    answered from it without credentials (the profile, role and endpoint
+                                    are ignored).
+        explain (bool): If True, print the query plan of each region with its estimated number of calls,
+                        without fetching the metrics nor writing any output (nor a run manifest).
+
+    Returns:
+        dict: The statistics of the AWS API calls of the account, see ApiCallStats.to_dict.
+    """
+    global _collection_time
+    manifest = None
+    collection_time = datetime.now(timezone.utc)
+    if not explain:
+        # A resumed run must produce the same output as the interrupted one
+        run_options = {'engine': engine, 'regions': regions, 'role_arn': role_arn, 'profile': profile,
+                       'endpoint_url': endpoint_url, 'collect_options': collect_options, 'state_dir': state_dir,
+                       'output_format': output_format, 'stream': stream, 'replay_dir': replay_dir}
+        window = [(collection_time - timedelta(days=METRIC_COLLECTION_PERIOD_DAYS)).isoformat(),
+                  collection_time.isoformat()]
+        manifest = RunManifest(os.path.join(output_dir, CHECKPOINT_DIR_NAME), section, resume=resume,
+                               options=run_options, window=window)
+        if manifest.is_done():
+            print(f'Skipping AWS account: {section} (completed in a previous run)')
+            return {}
+        # and collects over its window, even once the clock has moved to the next hour
+        if manifest.window:
+            collection_time = datetime.fromisoformat(manifest.window[1])
+    _collection_time = collection_time
+    cache = store = recorder = None
+    try:
+        print(f'Processing AWS account: {section}')
+        api_call_stats = ApiCallStats()
+        collect_options = dict(collect_options or {})
+        # The async engine only checkpoints whole accounts, and creates its own (aiobotocore) sessions
+        if engine == 'threads':
+            if manifest is not None:
+                collect_options['manifest'] = manifest
+        else:
+            collect_options['api_call_stats'] = api_call_stats
+        cache = MetricCache(**cache_options) if cache_options else None
+        if cache is not None:
+            collect_options['cache'] = cache
+        store = MetricStore(state_dir) if state_dir else None
+        if store is not None:
+            collect_options['store'] = store
+        if replay_dir:
+            recorder = ResponseReplayer(get_recording_path(replay_dir, section))
+            role_arn = profile = endpoint_url = None
+        elif record_dir:
+            recorder = ResponseRecorder(get_recording_path(record_dir, section))
+        if recorder is not None and engine != 'threads':
+            collect_options['recorder'] = recorder
+        session_options = {'role_arn': role_arn, 'external_id': external_id, 'profile': profile,
+                           'api_call_stats': api_call_stats, 'endpoint_url': endpoint_url, 'recorder': recorder}
+        session = create_session(**session_options)
+        if regions:
+            regions = resolve_regions(regions, session)
+            region_label = regions[0] if len(regions) == 1 else "multi-region"
+        else:
+            region_label = session.region_name
+
+        if explain:
+            sessions = ([create_session(region_name=region, **session_options) for region in regions] if regions
+                        else [session])
+            for region_session in sessions:
+                for _ in iter_msk_cluster_data(region_session, region_session.region_name, workers=workers,
+                                               explain=True, **collect_options):
+                    pass
+            return api_call_stats.to_dict()
+
+        if stream:
+            metric_columns = list(create_dataframe(cluster_peaks=True, series_statistics=True).columns)
+            metric_columns = metric_columns[len(CLUSTER_INFO) + len(INSTANCE_INFO):]
+            sink = open_sink(output_dir, section, region_label, output_format,
+                             float_columns={'ClusterData': metric_columns})
+            try:
+                if regions:
+                    stream_regions_data(regions, sink, workers=workers, engine=engine,
+                                        session_options=session_options, collect_options=collect_options)
+                else:
+                    stream_region_data(session, sink, workers=workers, engine=engine, collect_options=collect_options)
+            finally:
+                output_files = sink.close()
+                print(f'Results saved to {", ".join(output_files)}')
+            manifest.mark_done(output_files)
+            return api_call_stats.to_dict()
+
+        if regions:
+            cluster_df, costs_df, series_df = collect_regions_data(
+                regions, workers=workers, engine=engine, session_options=session_options,
+                collect_options=collect_options)
+        else:
+            cluster_df, costs_df, series_df = collect_region_data(
+                session, workers=workers, engine=engine, collect_options=collect_options)
+
+        frames = {'ClusterData': cluster_df}
+        if not costs_df.empty:
+            frames['Costs'] = costs_df
+        if not series_df.empty:
+            frames['HourlySeries'] = series_df
+
+        with profile_stage('output'):
+            output_files = write_output(frames, output_dir, section, region_label, output_format)
+        print(f'Results saved to {", ".join(output_files)}')
+        manifest.mark_done(output_files)
+        return api_call_stats.to_dict()
+    finally:
+        _collection_time = None
+        # The cache, state store and recorder are closed even when the account fails
+        close_collect_resources(cache, store, recorder)
+
+
+def close_collect_resources(cache=None, store=None, recorder=None):
+    """
+    Reports on and closes the response cache, the state store and the response recording of an account.
+
+    Args:
+        cache (MetricCache, optional): The response cache.
+        store (MetricStore, optional): The incremental state store.
+        recorder (ResponseRecorder or ResponseReplayer, optional): The response recording.
+    """
+    if cache is not None:
+        print(f'CloudWatch cache: {cache.hits} hits, {cache.misses} misses ({cache.path})')
+        cache.close()
+    if store is not None:
+        store.close()
+    if recorder is not None:
+        recorder.close()
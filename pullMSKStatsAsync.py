@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio collection engine for AWS MSK metrics and cost data.
+
+Runs the same Kafka, CloudWatch and Cost Explorer calls as pullMSKStats as
+coroutines on a single event loop (through aiobotocore), with a semaphore
+bounding the number of in-flight requests. The DataFrames are built by the
+same helpers as pullMSKStats.get_msk_cluster_data and pullMSKStats.get_aws_costs.
+"""
+
+import asyncio
+from botocore.config import Config
+from botocore.credentials import CredentialProvider, RefreshableCredentials
+from contextlib import AsyncExitStack
+from datetime import timedelta
+import pandas as pd
+
+import pullMSKStats
+from metricCatalog import MetricQueryPlanner
+from rateLimiter import MAX_ATTEMPTS, get_client_rate_limiter
+from stageProfiler import profile_stage
+
+try:
+    from aiobotocore.credentials import AioDeferredRefreshableCredentials
+    from aiobotocore.session import get_session
+except ImportError:  # aiobotocore is optional, only needed for the async engine
+    get_session = None
+
+
+class SessionCredentialProvider(CredentialProvider):
+    """
+    Provides an aiobotocore session with the credentials of a boto3 session, refreshed by
+    its refresh_credentials callback (see pullMSKStats.create_session) in a worker thread.
+    """
+    METHOD = 'assume-role'
+
+    def __init__(self, refresh_credentials):
+        """
+        Args:
+            refresh_credentials (callable): Returns the access_key, secret_key, token and expiry_time
+                                            of fresh credentials, e.g. through STS.
+        """
+        super().__init__()
+        self.refresh_credentials = refresh_credentials
+
+    async def load(self):
+        return AioDeferredRefreshableCredentials(refresh_using=lambda: asyncio.to_thread(self.refresh_credentials),
+                                                 method=self.METHOD)
+
+
+def create_async_client(session, service_name, api_call_stats=None, recorder=None):
+    """
+    Creates an aiobotocore client using the credentials and region of a boto3 session.
+
+    Calls are rate limited per operation as in the threads engine (see rateLimiter), and
+    throttled calls are retried with jittered backoff (botocore's 'standard' retry mode),
+    the in-flight requests being bounded by the engine's semaphore. Refreshable credentials
+    of an assumed role are refreshed through STS before they expire, see SessionCredentialProvider;
+    other refreshable credentials are resolved and refreshed by aiobotocore from the same profile.
+
+    Args:
+        session (boto3.Session): The AWS session to take credentials and region from.
+        service_name (str): The AWS service name, e.g. 'cloudwatch'.
+        api_call_stats (ApiCallStats, optional): Records the calls of the client.
+        recorder (ResponseRecorder or ResponseReplayer, optional): Records the responses of the client,
+                                                                   or answers its calls from a recording.
+
+    Returns:
+        An async context manager yielding the client.
+    """
+    if get_session is None:
+        raise RuntimeError("The async engine requires aiobotocore, install it with 'pip3 install aiobotocore'")
+
+    client_kwargs = {
+        'region_name': session.region_name,
+        'config': Config(retries={'mode': 'standard', 'max_attempts': MAX_ATTEMPTS}),
+    }
+    if getattr(session, 'endpoint_url', None):
+        client_kwargs['endpoint_url'] = session.endpoint_url
+    async_session = get_session()
+    refresh_credentials = getattr(session, 'refresh_credentials', None)
+    if refresh_credentials is not None:
+        async_session.get_component('credential_provider').insert_before(
+            'env', SessionCredentialProvider(refresh_credentials))
+    else:
+        credentials = session.get_credentials()
+        if isinstance(credentials, RefreshableCredentials):
+            if session.profile_name != 'default':
+                async_session.set_config_variable('profile', session.profile_name)
+        elif credentials is not None:
+            frozen_credentials = credentials.get_frozen_credentials()
+            async_session.set_credentials(frozen_credentials.access_key, frozen_credentials.secret_key,
+                                          frozen_credentials.token)
+    # The limiter is shared with the other clients of the session for the region and service
+    get_client_rate_limiter(session, session.region_name, service_name).register_async(
+        async_session.get_component('event_emitter'))
+    if api_call_stats is not None:
+        api_call_stats.register(async_session.get_component('event_emitter'))
+    if recorder is not None:
+        recorder.register(async_session.get_component('event_emitter'), session.region_name)
+    return async_session.create_client(service_name, **client_kwargs)
+
+
+async def call(semaphore, operation, **params):
+    """
+    Awaits an aiobotocore operation while holding the concurrency semaphore.
+
+    Args:
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests.
+        operation: The client method to call.
+        **params: The operation parameters.
+
+    Returns:
+        dict: The operation response.
+    """
+    async with semaphore:
+        return await operation(**params)
+
+
+async def paginate(semaphore, operation, **params):
+    """
+    Follows NextToken pagination of an operation, one request at a time.
+
+    Args:
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests.
+        operation: The client method to call.
+        **params: The operation parameters.
+
+    Returns:
+        list: All the response pages.
+    """
+    pages = []
+    while True:
+        page = await call(semaphore, operation, **params)
+        pages.append(page)
+        if not page.get('NextToken'):
+            return pages
+        params['NextToken'] = page['NextToken']
+
+
+async def get_metric_data_results_async(cloudwatch_client, semaphore, metric_data_queries, start_time, end_time):
+    """
+    Async version of pullMSKStats.get_metric_data_results.
+
+    Args:
+        cloudwatch_client: The aiobotocore CloudWatch client.
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests.
+        metric_data_queries (list): The queries to run, at most MAX_METRIC_DATA_QUERIES.
+        start_time (datetime): The start of the queried window.
+        end_time (datetime): The end of the queried window.
+
+    Returns:
+        list: One result per query Id, see pullMSKStats.merge_metric_data_pages.
+    """
+    pages = await paginate(semaphore, cloudwatch_client.get_metric_data,
+                           MetricDataQueries=metric_data_queries,
+                           StartTime=start_time,
+                           EndTime=end_time,
+                           ScanBy='TimestampAscending')
+    return pullMSKStats.merge_metric_data_pages(pages)
+
+
+async def get_msk_clusters_async(kafka_client, semaphore):
+    """
+    Async version of pullMSKStats.get_msk_clusters.
+
+    Args:
+        kafka_client: The aiobotocore Kafka client.
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests.
+
+    Returns:
+        dict: A dictionary containing active MSK clusters.
+    """
+    clusters = {}
+    for page in await paginate(semaphore, kafka_client.list_clusters_v2):
+        for cluster in page['ClusterInfoList']:
+            if cluster['State'] == 'ACTIVE':
+                clusters[cluster['ClusterName']] = cluster
+    return {'msk_running_instances': clusters}
+
+
+async def list_msk_broker_nodes_async(kafka_client, semaphore, cluster_id, details):
+    """
+    Async version of pullMSKStats.list_msk_broker_nodes, without the cache.
+
+    Args:
+        kafka_client: The aiobotocore Kafka client.
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests.
+        cluster_id (str): The name of the MSK cluster.
+        details (dict): The cluster description returned by list_clusters_v2.
+
+    Returns:
+        list: The broker nodes, see pullMSKStats.get_broker_nodes, or None if they cannot be listed.
+    """
+    try:
+        pages = await paginate(semaphore, kafka_client.list_nodes, ClusterArn=details['ClusterArn'])
+    except Exception as e:
+        print(f"Error listing the nodes of cluster {cluster_id}, assuming broker IDs 1 to "
+              f"{details['Provisioned']['NumberOfBrokerNodes']}: {e}")
+        return None
+    node_infos = [node_info for page in pages for node_info in page.get('NodeInfoList', [])]
+    return pullMSKStats.get_broker_nodes(node_infos, details) or None
+
+
+async def discover_serverless_topics_async(cloudwatch_client, semaphore, cluster_id, recently_active=False):
+    """
+    Async version of pullMSKStats.discover_serverless_topics.
+
+    Args:
+        cloudwatch_client: The aiobotocore CloudWatch client.
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests.
+        cluster_id (str): The name of the MSK Serverless cluster.
+        recently_active (bool): If True, only list metrics with data in the past three hours.
+
+    Returns:
+        dict: The topic names of the cluster as a set per metric name.
+    """
+    topics = {}
+    pages = await paginate(semaphore, cloudwatch_client.list_metrics,
+                           **pullMSKStats.build_serverless_topics_request(cluster_id, recently_active))
+    for page in pages:
+        for metric_name, metric_topics in pullMSKStats.get_serverless_topics(page.get('Metrics', []), cluster_id).items():
+            topics.setdefault(metric_name, set()).update(metric_topics)
+    return topics
+
+
+async def get_cloudwatch_serverless_metric_async(
+        cloudwatch_client,
+        semaphore,
+        cluster_id,
+        metric_name,
+        is_peak,
+        time_period=pullMSKStats.METRIC_COLLECTION_PERIOD_DAYS,
+        topics_task=None
+):
+    """
+    Async version of pullMSKStats.get_cloudwatch_serverless_metric.
+
+    Args:
+        cloudwatch_client: The aiobotocore CloudWatch client.
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests.
+        cluster_id (str): The name of the MSK Serverless cluster.
+        metric_name (str): The name of the metric to collect.
+        is_peak (bool): If True, sums the Maximum statistic of each topic, otherwise the Average.
+        time_period (int): The number of days in the past to collect metrics for.
+        topics_task (asyncio.Task, optional): A discover_serverless_topics_async task shared by
+                                              the metrics of the cluster.
+
+    Returns:
+        float: The summed metric value for the cluster, 0.0 if no data is available.
+    """
+    end_time = pullMSKStats.get_collection_time()
+    start_time = end_time - timedelta(days=time_period)
+
+    # Failed calls (once retries are exhausted) are raised rather than summed as 0
+    if topics_task is None:
+        topics_task = asyncio.ensure_future(
+            discover_serverless_topics_async(cloudwatch_client, semaphore, cluster_id))
+    topics = (await topics_task).get(metric_name, set())
+
+    if not topics:
+        print(f"No topics found for cluster {cluster_id} and metric {metric_name} with a 'Topic' dimension.")
+        return 0.0
+
+    metric_data_queries = pullMSKStats.build_serverless_metric_queries(
+        cluster_id, metric_name, topics, is_peak, time_period)
+
+    async def fetch_batch(batch_queries):
+        metric_data_results = await get_metric_data_results_async(
+            cloudwatch_client, semaphore, batch_queries, start_time, end_time)
+        pullMSKStats.check_metric_data_statuses(pullMSKStats.get_metric_data_statuses(metric_data_results),
+                                                f"metric {metric_name} of cluster {cluster_id}")
+        return pullMSKStats.sum_serverless_metric_results(
+            metric_data_results, batch_queries, is_peak, start_time, end_time)
+
+    batch_size = pullMSKStats.MAX_METRIC_DATA_QUERIES
+    batch_sums = await asyncio.gather(*[
+        fetch_batch(metric_data_queries[i:i + batch_size])
+        for i in range(0, len(metric_data_queries), batch_size)
+    ])
+    # Add the batch sums in order, as the serial implementation does
+    aggregated_sum_of_metric_values = 0.0
+    for batch_sum in batch_sums:
+        aggregated_sum_of_metric_values += batch_sum
+    return aggregated_sum_of_metric_values
+
+
+async def get_cloudwatch_metric_data_async(
+        cloudwatch_client,
+        semaphore,
+        metric_data_queries,
+        time_period=pullMSKStats.METRIC_COLLECTION_PERIOD_DAYS,
+        messages=None,
+        statuses=None
+):
+    """
+    Async version of pullMSKStats.get_cloudwatch_metric_data, all batches run concurrently.
+
+    Args:
+        cloudwatch_client: The aiobotocore CloudWatch client.
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests.
+        metric_data_queries (list): The queries to run, each with a unique Id.
+        time_period (int): The time period in days over which to collect metrics.
+        messages (dict, optional): Filled with the message codes CloudWatch returned for each query Id.
+        statuses (dict, optional): Filled with the StatusCode of each query Id.
+
+    Returns:
+        dict: The value of each query keyed by query Id, 0 when there is no data.
+    """
+    end_time = pullMSKStats.get_collection_time()
+    start_time = end_time - timedelta(days=time_period)
+
+    batch_size = pullMSKStats.MAX_METRIC_DATA_QUERIES
+    batch_results = await asyncio.gather(*[
+        get_metric_data_results_async(
+            cloudwatch_client, semaphore, metric_data_queries[i:i + batch_size], start_time, end_time)
+        for i in range(0, len(metric_data_queries), batch_size)
+    ])
+    metric_data_results = [result for results in batch_results for result in results]
+    if statuses is not None:
+        statuses.update(pullMSKStats.get_metric_data_statuses(metric_data_results))
+    return pullMSKStats.get_first_metric_values(metric_data_queries, metric_data_results, messages)
+
+
+async def get_msk_cluster_data_async(kafka_client, cloudwatch_client, semaphore, region,
+                                     recently_active_topics=False, serverless_search=False):
+    """
+    Async version of pullMSKStats.get_msk_cluster_data.
+
+    Args:
+        kafka_client: The aiobotocore Kafka client.
+        cloudwatch_client: The aiobotocore CloudWatch client.
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests.
+        region (str): The AWS region.
+        recently_active_topics (bool): If True, serverless topic discovery only lists
+                                       metrics with data in the past three hours.
+        serverless_search (bool): If True, serverless totals are summed by CloudWatch SEARCH
+                                  expressions, falling back to per-topic queries for clusters
+                                  with too many topics.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing MSK cluster data.
+    """
+    running_instances = (await get_msk_clusters_async(kafka_client, semaphore))['msk_running_instances']
+    # The broker nodes of the provisioned clusters are listed concurrently
+    provisioned_clusters = [(cluster_id, details) for cluster_id, details in running_instances.items()
+                            if details.get('ClusterType', 'CLUSTERLESS').upper() == 'PROVISIONED']
+    cluster_nodes = dict(zip([cluster_id for cluster_id, _ in provisioned_clusters], await asyncio.gather(*[
+        list_msk_broker_nodes_async(kafka_client, semaphore, cluster_id, details)
+        for cluster_id, details in provisioned_clusters])))
+    cluster_df = pullMSKStats.create_dataframe()
+    rows = []
+    # Identical queries of the region share an Id, mapping back to all their cells
+    planner = MetricQueryPlanner()
+    search_metrics = {}
+    serverless_cells = []
+    serverless_tasks = []
+
+    for cluster_id, details in running_instances.items():
+        cluster_type = details.get('ClusterType', 'CLUSTERLESS').upper()
+        print(f'Processing cluster account: {cluster_id}')
+        cluster_rows, cluster_cells = pullMSKStats.build_msk_cluster_rows(region, cluster_id, details,
+                                                                          cluster_nodes.get(cluster_id))
+        if cluster_type != 'PROVISIONED' and not serverless_search:
+            # A single topic discovery shared by all the metrics of the cluster
+            topics_task = asyncio.ensure_future(discover_serverless_topics_async(
+                cloudwatch_client, semaphore, cluster_id, recently_active_topics))
+
+        for row_index, column_index, metric, is_peak, node_id in cluster_cells:
+            cell = (len(rows) + row_index, column_index)
+            if cluster_type == 'PROVISIONED':
+                planner.add(pullMSKStats.build_broker_metric_query(None, cluster_id, metric, is_peak, node_id), cell)
+            elif serverless_search:
+                query_id = planner.add(pullMSKStats.build_serverless_search_query(None, cluster_id, metric, is_peak),
+                                       cell)
+                search_metrics[query_id] = (cluster_id, metric, is_peak)
+            else:
+                serverless_cells.append(cell)
+                serverless_tasks.append(get_cloudwatch_serverless_metric_async(
+                    cloudwatch_client, semaphore, cluster_id, metric, is_peak, topics_task=topics_task))
+        rows += cluster_rows
+
+    messages = {}
+    statuses = {}
+    metric_values, serverless_values = await asyncio.gather(
+        get_cloudwatch_metric_data_async(cloudwatch_client, semaphore, planner.queries, messages=messages,
+                                         statuses=statuses),
+        asyncio.gather(*serverless_tasks)
+    )
+    for (row_index, column_index), value in planner.map_values(metric_values).items():
+        rows[row_index][column_index] = value
+
+    # SEARCH totals that matched too many topics are recomputed per topic
+    fallback_cells = []
+    fallback_tasks = []
+    topics_tasks = {}
+    for query_id, (cluster_id, metric, is_peak) in search_metrics.items():
+        if 'MaxMetricsExceeded' in messages.get(query_id, []):
+            if cluster_id not in topics_tasks:
+                print(f"Too many topics for SEARCH on cluster {cluster_id}, falling back to per-topic queries")
+                topics_tasks[cluster_id] = asyncio.ensure_future(discover_serverless_topics_async(
+                    cloudwatch_client, semaphore, cluster_id, recently_active_topics))
+            for cell in planner.cells[query_id]:
+                fallback_cells.append(cell)
+                fallback_tasks.append(get_cloudwatch_serverless_metric_async(
+                    cloudwatch_client, semaphore, cluster_id, metric, is_peak, topics_task=topics_tasks[cluster_id]))
+    serverless_cells += fallback_cells
+    serverless_values += await asyncio.gather(*fallback_tasks)
+    # Values replaced by the fallback do not need to be complete
+    pullMSKStats.check_metric_data_statuses({query_id: status for query_id, status in statuses.items()
+                                             if 'MaxMetricsExceeded' not in messages.get(query_id, [])},
+                                            f"region {region}")
+    for (row_index, column_index), value in zip(serverless_cells, serverless_values):
+        rows[row_index][column_index] = value
+
+    return pd.DataFrame(rows, columns=cluster_df.columns)
+
+
+async def get_aws_costs_async(cost_explorer, semaphore, region):
+    """
+    Async version of pullMSKStats.get_aws_costs.
+
+    Args:
+        cost_explorer: The aiobotocore Cost Explorer client.
+        semaphore (asyncio.Semaphore): Bounds the number of in-flight requests.
+        region (str): The AWS region.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing MSK cost data, or an empty DataFrame on error.
+    """
+    try:
+        pricing_data = await call(
+            semaphore, cost_explorer.get_cost_and_usage, **pullMSKStats.build_cost_and_usage_request(region))
+        return pullMSKStats.build_cost_dataframe(pricing_data)
+
+    except Exception as e:
+        print(f"Error querying AWS Cost Explorer: {e}")
+        return pd.DataFrame()
+
+
+async def collect_account_data(session, concurrency, api_call_stats=None, recorder=None, **collect_options):
+    """
+    Collects the MSK cluster data and costs of a session's region concurrently.
+
+    Args:
+        session (boto3.Session): The AWS session to take credentials and region from.
+        concurrency (int): The maximum number of in-flight requests.
+        api_call_stats (ApiCallStats, optional): Records the calls of the clients.
+        recorder (ResponseRecorder or ResponseReplayer, optional): Records the responses of the clients,
+                                                                   or answers their calls from a recording.
+        **collect_options: Extra keyword arguments for get_msk_cluster_data_async.
+
+    Returns:
+        tuple: The cluster DataFrame and the costs DataFrame.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    async with AsyncExitStack() as stack:
+        kafka_client = await stack.enter_async_context(create_async_client(
+            session, 'kafka', api_call_stats, recorder))
+        cloudwatch_client = await stack.enter_async_context(create_async_client(
+            session, 'cloudwatch', api_call_stats, recorder))
+        cost_explorer = await stack.enter_async_context(create_async_client(
+            session, 'ce', api_call_stats, recorder))
+        return await asyncio.gather(
+            get_msk_cluster_data_async(kafka_client, cloudwatch_client, semaphore, session.region_name,
+                                       **collect_options),
+            get_aws_costs_async(cost_explorer, semaphore, session.region_name)
+        )
+
+
+@profile_stage('async collection')
+def get_account_data(session, concurrency, **collect_options):
+    """
+    Runs collect_account_data on a new event loop.
+
+    Args:
+        session (boto3.Session): The AWS session to take credentials and region from.
+        concurrency (int): The maximum number of in-flight requests.
+        **collect_options: Extra keyword arguments for get_msk_cluster_data_async.
+
+    Returns:
+        tuple: The cluster DataFrame and the costs DataFrame.
+    """
+    return tuple(asyncio.run(collect_account_data(session, concurrency, **collect_options)))
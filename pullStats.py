@@ -6,10 +6,16 @@ Usage:
 """
 
 import configparser
+import cProfile
 import os
 import sys
+import time
 import pullMSKStats
+from apiCallStats import ApiCallStats
+from outputWriters import OUTPUT_FORMATS, STREAMING_FORMATS, require_pyarrow
+from stageProfiler import PROFILER
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 
 def main():
@@ -17,7 +23,77 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("config_file", help="Path to configuration file", metavar="FILE")
     parser.add_argument("output_dir", default=".", help="Output directory", nargs='?', metavar="PATH")
+    parser.add_argument("--workers", type=int, default=1, help="Number of clusters processed concurrently "
+                        "(number of in-flight requests with --engine async)", metavar="N")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads",
+                        help="Collection engine, 'async' requires aiobotocore")
+    parser.add_argument("--recently-active-topics", action="store_true",
+                        help="Only discover MSK Serverless topics with metrics in the past three hours")
+    parser.add_argument("--serverless-search", action="store_true",
+                        help="Sum MSK Serverless topic metrics with CloudWatch SEARCH expressions")
+    parser.add_argument("--metrics-insights", action="store_true",
+                        help="Collect the broker metrics of provisioned clusters with one CloudWatch Metrics Insights "
+                        "query per metric grouped by broker, instead of one query per broker")
+    parser.add_argument("--hourly-series", action="store_true",
+                        help="Collect aligned hourly series to compute true cluster-wide peaks")
+    parser.add_argument("--series-stats", action="store_true",
+                        help="Add p50/p90/p95/p99, stddev and busy-hour columns computed from the hourly "
+                        "series, and export the series to an HourlySeries sheet (implies --hourly-series)")
+    parser.add_argument("--processes", type=int, default=1, help="Number of accounts (config sections) "
+                        "processed in parallel worker processes", metavar="N")
+    parser.add_argument("--cache-dir", help="Directory of an on-disk cache of CloudWatch responses, "
+                        "reused by runs over the same hour-aligned window", metavar="PATH")
+    parser.add_argument("--cache-ttl", type=float, default=24, help="Hours after which cached responses expire "
+                        "(default: 24)", metavar="HOURS")
+    parser.add_argument("--cache-max-size", type=int, default=512, help="Size in MB above which the least "
+                        "recently used cached responses are evicted (default: 512)", metavar="MB")
+    parser.add_argument("--incremental", help="Directory of a local store of hourly buckets: only the hours after "
+                        "the previous run are fetched, averages and peaks are recomputed from the stored buckets "
+                        "(implies --hourly-series)", metavar="PATH")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="xlsx", dest="output_format",
+                        help="Output format: an Excel workbook (default), CSV or Arrow files, "
+                        "or Parquet datasets partitioned by account and region (arrow and parquet require pyarrow)")
+    parser.add_argument("--stream", action="store_true", help="Write each cluster as soon as it is done, keeping "
+                        "the clusters collected before a failure (requires --format csv, jsonl or parquet)")
+    parser.add_argument("--resume", action="store_true", help="Resume an interrupted run: skip the accounts whose "
+                        "output was written, and the clusters and costs already collected (recorded in the "
+                        "run manifest of the output directory)")
+    parser.add_argument("--api-stats", help="Write the AWS API call statistics (calls, retries, throttles, "
+                        "errors and latency histograms per operation) to a JSON file", metavar="FILE")
+    parser.add_argument("--record", help="Record the Kafka, CloudWatch and Cost Explorer responses of each account "
+                        "to a compressed JSON Lines file in a directory", metavar="DIR")
+    parser.add_argument("--replay", help="Answer the AWS calls of each account from the recordings of a directory "
+                        "(see --record), offline and without credentials", metavar="DIR")
+    parser.add_argument("--explain", action="store_true", help="Print the query plan of each region (the deduplicated "
+                        "CloudWatch queries of every cluster and the estimated number of calls) without fetching the "
+                        "metrics nor writing any output")
+    parser.add_argument("--profile", action="store_true", help="Report the wall time, CPU time and peak RSS of "
+                        "the stages of the run: cluster discovery, metric collection, cost collection and output")
+    parser.add_argument("--profile-stats", help="Write cProfile statistics of the main thread to a file, readable "
+                        "with pstats or snakeviz (implies --profile)", metavar="FILE")
     args = parser.parse_args()
+    args.profile = args.profile or bool(args.profile_stats)
+    if args.engine == "async" and (args.hourly_series or args.series_stats):
+        parser.error("--hourly-series and --series-stats are not supported by the async engine")
+    if args.engine == "async" and (args.cache_dir or args.incremental):
+        parser.error("--cache-dir and --incremental are not supported by the async engine")
+    if args.engine == "async" and args.metrics_insights:
+        parser.error("--metrics-insights is not supported by the async engine")
+    if args.engine == "async" and args.explain:
+        parser.error("--explain is not supported by the async engine")
+    if args.record and args.replay:
+        parser.error("--record and --replay are mutually exclusive")
+    if args.record and args.cache_dir:
+        parser.error("--record does not record the responses served by --cache-dir")
+    if args.profile and args.processes > 1:
+        parser.error("--profile and --profile-stats require --processes 1")
+    if args.stream and args.output_format not in STREAMING_FORMATS:
+        parser.error(f"--stream requires --format {', '.join(STREAMING_FORMATS)}")
+    if args.output_format in ("arrow", "parquet"):
+        try:
+            require_pyarrow(args.output_format)
+        except RuntimeError as e:
+            parser.error(str(e))
 
 
     if not args.config_file:
@@ -33,15 +109,79 @@ def main():
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
 
+    accounts = []
     for section in config.sections():
         if config.get(section, 'cluster_type') == "msk":
+            regions = [region.strip() for region in config.get(section, 'regions', fallback='').split(',')
+                       if region.strip()]
             region = os.environ.get('AWS_DEFAULT_REGION')
-            if not region:
+            if not regions and not region:
                 print("AWS_DEFAULT_REGION environment variable not set")
                 sys.exit(1)
-            pullMSKStats.process_aws_account(section, args.output_dir)
+            accounts.append((section, {
+                'workers': args.workers,
+                'engine': args.engine,
+                'regions': regions,
+                'role_arn': config.get(section, 'role_arn', fallback=None),
+                'external_id': config.get(section, 'external_id', fallback=None),
+                'profile': config.get(section, 'profile', fallback=None),
+                'endpoint_url': config.get(section, 'endpoint_url', fallback=None),
+                'collect_options': {
+                    'recently_active_topics': args.recently_active_topics,
+                    'serverless_search': args.serverless_search,
+                    'hourly': args.hourly_series,
+                    'series_statistics': args.series_stats,
+                    'metrics_insights': args.metrics_insights,
+                },
+                'cache_options': {
+                    'cache_dir': args.cache_dir,
+                    'ttl_seconds': args.cache_ttl * 3600,
+                    'max_size_bytes': args.cache_max_size * 1024 * 1024,
+                } if args.cache_dir else None,
+                'state_dir': args.incremental,
+                'output_format': args.output_format,
+                'stream': args.stream,
+                'resume': args.resume,
+                'record_dir': args.record,
+                'replay_dir': args.replay,
+                'explain': args.explain,
+            }))
         else:
             print("❌ Invalid cluster type. currently only 'msk' is supported.")
 
+    if args.profile:
+        PROFILER.enable()
+    profiler = cProfile.Profile() if args.profile_stats else None
+    if profiler is not None:
+        profiler.enable()
+    start_time = time.perf_counter()
+    api_call_stats = ApiCallStats()
+    if args.processes > 1:
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            futures = [(section, executor.submit(pullMSKStats.process_aws_account, section, args.output_dir, **options))
+                       for section, options in accounts]
+            for section, future in futures:
+                try:
+                    api_call_stats.merge(future.result())
+                except Exception as e:
+                    print(f"❌ Error processing AWS account {section}: {e}")
+    else:
+        for section, options in accounts:
+            api_call_stats.merge(pullMSKStats.process_aws_account(section, args.output_dir, **options))
+
+    wall_time = time.perf_counter() - start_time
+    if profiler is not None:
+        profiler.disable()
+    api_call_stats.print_summary(wall_time)
+    if args.api_stats:
+        api_call_stats.write_json(args.api_stats, wall_time)
+        print(f"API call statistics saved to {args.api_stats}")
+    if args.profile:
+        PROFILER.disable()
+        PROFILER.print_summary(wall_time)
+    if profiler is not None:
+        profiler.dump_stats(args.profile_stats)
+        print(f"cProfile statistics saved to {args.profile_stats}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive client-side rate limiting of AWS API calls.
+
+Each API operation of a client gets a token bucket, refilled at a rate that
+starts at the operation's quota. The rate is adapted AIMD-style: it is halved
+whenever a call is throttled, and grows back additively (ADDITIVE_INCREASE
+calls per second, every second) while calls succeed, up to the quota. Every
+HTTP attempt, retries included, takes a token. The quotas are per account and
+region, so the clients of a session share the limiter of their region and
+service, whichever engine creates them.
+
+Retries themselves are left to botocore's 'standard' retry mode, which
+retries throttling and transient errors with jittered exponential backoff.
+The limiters of aiobotocore clients wait on the event loop instead of
+blocking it.
+"""
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+
+from botocore.config import Config
+
+
+# Default quotas (calls per second) of the operations, per account and region
+DEFAULT_OPERATION_RATES = {
+    'GetMetricData': 50,
+    'GetMetricStatistics': 400,
+    'ListMetrics': 25,
+    'ListClustersV2': 10,
+    'ListNodes': 10,
+    'GetCostAndUsage': 5,
+}
+DEFAULT_RATE = 10
+MIN_RATE = 0.5
+ADDITIVE_INCREASE = 1.0  # Calls per second, per second without throttling
+MULTIPLICATIVE_DECREASE = 0.5
+MAX_ATTEMPTS = 10
+THROTTLING_ERROR_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'LimitExceededException',
+    'ProvisionedThroughputExceededException', 'RequestThrottled', 'SlowDown',
+}
+
+
+class AdaptiveRateLimiter:
+    """
+    A thread-safe token bucket whose refill rate is adapted with AIMD.
+    """
+
+    def __init__(self, max_rate, min_rate=MIN_RATE):
+        """
+        Args:
+            max_rate (float): The quota in calls per second, also the initial rate.
+            min_rate (float): The rate below which throttling does not decrease the rate.
+        """
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.tokens = 1.0
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._increased = self._updated
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # The bucket holds at most one second of calls
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self):
+        """
+        Takes a token if the bucket holds one.
+
+        Returns:
+            float: None if a token was taken, otherwise the seconds until the bucket holds one.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return None
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """
+        Takes a token, waiting for the bucket to refill if it is empty.
+        """
+        while True:
+            wait = self._take()
+            if wait is None:
+                return
+            # Jitter spreads the threads waiting on the same bucket
+            time.sleep(wait * (1 + random.random() * 0.1))
+
+    async def acquire_async(self):
+        """
+        Takes a token like acquire, waiting on the event loop.
+        """
+        while True:
+            wait = self._take()
+            if wait is None:
+                return
+            await asyncio.sleep(wait * (1 + random.random() * 0.1))
+
+    def on_success(self):
+        """
+        Increases the rate additively, by ADDITIVE_INCREASE per second since the last increase.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE * (now - self._increased))
+            self._increased = now
+
+    def on_throttle(self):
+        """
+        Decreases the rate multiplicatively and empties the bucket.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate * MULTIPLICATIVE_DECREASE)
+            self.tokens = min(self.tokens, 0.0)
+            self._increased = now
+
+
+class ClientRateLimiter:
+    """
+    The AdaptiveRateLimiter of each operation of a botocore client, driven by the client's events.
+    """
+
+    def __init__(self, rates=None):
+        """
+        Args:
+            rates (dict, optional): Quotas keyed by operation name, completing DEFAULT_OPERATION_RATES.
+        """
+        self.rates = dict(DEFAULT_OPERATION_RATES, **(rates or {}))
+        self.limiters = {}
+        self._lock = threading.Lock()
+
+    def get_limiter(self, operation_name):
+        """
+        Returns the limiter of an operation, created on first use.
+
+        Args:
+            operation_name (str): The API operation name, e.g. 'GetMetricData'.
+
+        Returns:
+            AdaptiveRateLimiter: The limiter of the operation.
+        """
+        with self._lock:
+            if operation_name not in self.limiters:
+                self.limiters[operation_name] = AdaptiveRateLimiter(self.rates.get(operation_name, DEFAULT_RATE))
+            return self.limiters[operation_name]
+
+    def before_send(self, event_name, **kwargs):
+        """
+        Takes a token of the operation before each HTTP attempt.
+        """
+        self.get_limiter(event_name.rsplit('.', 1)[-1]).acquire()
+
+    async def before_send_async(self, event_name, **kwargs):
+        """
+        Takes a token of the operation before each HTTP attempt of an aiobotocore client.
+        """
+        await self.get_limiter(event_name.rsplit('.', 1)[-1]).acquire_async()
+
+    def needs_retry(self, response, operation, caught_exception=None, **kwargs):
+        """
+        Adapts the rate of the operation to the outcome of each HTTP attempt.
+        """
+        limiter = self.get_limiter(operation.name)
+        error_code = None
+        if response is not None:
+            error_code = response[1].get('Error', {}).get('Code')
+        if error_code in THROTTLING_ERROR_CODES:
+            limiter.on_throttle()
+        elif error_code is None and caught_exception is None:
+            limiter.on_success()
+        # botocore's retry handler decides whether and when to retry
+
+    def register(self, client):
+        """
+        Registers the limiter on the events of a client.
+
+        Args:
+            client (botocore.client.BaseClient): The client to rate limit.
+        """
+        service_id = client.meta.service_model.service_id.hyphenize()
+        client.meta.events.register(f'before-send.{service_id}', self.before_send)
+        client.meta.events.register(f'needs-retry.{service_id}', self.needs_retry)
+
+    def register_async(self, events):
+        """
+        Registers the limiter on an aiobotocore event emitter, before the clients are created from it.
+
+        Args:
+            events (aiobotocore.hooks.AioHierarchicalEmitter): The 'event_emitter' component of an
+                                                               aiobotocore session.
+        """
+        events.register('before-send', self.before_send_async)
+        events.register('needs-retry', self.needs_retry)
+
+
+# The ClientRateLimiter of each session, keyed by (region, service)
+_session_limiters = weakref.WeakKeyDictionary()
+_session_limiters_lock = threading.Lock()
+
+
+def get_client_rate_limiter(session, region_name, service_name, rates=None):
+    """
+    Returns the limiter shared by the clients of a session for a region and service, created on first use.
+
+    Args:
+        session (boto3.Session): The AWS session the clients are created from.
+        region_name (str): The AWS region of the clients.
+        service_name (str): The AWS service name, e.g. 'cloudwatch'.
+        rates (dict, optional): Quotas keyed by operation name, used when the limiter is created.
+
+    Returns:
+        ClientRateLimiter: The limiter.
+    """
+    with _session_limiters_lock:
+        limiters = _session_limiters.setdefault(session, {})
+        if (region_name, service_name) not in limiters:
+            limiters[(region_name, service_name)] = ClientRateLimiter(rates)
+        return limiters[(region_name, service_name)]
+
+
+def create_rate_limited_client(session, service_name, rates=None, max_attempts=MAX_ATTEMPTS):
+    """
+    Creates a client whose calls are rate limited per operation and retried with jittered backoff.
+
+    The clients of a session share the limiter of their region and service, see get_client_rate_limiter.
+
+    Args:
+        session (boto3.Session): The AWS session to create the client from.
+        service_name (str): The AWS service name, e.g. 'cloudwatch'.
+        rates (dict, optional): Quotas keyed by operation name, see ClientRateLimiter. They only apply
+                                to the first client of the session for the region and service.
+        max_attempts (int): The maximum number of attempts of a call, the first one included.
+
+    Returns:
+        botocore.client.BaseClient: The client.
+    """
+    client = session.client(service_name, config=Config(retries={'mode': 'standard', 'max_attempts': max_attempts}))
+    get_client_rate_limiter(session, client.meta.region_name, service_name, rates).register(client)
+    return client
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Recording and replay of the AWS responses of a run.
+
+A ResponseRecorder registered on a session writes every parsed response of
+its clients (errors included), with the operation parameters, region and time
+of the call, as a line of a gzip-compressed JSON Lines file. A ResponseReplayer
+registered on another session answers the calls of its clients from such a
+recording instead of sending them, so a run can be replayed offline, without
+credentials.
+
+Calls are matched on their service, operation, region and parameters, minus
+the time window (StartTime, EndTime, TimePeriod) which moves between runs.
+CloudWatch timestamps are shifted by the whole hours elapsed since the call
+was recorded, so that hourly series still line up with the hours of the
+replayed run.
+"""
+
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from functools import partial
+import gzip
+import json
+import os
+import threading
+
+from botocore.awsrequest import AWSResponse
+
+
+TIME_PARAMETERS = ['StartTime', 'EndTime', 'TimePeriod']
+CONTEXT_PARAMS_KEY = 'response_recorder_params'
+SHIFTED_SERVICES = ['cloudwatch']
+
+
+def get_recording_path(directory, section):
+    """
+    Returns:
+        str: The path of the recording of an account in a directory.
+    """
+    return os.path.join(directory, f"{section}.jsonl.gz")
+
+
+def encode_value(value):
+    """
+    JSON encoder default of the recordings, datetimes becoming {'$datetime': ISO 8601}.
+    """
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def decode_object(value):
+    """
+    JSON decoder object_hook of the recordings, see encode_value.
+    """
+    if len(value) == 1 and '$datetime' in value:
+        return datetime.fromisoformat(value['$datetime'])
+    return value
+
+
+def build_call_key(service_name, operation_name, region, params):
+    """
+    Returns:
+        str: The key matching a call with its recorded response, regardless of its time window.
+    """
+    params = {key: value for key, value in params.items() if key not in TIME_PARAMETERS}
+    return json.dumps([service_name, operation_name, region, params], sort_keys=True, default=encode_value)
+
+
+def shift_timestamps(value, delta):
+    """
+    Returns:
+        A deep copy of a response with its datetimes shifted by a timedelta.
+    """
+    if isinstance(value, datetime):
+        return value + delta
+    if isinstance(value, dict):
+        return {key: shift_timestamps(item, delta) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shift_timestamps(item, delta) for item in value]
+    return value
+
+
+def floor_hour(value):
+    """
+    Returns:
+        datetime: A datetime truncated to the hour.
+    """
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def capture_params(params, context, **kwargs):
+    """
+    Keeps the parameters of a call in its context, before-call handlers only see the serialized request.
+    """
+    context[CONTEXT_PARAMS_KEY] = dict(params)
+
+
+class ResponseRecorder:
+    """
+    Thread-safe writer of the responses of the clients of a session to a compressed JSONL recording.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The path of the recording, overwritten.
+        """
+        self.path = path
+        self.calls = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def register(self, events, region_name):
+        """
+        Registers the hooks on an event emitter, that of a session to record the calls of all its clients.
+
+        Args:
+            events (botocore.hooks.HierarchicalEmitter): The emitter, e.g. the 'events' of a boto3 session,
+                                                         or the 'event_emitter' component of a botocore session.
+            region_name (str): The region of the clients, recorded with their calls.
+        """
+        events.register('before-parameter-build', capture_params)
+        events.register('after-call', partial(self.after_call, region_name))
+
+    def after_call(self, region_name, http_response, parsed, model, context, **kwargs):
+        """
+        Records a call once its response, successful or not, is parsed.
+        """
+        response = {key: value for key, value in parsed.items() if key != 'ResponseMetadata'}
+        line = json.dumps({
+            'service': model.service_model.service_name,
+            'operation': model.name,
+            'region': region_name,
+            'params': context.get(CONTEXT_PARAMS_KEY, {}),
+            'time': datetime.now(timezone.utc),
+            'status': http_response.status_code,
+            'response': response,
+        }, default=encode_value)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line + '\n')
+            self.calls += 1
+
+    def close(self):
+        """
+        Closes the recording, the calls made afterwards are not recorded.
+        """
+        with self._lock:
+            self._file.close()
+        print(f"Recorded {self.calls} AWS responses to {self.path}")
+
+
+class ResponseReplayer:
+    """
+    Answers the calls of the clients of a session from a recording, see ResponseRecorder.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The path of the recording.
+        """
+        self.path = path
+        self.calls = 0
+        self.responses = {}
+        self._lock = threading.Lock()
+        with gzip.open(path, 'rt', encoding='utf-8') as recording:
+            for line in recording:
+                call = json.loads(line, object_hook=decode_object)
+                key = build_call_key(call['service'], call['operation'], call['region'], call['params'])
+                self.responses.setdefault(key, deque()).append(call)
+
+    def register(self, events, region_name):
+        """
+        Registers the hooks on an event emitter, no request of its clients is sent afterwards.
+
+        Args:
+            events (botocore.hooks.HierarchicalEmitter): The emitter, e.g. the 'events' of a boto3 session,
+                                                         or the 'event_emitter' component of a botocore session.
+            region_name (str): The region of the clients, whose recorded calls are replayed.
+        """
+        events.register('before-parameter-build', capture_params)
+        events.register('before-call', partial(self.answer_call, region_name))
+
+    def answer_call(self, region_name, model, context, **kwargs):
+        """
+        Returns the recorded response of a call, identical calls being answered in the recorded order
+        (the last response is repeated once they are exhausted).
+        """
+        service_name = model.service_model.service_name
+        key = build_call_key(service_name, model.name, region_name, context.get(CONTEXT_PARAMS_KEY, {}))
+        with self._lock:
+            calls = self.responses.get(key)
+            if not calls:
+                raise LookupError(f"No recorded {service_name}.{model.name} response in {self.path} "
+                                  f"for {context.get(CONTEXT_PARAMS_KEY)}")
+            call = calls.popleft() if len(calls) > 1 else calls[0]
+            self.calls += 1
+
+        delta = timedelta(0)
+        if service_name in SHIFTED_SERVICES:
+            delta = floor_hour(datetime.now(timezone.utc)) - floor_hour(call['time'])
+        # A copy, the callers may modify the response
+        response = shift_timestamps(call['response'], delta)
+        response['ResponseMetadata'] = {'HTTPStatusCode': call['status'], 'RetryAttempts': 0}
+        return AWSResponse(None, call['status'], {}, None), response
+
+    def close(self):
+        """
+        Reports the number of replayed calls.
+        """
+        print(f"Replayed {self.calls} AWS responses from {self.path}")
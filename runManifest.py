@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Run manifest recording the completed units of an account, to resume interrupted runs.
+
+Each account (config section) has its own manifest file in the checkpoint
+directory, so that accounts processed in parallel processes never share one.
+A unit is the collection of a cluster, or the costs, of a region; its partial
+output is pickled next to the manifest when it completes. Once the output of
+the account is written, the account is marked done and its partial outputs
+are removed.
+
+The manifest records the options and the collection window of its run: a
+resumed run with other options starts over, and one with the same options
+collects over the window of the interrupted run (see RunManifest.window), so
+that its output never mixes two windows.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+
+
+CHECKPOINT_DIR_NAME = '.checkpoint'
+
+
+def get_unit_name(region, cluster_id=None):
+    """
+    Returns the name of a unit of work.
+
+    Args:
+        region (str): The AWS region.
+        cluster_id (str, optional): The name of the MSK cluster, None for the costs of the region.
+
+    Returns:
+        str: The unit name.
+    """
+    return f"{region}/cluster/{cluster_id}" if cluster_id is not None else f"{region}/costs"
+
+
+class RunManifest:
+    """
+    The completed units of an account, shared by the threads processing its regions and clusters.
+    """
+
+    def __init__(self, checkpoint_dir, section, resume=False, options=None, window=None):
+        """
+        Opens the manifest of an account.
+
+        Args:
+            checkpoint_dir (str): The directory holding the manifests, created if needed.
+            section (str): The section/account identifier.
+            resume (bool): If True, the units completed by a previous run with the same options are kept,
+                           along with its window, otherwise the manifest of the account starts empty.
+            options (dict, optional): The run options that change the output, JSON-serializable.
+            window (list, optional): The start and end of the collection window of this run, as ISO 8601
+                                     strings, replaced by that of the previous run when it is resumed.
+        """
+        file_name = "".join(character if character.isalnum() or character in '-_.' else '_' for character in section)
+        self.path = os.path.join(checkpoint_dir, f"{file_name}.json")
+        self.units_dir = os.path.join(checkpoint_dir, file_name)
+        self._lock = threading.Lock()
+        self.failed_units = []
+        # A JSON round trip, so that the options compare equal to those read back from the file
+        options = json.loads(json.dumps(options or {}))
+        window = list(window) if window is not None else None
+        self.manifest = {'section': section, 'done': False, 'output_files': [], 'units': {},
+                         'options': options, 'window': window}
+
+        previous = self.read() if resume else None
+        if previous is not None and previous.get('options') == options:
+            self.manifest = previous
+            return
+        if previous is not None:
+            print(f"The previous run of account {section} used other options, starting it over")
+        # The manifest is rewritten right away, so that it never lists the units of a previous run
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        shutil.rmtree(self.units_dir, ignore_errors=True)
+        with self._lock:
+            self.write()
+
+    @property
+    def window(self):
+        """
+        Returns:
+            list: The start and end of the collection window as ISO 8601 strings, that of the
+                  interrupted run when it is resumed, or None if it was not recorded.
+        """
+        return self.manifest.get('window')
+
+    def read(self):
+        """
+        Returns:
+            dict: The manifest written by a previous run, or None if there is none or it is unreadable.
+        """
+        try:
+            with open(self.path) as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return None
+
+    def is_done(self):
+        """
+        Returns:
+            bool: True if the output of the account was written by a previous run.
+        """
+        return self.manifest['done']
+
+    def load(self, unit):
+        """
+        Returns the partial output of a completed unit.
+
+        Args:
+            unit (str): The unit name, see get_unit_name.
+
+        Returns:
+            The partial output, or None if the unit did not complete or its output is missing or unreadable.
+        """
+        with self._lock:
+            file_name = self.manifest['units'].get(unit)
+        if file_name is None:
+            return None
+        try:
+            with open(os.path.join(self.units_dir, file_name), 'rb') as unit_file:
+                return pickle.load(unit_file)
+        except Exception as e:
+            print(f"Error reading the checkpoint of {unit}, collecting it again: {e}")
+            return None
+
+    def save(self, unit, output):
+        """
+        Stores the partial output of a unit and records it as completed.
+
+        Args:
+            unit (str): The unit name, see get_unit_name.
+            output: The partial output, any picklable object.
+        """
+        file_name = f"{hashlib.sha1(unit.encode('utf-8')).hexdigest()}.pkl"
+        os.makedirs(self.units_dir, exist_ok=True)
+        with open(os.path.join(self.units_dir, file_name), 'wb') as unit_file:
+            pickle.dump(output, unit_file)
+        with self._lock:
+            self.manifest['units'][unit] = file_name
+            self.write()
+
+    def mark_failed(self, unit):
+        """
+        Records a unit that failed in this run, the account is then not marked done.
+
+        Args:
+            unit (str): The unit name, see get_unit_name, or a region for a whole region.
+        """
+        with self._lock:
+            self.failed_units.append(unit)
+
+    def mark_done(self, output_files):
+        """
+        Records the output of the account and removes its partial outputs,
+        unless some units failed: those are fetched again by a resumed run.
+
+        Args:
+            output_files (list): The paths of the output written for the account.
+        """
+        if self.failed_units:
+            print(f"{len(self.failed_units)} unit(s) failed for account {self.manifest['section']}, "
+                  f"run again with --resume to collect them")
+            return
+        with self._lock:
+            self.manifest.update({'done': True, 'output_files': output_files, 'units': {}})
+            self.write()
+        shutil.rmtree(self.units_dir, ignore_errors=True)
+
+    def write(self):
+        """
+        Writes the manifest atomically, called under the manifest lock.
+        """
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=2)
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage profiling of a run.
+
+The main steps of a run (cluster discovery, metric collection, cost
+collection and output writing) are wrapped in named stages. Once the
+profiler is enabled, each stage records how many times it ran, its wall
+time and the CPU time of the threads running it (both summed over the runs
+of the stage, which overlap when clusters are collected concurrently), and
+the peak resident set size (RSS) of the process while it ran, sampled with
+psutil.
+
+A stage whose wall time is well above its CPU time is waiting on the
+network; one whose CPU time is close to its wall time is bound by pandas,
+NumPy or the output writers.
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # Listed in requirements.txt, the peak RSS is not reported without it
+    psutil = None
+
+
+RSS_SAMPLE_INTERVAL_SECONDS = 0.05
+
+
+class StageProfiler:
+    """
+    Thread-safe wall time, CPU time and peak RSS of the named stages of a run.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._process = None
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def enable(self):
+        """
+        Starts recording the stages, and sampling the RSS of the process in a background thread.
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        self._stop.clear()
+        if psutil is not None:
+            self._process = psutil.Process()
+            self._sampler = threading.Thread(target=self._sample_rss, name='stage-profiler', daemon=True)
+            self._sampler.start()
+
+    def disable(self):
+        """
+        Stops recording the stages.
+        """
+        self.enabled = False
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    def _sample_rss(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL_SECONDS):
+            self._record_rss()
+
+    def _record_rss(self):
+        """
+        Raises the peak RSS of the active stages to the current RSS of the process.
+        """
+        if self._process is None:
+            return
+        rss = self._process.memory_info().rss
+        with self._lock:
+            for name, count in self._active.items():
+                if count:
+                    self.stages[name]['peak_rss'] = max(self.stages[name]['peak_rss'], rss)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Records a run of a stage, a no-op unless the profiler is enabled.
+
+        Args:
+            name (str): The stage name, e.g. 'metrics'.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        with self._lock:
+            self.stages.setdefault(name, {'runs': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'peak_rss': 0})
+            self._active[name] = self._active.get(name, 0) + 1
+        self._record_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.thread_time() - cpu_start
+            self._record_rss()
+            with self._lock:
+                self._active[name] -= 1
+                stage = self.stages[name]
+                stage['runs'] += 1
+                stage['wall_time'] += wall_time
+                stage['cpu_time'] += cpu_time
+
+    def print_summary(self, wall_time=None):
+        """
+        Prints a line per stage.
+
+        Args:
+            wall_time (float, optional): The wall time of the run in seconds.
+        """
+        header = "Stages" + (f" (wall time {wall_time:.1f} s)" if wall_time is not None else "")
+        print(f"{header}:")
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+        for name, stage in stages.items():
+            peak_rss = f"{stage['peak_rss'] / (1024 * 1024):.0f} MB" if self._process is not None else "n/a"
+            print(f"  {name}: {stage['runs']} runs, wall {stage['wall_time']:.2f} s, "
+                  f"CPU {stage['cpu_time']:.2f} s, peak RSS {peak_rss}")
+        if psutil is None:
+            print("  Install psutil to report the peak RSS of the stages")
+
+
+PROFILER = StageProfiler()
+
+
+def profile_stage(name):
+    """
+    Records a run of a stage with the profiler of the process, usable as a context manager
+    or a function decorator.
+
+    Args:
+        name (str): The stage name, e.g. 'metrics'.
+    """
+    return PROFILER.stage(name)
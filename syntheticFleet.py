@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic MSK fleets served without an AWS account.
+
+A SyntheticFleet holds N provisioned clusters of M brokers and serverless
+clusters of K topics, and answers the Kafka, CloudWatch and Cost Explorer
+operations used by pullMSKStats with deterministic data:
+
+- ListClustersV2 and ListNodes, paginated.
+- ListMetrics, paginated, listing the topic metrics of the serverless clusters.
+- GetMetricStatistics and GetMetricData (MetricStat queries, the SUM(SEARCH(...))
+  expressions of pullMSKStats.build_serverless_search_query and the Metrics Insights
+  queries of pullMSKStats.build_broker_insights_query), with GetMetricData
+  paginated past max_datapoints.
+- GetCostAndUsage.
+
+Datapoints follow a daily cycle, so that hourly peaks differ from averages.
+register_fleet serves a fleet to the clients of a boto3 session through
+botocore event hooks, nothing is sent over the network.
+"""
+
+from datetime import datetime, timedelta, timezone
+import math
+import re
+import time
+
+import boto3
+from botocore.awsrequest import AWSResponse
+
+
+KAFKA_VERSION = '3.6.0'
+INSTANCE_TYPE = 'kafka.m5.large'
+VOLUME_SIZE_GB = 1000
+SERVERLESS_TOPIC_METRICS = ['BytesInPerSec', 'BytesOutPerSec', 'MessagesInPerSec']
+LIST_CLUSTERS_PAGE_SIZE = 100
+LIST_NODES_PAGE_SIZE = 10
+LIST_METRICS_PAGE_SIZE = 500
+MAX_DATAPOINTS = 100800  # GetMetricData datapoints per response
+CONTEXT_PARAMS_KEY = 'synthetic_fleet_params'
+SEARCH_PATTERN = re.compile(
+    r"""MetricName="(?P<metric>[^"]+)" "Cluster Name"="(?P<cluster>[^"]+)"', '(?P<stat>\w+)', (?P<period>\d+)""")
+INSIGHTS_PATTERN = re.compile(
+    r"""SELECT (?P<function>AVG|MAX)\((?P<metric>\w+)\) FROM SCHEMA\("AWS/Kafka", (?P<schema>[^)]+)\) """
+    r"""WHERE "Cluster Name" = '(?P<cluster>[^']+)'(?: GROUP BY "(?P<group>[^"]+)")?$""")
+INSIGHTS_STATISTICS = {'AVG': 'Average', 'MAX': 'Maximum'}
+
+
+def parse_time(value):
+    """
+    Returns a request time as an aware datetime.
+
+    Args:
+        value (datetime or str): A datetime, or an ISO 8601 string.
+
+    Returns:
+        datetime: The time, in UTC when it has no timezone.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def get_metric_value(metric_name, broker_id=0, topic_index=0, stat='Average', timestamp=None):
+    """
+    Returns the synthetic value of a metric.
+
+    Args:
+        metric_name (str): The CloudWatch metric name.
+        broker_id (int): The broker ID, 0 for cluster-level metrics.
+        topic_index (int): The index of the topic, 0 for broker metrics.
+        stat (str): 'Average' or 'Maximum' (twice the average).
+        timestamp (datetime, optional): The start of the datapoint, the value follows a daily cycle.
+
+    Returns:
+        float: The value.
+    """
+    value = float(len(metric_name) * 100 + broker_id * 10 + topic_index % 100)
+    if timestamp is not None:
+        value *= 1.5 + math.sin(2 * math.pi * timestamp.hour / 24) / 2
+    return value * 2 if stat == 'Maximum' else value
+
+
+class SyntheticFleet:
+    """
+    A fleet of synthetic MSK clusters answering AWS API operations with parsed responses.
+    """
+
+    def __init__(self, provisioned_clusters=10, brokers=3, serverless_clusters=2, topics=50, latency=0.0,
+                 max_datapoints=MAX_DATAPOINTS, replaced_brokers=0):
+        """
+        Args:
+            provisioned_clusters (int): The number of provisioned clusters.
+            brokers (int): The number of brokers of each provisioned cluster.
+            replaced_brokers (int): The number of brokers of each provisioned cluster replaced by brokers
+                                    with new IDs, so that the broker IDs are not 1 to `brokers`.
+            serverless_clusters (int): The number of serverless clusters.
+            topics (int): The number of topics of each serverless cluster.
+            latency (float): Seconds added to every call.
+            max_datapoints (int): The GetMetricData datapoints per response, beyond which it is paginated.
+        """
+        self.brokers = brokers
+        self.broker_ids = list(range(1, brokers - replaced_brokers + 1)) + \
+            list(range(brokers + 1, brokers + replaced_brokers + 1))
+        self.topics = [f"topic-{index:05d}" for index in range(topics)]
+        self.latency = latency
+        self.max_datapoints = max_datapoints
+        self.clusters = {}
+        for index in range(provisioned_clusters):
+            self.add_cluster(self.build_provisioned_cluster(f"provisioned-{index:04d}"))
+        for index in range(serverless_clusters):
+            self.add_cluster(self.build_serverless_cluster(f"serverless-{index:04d}"))
+
+    def add_cluster(self, cluster):
+        self.clusters[cluster['ClusterName']] = cluster
+
+    def build_provisioned_cluster(self, name):
+        """
+        Returns:
+            dict: The ListClustersV2 description of a provisioned cluster.
+        """
+        return {
+            'ClusterName': name,
+            'ClusterArn': f"arn:aws:kafka:us-east-1:123456789012:cluster/{name}/{len(self.clusters):08d}",
+            'ClusterType': 'PROVISIONED',
+            'CurrentVersion': 'K3AEGXETSR30VB',
+            'State': 'ACTIVE',
+            'Provisioned': {
+                'BrokerNodeGroupInfo': {
+                    'BrokerAZDistribution': 'DEFAULT',
+                    'InstanceType': INSTANCE_TYPE,
+                    'StorageInfo': {'EbsStorageInfo': {'VolumeSize': VOLUME_SIZE_GB}},
+                },
+                'ClientAuthentication': {'Sasl': {'Iam': {'Enabled': True}}},
+                'CurrentBrokerSoftwareInfo': {'KafkaVersion': KAFKA_VERSION},
+                'EnhancedMonitoring': 'DEFAULT',
+                'NumberOfBrokerNodes': self.brokers,
+            },
+        }
+
+    def build_serverless_cluster(self, name):
+        """
+        Returns:
+            dict: The ListClustersV2 description of a serverless cluster.
+        """
+        return {
+            'ClusterName': name,
+            'ClusterArn': f"arn:aws:kafka:us-east-1:123456789012:cluster/{name}/{len(self.clusters):08d}",
+            'ClusterType': 'SERVERLESS',
+            'State': 'ACTIVE',
+            'Serverless': {'ClientAuthentication': {'Sasl': {'Iam': {'Enabled': True}}}},
+        }
+
+    def handle(self, operation_name, params):
+        """
+        Answers an API operation.
+
+        Args:
+            operation_name (str): The operation name, e.g. 'GetMetricData'.
+            params (dict): The operation parameters.
+
+        Returns:
+            dict: The parsed response.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        handler = getattr(self, f"handle_{re.sub(r'(?<!^)(?=[A-Z])', '_', operation_name).lower()}", None)
+        if handler is None:
+            raise NotImplementedError(f"The synthetic fleet does not implement {operation_name}")
+        return handler(params)
+
+    def handle_list_clusters_v2(self, params):
+        start = int(params.get('NextToken', 0))
+        page_size = params.get('MaxResults', LIST_CLUSTERS_PAGE_SIZE)
+        clusters = list(self.clusters.values())
+        response = {'ClusterInfoList': clusters[start:start + page_size]}
+        if start + page_size < len(clusters):
+            response['NextToken'] = str(start + page_size)
+        return response
+
+    def handle_list_nodes(self, params):
+        cluster_arn = params['ClusterArn']
+        provisioned = any(cluster['ClusterArn'] == cluster_arn and cluster['ClusterType'] == 'PROVISIONED'
+                          for cluster in self.clusters.values())
+        nodes = [{
+            'AddedToClusterTime': '2024-01-01T00:00:00.000Z',
+            'BrokerNodeInfo': {
+                'AttachedENIId': f"eni-{broker_id:017x}",
+                'BrokerId': float(broker_id),
+                'ClientSubnet': f"subnet-{broker_id % 3:017x}",
+                'ClientVpcIpAddress': f"10.0.{broker_id % 3}.{broker_id}",
+                'CurrentBrokerSoftwareInfo': {'KafkaVersion': KAFKA_VERSION},
+            },
+            'InstanceType': INSTANCE_TYPE,
+            'NodeARN': f"{cluster_arn.replace(':cluster/', ':broker/')}/{broker_id}",
+            'NodeType': 'BROKER',
+        } for broker_id in (self.broker_ids if provisioned else [])]
+        start = int(params.get('NextToken', 0))
+        page_size = params.get('MaxResults', LIST_NODES_PAGE_SIZE)
+        response = {'NodeInfoList': nodes[start:start + page_size]}
+        if start + page_size < len(nodes):
+            response['NextToken'] = str(start + page_size)
+        return response
+
+    def handle_list_metrics(self, params):
+        filters = {dimension['Name']: dimension.get('Value') for dimension in params.get('Dimensions', [])}
+        cluster = self.clusters.get(filters.get('Cluster Name'))
+        metrics = []
+        if cluster is not None and cluster['ClusterType'] == 'SERVERLESS':
+            metric_names = [params['MetricName']] if 'MetricName' in params else SERVERLESS_TOPIC_METRICS
+            metrics = [
+                {'Namespace': 'AWS/Kafka', 'MetricName': metric_name,
+                 'Dimensions': [{'Name': 'Cluster Name', 'Value': cluster['ClusterName']},
+                                {'Name': 'Topic', 'Value': topic}]}
+                for metric_name in metric_names if metric_name in SERVERLESS_TOPIC_METRICS
+                for topic in self.topics]
+        start = int(params.get('NextToken', 0))
+        response = {'Metrics': metrics[start:start + LIST_METRICS_PAGE_SIZE]}
+        if start + LIST_METRICS_PAGE_SIZE < len(metrics):
+            response['NextToken'] = str(start + LIST_METRICS_PAGE_SIZE)
+        return response
+
+    def get_datapoints(self, metric_name, dimensions, stat, period, start_time, end_time):
+        """
+        Returns the timestamps and values of a metric over a window.
+
+        Args:
+            metric_name (str): The CloudWatch metric name.
+            dimensions (list): The metric dimensions.
+            stat (str): 'Average' or 'Maximum'.
+            period (int): The datapoint period in seconds.
+            start_time (datetime): The start of the window.
+            end_time (datetime): The end of the window.
+
+        Returns:
+            tuple: The timestamps and the values, empty for metrics outside the fleet.
+        """
+        dimensions = {dimension['Name']: dimension['Value'] for dimension in dimensions}
+        cluster = self.clusters.get(dimensions.get('Cluster Name'))
+        if cluster is None:
+            return [], []
+        broker_id = int(dimensions.get('Broker ID', 0))
+        if broker_id and (cluster['ClusterType'] != 'PROVISIONED' or broker_id not in self.broker_ids):
+            return [], []
+        topic = dimensions.get('Topic')
+        if topic is not None and (cluster['ClusterType'] != 'SERVERLESS' or topic not in self.topics
+                                  or metric_name not in SERVERLESS_TOPIC_METRICS):
+            return [], []
+        topic_index = self.topics.index(topic) if topic is not None else 0
+        timestamps = []
+        timestamp = start_time
+        while timestamp < end_time:
+            timestamps.append(timestamp)
+            timestamp += timedelta(seconds=period)
+        # Whole-window statistics are not cyclic
+        cyclic = period < 24 * 3600
+        return timestamps, [get_metric_value(metric_name, broker_id, topic_index, stat, timestamp if cyclic else None)
+                            for timestamp in timestamps]
+
+    def get_search_datapoints(self, expression, start_time, end_time):
+        """
+        Returns the datapoints of a SUM(SEARCH(...)) expression, summed over the topics of a cluster.
+        """
+        match = SEARCH_PATTERN.search(expression)
+        if match is None:
+            raise NotImplementedError(f"The synthetic fleet does not implement the expression {expression}")
+        timestamps, sums = [], []
+        for topic in self.topics:
+            dimensions = [{'Name': 'Cluster Name', 'Value': match['cluster']}, {'Name': 'Topic', 'Value': topic}]
+            timestamps, values = self.get_datapoints(match['metric'], dimensions, match['stat'], int(match['period']),
+                                                     start_time, end_time)
+            sums = [total + value for total, value in zip(sums, values)] if sums else values
+        return timestamps, sums
+
+    def get_insights_datapoints(self, expression, period, start_time, end_time):
+        """
+        Returns the series of a Metrics Insights query, one per broker when grouped by "Broker ID".
+
+        Returns:
+            list: The Broker ID (None for an ungrouped query), the timestamps and the values of each series.
+        """
+        match = INSIGHTS_PATTERN.match(expression)
+        if match is None:
+            raise NotImplementedError(f"The synthetic fleet does not implement the expression {expression}")
+        cluster = self.clusters.get(match['cluster'])
+        if cluster is None or cluster['ClusterType'] != 'PROVISIONED':
+            return []
+        stat = INSIGHTS_STATISTICS[match['function']]
+        dimensions = [{'Name': 'Cluster Name', 'Value': match['cluster']}]
+        if '"Broker ID"' not in match['schema']:
+            return [(None, *self.get_datapoints(match['metric'], dimensions, stat, period, start_time, end_time))]
+        series = []
+        for broker_id in self.broker_ids:
+            broker_dimensions = dimensions + [{'Name': 'Broker ID', 'Value': str(broker_id)}]
+            series.append((str(broker_id) if match['group'] == 'Broker ID' else None,
+                           *self.get_datapoints(match['metric'], broker_dimensions, stat, period, start_time,
+                                                end_time)))
+        return series
+
+    def handle_get_metric_statistics(self, params):
+        stat = params['Statistics'][0]
+        timestamps, values = self.get_datapoints(params['MetricName'], params.get('Dimensions', []), stat,
+                                                 params['Period'], parse_time(params['StartTime']),
+                                                 parse_time(params['EndTime']))
+        return {'Label': params['MetricName'],
+                'Datapoints': [{'Timestamp': timestamp, stat: value} for timestamp, value in zip(timestamps, values)]}
+
+    def handle_get_metric_data(self, params):
+        start_time, end_time = parse_time(params['StartTime']), parse_time(params['EndTime'])
+        # Datapoints of every query, in query order, paginated by offset
+        datapoints = []
+        for query in params['MetricDataQueries']:
+            if query.get('Expression', '').startswith('SELECT'):
+                # The dynamic label of pullMSKStats.BROKER_ID_LABEL resolves to the Broker ID
+                query_series = [(broker_id or '', timestamps, values) for broker_id, timestamps, values
+                                in self.get_insights_datapoints(query['Expression'], query['Period'],
+                                                                start_time, end_time)]
+            elif 'Expression' in query:
+                query_series = [(query['Id'], *self.get_search_datapoints(query['Expression'], start_time,
+                                                                          end_time))]
+            else:
+                metric_stat = query['MetricStat']
+                query_series = [(query['Id'], *self.get_datapoints(
+                    metric_stat['Metric']['MetricName'], metric_stat['Metric'].get('Dimensions', []),
+                    metric_stat['Stat'], metric_stat['Period'], start_time, end_time))]
+            for label, timestamps, values in query_series:
+                if params.get('ScanBy') == 'TimestampDescending':
+                    timestamps, values = timestamps[::-1], values[::-1]
+                datapoints.append((query['Id'], label, timestamps, values))
+
+        start = int(params.get('NextToken', 0))
+        end = start + min(params.get('MaxDatapoints', self.max_datapoints), self.max_datapoints)
+        results = []
+        offset = 0
+        for query_id, label, timestamps, values in datapoints:
+            query_start, query_end = offset, offset + len(values)
+            offset = query_end
+            if query_start == query_end:
+                # Queries without datapoints are returned with the first page
+                if start == 0:
+                    results.append({'Id': query_id, 'Label': label, 'Timestamps': [], 'Values': [],
+                                    'StatusCode': 'Complete'})
+                continue
+            if query_end <= start or query_start >= end:
+                continue
+            first, last = max(start, query_start) - query_start, min(end, query_end) - query_start
+            results.append({
+                'Id': query_id,
+                'Label': label,
+                'Timestamps': timestamps[first:last],
+                'Values': values[first:last],
+                'StatusCode': 'Complete' if query_end <= end else 'PartialData',
+            })
+        response = {'MetricDataResults': results, 'Messages': []}
+        if end < offset:
+            response['NextToken'] = str(end)
+        return response
+
+    def handle_get_cost_and_usage(self, params):
+        provisioned = sum(cluster['ClusterType'] == 'PROVISIONED' for cluster in self.clusters.values())
+        serverless = len(self.clusters) - provisioned
+        groups = [
+            ('USE1-Kafka.m5.large', provisioned * self.brokers * 0.21 * 720),
+            ('USE1-Kafka.Storage.GP2', provisioned * self.brokers * VOLUME_SIZE_GB * 0.10),
+            ('USE1-Serverless-ClusterHours', serverless * 0.75 * 720),
+        ]
+        return {'ResultsByTime': [{
+            'TimePeriod': params['TimePeriod'],
+            'Total': {},
+            'Groups': [{'Keys': [usage_type], 'Metrics': {'UnblendedCost': {'Amount': f"{cost:.2f}", 'Unit': 'USD'}}}
+                       for usage_type, cost in groups if cost],
+            'Estimated': False,
+        }]}
+
+
+def register_fleet(events, fleet):
+    """
+    Serves a synthetic fleet to the clients of an event emitter, instead of sending their requests.
+
+    Args:
+        events (botocore.hooks.HierarchicalEmitter): The emitter, e.g. the 'events' of a boto3 session.
+        fleet (SyntheticFleet): The fleet answering the calls.
+    """
+    def capture_params(params, context, **kwargs):
+        context[CONTEXT_PARAMS_KEY] = dict(params)
+
+    def answer_call(model, context, **kwargs):
+        response = fleet.handle(model.name, context[CONTEXT_PARAMS_KEY])
+        response['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RetryAttempts': 0}
+        return AWSResponse(None, 200, {}, None), response
+
+    events.register('before-parameter-build', capture_params)
+    events.register('before-call', answer_call)
+
+
+def create_fleet_session(fleet, region_name='us-east-1', api_call_stats=None):
+    """
+    Creates a boto3 session whose clients are served by a synthetic fleet.
+
+    Args:
+        fleet (SyntheticFleet): The fleet answering the calls.
+        region_name (str): The AWS region of the session.
+        api_call_stats (ApiCallStats, optional): Records the calls of the clients.
+
+    Returns:
+        boto3.Session: The session, with dummy credentials.
+    """
+    session = boto3.Session(aws_access_key_id='synthetic', aws_secret_access_key='synthetic',
+                            region_name=region_name)
+    if api_call_stats is not None:
+        api_call_stats.register(session.events)
+    register_fleet(session.events, fleet)
+    return session
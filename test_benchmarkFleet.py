@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the smallest synthetic fleet against its API call budgets, see benchmarkFleet.BENCHMARK_BUDGETS.
+
+The numbers of calls are deterministic; the time and memory budgets depend on the machine
+and are checked by `python benchmarkFleet.py --budget small` instead.
+
+Usage:
+    python -m pytest test_benchmarkFleet.py
+"""
+
+from benchmarkFleet import BENCHMARK_BUDGETS, BUDGET_WORKERS, check_budgets, run_benchmarks
+from syntheticFleet import SyntheticFleet
+
+
+def test_small_fleet_within_api_call_budgets():
+    budget = BENCHMARK_BUDGETS['small']
+    fleet = SyntheticFleet(budget['fleet']['provisioned'], budget['fleet']['brokers'], budget['fleet']['serverless'],
+                           budget['fleet']['topics'])
+    results = run_benchmarks(fleet, workers=BUDGET_WORKERS, repeat=1)
+    assert set(results['benchmark']) == set(budget['budgets'])
+    api_call_budgets = {name: {'api calls': budgets['api calls']} for name, budgets in budget['budgets'].items()}
+    assert check_budgets(results, api_call_budgets) == []
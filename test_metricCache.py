@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the expiry and the least recently used eviction of the CloudWatch response cache.
+
+Usage:
+    python -m pytest test_metricCache.py
+"""
+
+import json
+
+import metricCache
+from metricCache import ACCESS_RESOLUTION_SECONDS, MetricCache
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def test_entries_expire_after_the_ttl(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(metricCache.time, 'time', clock.time)
+    cache = MetricCache(str(tmp_path), ttl_seconds=3600)
+    cache.put('key', 1.5)
+    clock.now += 3599
+    assert cache.get('key') == 1.5
+    clock.now += 2
+    assert cache.get('key') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(metricCache.time, 'time', clock.time)
+    entry_size = len(json.dumps([0.0] * 10))
+    cache = MetricCache(str(tmp_path), max_size_bytes=3 * entry_size)
+    for key in ['a', 'b', 'c']:
+        cache.put(key, [0.0] * 10)
+        clock.now += 1
+    # 'a' is read after 'b' and 'c' were written, so 'b' is now the least recently used
+    clock.now += ACCESS_RESOLUTION_SECONDS + 1
+    assert cache.get('a') is not None
+    cache.put('d', [0.0] * 10)
+
+    assert cache.get('b') is None
+    assert [cache.get(key) is not None for key in ['a', 'c', 'd']] == [True, True, True]
+    cache.close()
+
+
+def test_total_size_is_kept_across_reopens(tmp_path):
+    value = [1.0] * 10
+    cache = MetricCache(str(tmp_path), max_size_bytes=2 * len(json.dumps(value)))
+    cache.put('a', value)
+    cache.put('a', value)
+    cache.close()
+
+    cache = MetricCache(str(tmp_path), max_size_bytes=2 * len(json.dumps(value)))
+    cache.put('b', value)
+    assert cache.get('a') == value and cache.get('b') == value
+    cache.put('c', value)
+    assert cache.get('a') is None
+    cache.close()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the MetricQueryPlanner deduplicates queries and maps their values back to cells.
+
+Usage:
+    python -m pytest test_metricCatalog.py
+"""
+
+from metricCatalog import MetricQueryPlanner, count_distinct_queries
+
+
+def build_query(metric_name, stat, dimensions, query_id='q'):
+    return {'Id': query_id, 'ReturnData': True,
+            'MetricStat': {'Metric': {'Namespace': 'AWS/Kafka', 'MetricName': metric_name,
+                                      'Dimensions': [{'Name': name, 'Value': value} for name, value in dimensions]},
+                           'Period': 3600, 'Stat': stat}}
+
+
+CLUSTER = ('Cluster Name', 'cluster-1')
+
+
+def test_identical_queries_share_an_id():
+    planner = MetricQueryPlanner('m')
+    first_id = planner.add(build_query('BytesInPerSec', 'Average', [CLUSTER, ('Broker ID', '1')], 'x'), (0, 9))
+    # The same query with its dimensions in another order and another Id
+    second_id = planner.add(build_query('BytesInPerSec', 'Average', [('Broker ID', '1'), CLUSTER], 'y'), (0, 13))
+    other_id = planner.add(build_query('BytesInPerSec', 'Average', [CLUSTER, ('Broker ID', '2')]), (1, 9))
+
+    assert first_id == second_id == 'm0'
+    assert other_id == 'm1'
+    assert [query['Id'] for query in planner.queries] == ['m0', 'm1']
+    assert planner.cells == {'m0': [(0, 9), (0, 13)], 'm1': [(1, 9)]}
+    assert planner.planned_cells == 3
+    assert count_distinct_queries([build_query('BytesInPerSec', 'Average', [CLUSTER, ('Broker ID', '1')], 'x'),
+                                   build_query('BytesInPerSec', 'Average', [('Broker ID', '1'), CLUSTER], 'y')]) == 1
+
+
+def test_statistics_of_a_metric_are_adjacent():
+    planner = MetricQueryPlanner('m')
+    planner.add(build_query('BytesInPerSec', 'Average', [CLUSTER]), 'average in')
+    planner.add(build_query('BytesOutPerSec', 'Average', [CLUSTER]), 'average out')
+    planner.add(build_query('BytesInPerSec', 'Maximum', [CLUSTER]), 'peak in')
+
+    assert [query['Id'] for query in planner.queries] == ['m0', 'm2', 'm1']
+    assert planner.count_statistics() == {'Average': 2, 'Maximum': 1}
+
+
+def test_values_are_mapped_back_and_summed_per_cell():
+    planner = MetricQueryPlanner('m')
+    planner.add(build_query('BytesInPerSec', 'Average', [CLUSTER, ('Topic', 'a')]), 'sum')
+    planner.add(build_query('BytesInPerSec', 'Average', [CLUSTER, ('Topic', 'b')]), 'sum')
+    planner.add(build_query('BytesInPerSec', 'Average', [CLUSTER, ('Topic', 'a')]), 'topic a')
+
+    assert planner.map_values({'m0': 1.5, 'm1': 2.0}) == {'sum': 3.5, 'topic a': 1.5}
+    assert planner.map_values({'m0': 1.5}) == {'sum': 1.5, 'topic a': 1.5}
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Checks how the incremental state store advances the stored range of a series and prunes old buckets.
+
+Usage:
+    python -m pytest test_metricStore.py
+"""
+
+from metricStore import OVERLAP_SECONDS, MetricStore, build_series_key
+
+
+HOUR = 3600
+QUERY = {'Id': 'm0', 'MetricStat': {'Metric': {'Namespace': 'AWS/Kafka', 'MetricName': 'BytesInPerSec',
+                                               'Dimensions': [{'Name': 'Cluster Name', 'Value': 'cluster-1'}]},
+                                    'Period': HOUR, 'Stat': 'Average'}}
+
+
+def test_series_key_ignores_the_query_id():
+    assert build_series_key(QUERY) == build_series_key(dict(QUERY, Id='m7'))
+
+
+def test_next_window_only_fetches_the_new_hours(tmp_path):
+    store = MetricStore(str(tmp_path))
+    key = build_series_key(QUERY)
+    assert store.get_fetch_start(key, 0, 10 * HOUR) == 0
+    store.save(key, 0, 0, 10 * HOUR, [(hour * HOUR, float(hour)) for hour in range(10)])
+
+    # Two hours later: the last stored hour is fetched again, then the new ones
+    fetch_start = store.get_fetch_start(key, 2 * HOUR, 12 * HOUR)
+    assert fetch_start == 10 * HOUR - OVERLAP_SECONDS
+    store.save(key, fetch_start, 2 * HOUR, 12 * HOUR, [(9 * HOUR, 9.5), (10 * HOUR, 10.0), (11 * HOUR, 11.0)])
+
+    buckets = store.load(key, 2 * HOUR, 12 * HOUR)
+    assert buckets == [(hour * HOUR, 9.5 if hour == 9 else float(hour)) for hour in range(2, 12)]
+    assert store.get_fetch_start(key, 2 * HOUR, 12 * HOUR) == 12 * HOUR - OVERLAP_SECONDS
+    store.close()
+
+
+def test_buckets_older_than_the_window_are_pruned(tmp_path):
+    store = MetricStore(str(tmp_path))
+    key = build_series_key(QUERY)
+    store.save(key, 0, 0, 4 * HOUR, [(hour * HOUR, 1.0) for hour in range(4)])
+    store.save(key, 3 * HOUR, 2 * HOUR, 5 * HOUR, [(4 * HOUR, 1.0)])
+
+    assert store.load(key, 0, 5 * HOUR) == [(hour * HOUR, 1.0) for hour in range(2, 5)]
+    store.close()
+
+
+def test_window_starting_before_the_stored_range_is_fetched_in_full(tmp_path):
+    store = MetricStore(str(tmp_path))
+    key = build_series_key(QUERY)
+    store.save(key, 2 * HOUR, 2 * HOUR, 4 * HOUR, [(2 * HOUR, 1.0), (3 * HOUR, 1.0)])
+
+    # A longer window, or one that starts after the end of the stored range
+    assert store.get_fetch_start(key, 0, 4 * HOUR) == 0
+    assert store.get_fetch_start(key, 5 * HOUR, 8 * HOUR) == 5 * HOUR
+    store.close()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the row sinks writing the frames of an account incrementally, see outputWriters.
+
+Usage:
+    python -m pytest test_outputWriters.py
+"""
+
+import pandas as pd
+import pytest
+
+from outputWriters import ParquetSink, RowSink, open_sink
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+
+def test_parquet_sink_keeps_float_columns_of_integer_first_rows(tmp_path):
+    sink = open_sink(str(tmp_path), 'account', 'us-east-1', 'parquet',
+                     float_columns={'ClusterData': ['BytesInPerSec (avg)']})
+    sink.write('ClusterData', pd.DataFrame({'Region': ['us-east-1'], 'ClusterName': ['idle'], 'NodeId': [1],
+                                            'BytesInPerSec (avg)': [0]}))
+    sink.write('ClusterData', pd.DataFrame({'Region': [''], 'ClusterName': [''], 'NodeId': [2],
+                                            'BytesInPerSec (avg)': [1.5]}))
+    sink.write('ClusterData', pd.DataFrame({'Region': ['us-east-1'], 'ClusterName': ['serverless'], 'NodeId': [''],
+                                            'BytesInPerSec (avg)': ['']}))
+    output_files = sink.close()
+
+    assert isinstance(sink, ParquetSink)
+    assert len(output_files) == 1
+    table = pq.read_table(output_files[0])
+    assert str(table.schema.field('BytesInPerSec (avg)').type) == 'double'
+    assert str(table.schema.field('NodeId').type) == 'int64'
+    frame = table.to_pandas()
+    assert frame['BytesInPerSec (avg)'].tolist()[:2] == [0.0, 1.5]
+    assert pd.isna(frame['BytesInPerSec (avg)'].iloc[2])
+    assert frame['NodeId'].tolist()[:2] == [1, 2]
+    assert frame['ClusterName'].tolist() == ['idle', '', 'serverless']
+
+
+def test_csv_sink_keeps_the_columns_of_the_first_rows(tmp_path):
+    sink = open_sink(str(tmp_path), 'account', 'us-east-1', 'csv')
+    sink.write('ClusterData', pd.DataFrame({'ClusterName': ['a'], 'NodeId': [1]}))
+    sink.write('ClusterData', pd.DataFrame({'NodeId': [2], 'Extra': [3], 'ClusterName': ['b']}))
+    output_files = sink.close()
+
+    assert pd.read_csv(output_files[0]).to_dict('list') == {'ClusterName': ['a', 'b'], 'NodeId': [1, 2]}
+
+
+def test_row_sink_requires_append(tmp_path):
+    with pytest.raises(TypeError):
+        RowSink(str(tmp_path), 'account', 'us-east-1')
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the collection windows and the GetMetricData helpers of pullMSKStats.
+
+Usage:
+    python -m pytest test_pullMSKStats.py
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import pullMSKStats
+from apiCallStats import ApiCallStats
+from metricCache import MetricCache
+from syntheticFleet import SyntheticFleet, create_fleet_session
+
+
+def test_merge_metric_data_pages_concatenates_partial_results():
+    pages = [
+        {'MetricDataResults': [
+            {'Id': 'm0', 'Label': 'a', 'Timestamps': [1, 2], 'Values': [1.0, 2.0], 'StatusCode': 'PartialData'},
+            {'Id': 'm1', 'Label': 'b', 'Timestamps': [1], 'Values': [5.0], 'StatusCode': 'Complete'}],
+         'NextToken': 'page-2'},
+        {'MetricDataResults': [
+            {'Id': 'm0', 'Label': 'a', 'Timestamps': [3], 'Values': [3.0], 'StatusCode': 'Complete',
+             'Messages': [{'Code': 'MaxDatapoints', 'Value': 'truncated'}]}]},
+    ]
+    results = pullMSKStats.merge_metric_data_pages(pages)
+
+    assert [result['Id'] for result in results] == ['m0', 'm1']
+    assert results[0]['Timestamps'] == [1, 2, 3]
+    assert results[0]['Values'] == [1.0, 2.0, 3.0]
+    assert results[0]['Messages'] == [{'Code': 'MaxDatapoints', 'Value': 'truncated'}]
+    assert pullMSKStats.get_metric_data_statuses(results) == {'m0': 'Complete', 'm1': 'Complete'}
+
+
+def test_incomplete_results_fail():
+    results = pullMSKStats.merge_metric_data_pages([
+        {'MetricDataResults': [{'Id': 'm0', 'Timestamps': [1], 'Values': [1.0], 'StatusCode': 'PartialData'}]}])
+
+    with pytest.raises(RuntimeError, match='m0 \\(PartialData\\)'):
+        pullMSKStats.check_metric_data_statuses(pullMSKStats.get_metric_data_statuses(results), 'cluster')
+
+
+def test_get_metric_data_results_follows_next_token():
+    api_call_stats = ApiCallStats()
+    session = create_fleet_session(SyntheticFleet(1, 3, 0, 0, max_datapoints=50), api_call_stats=api_call_stats)
+    query = pullMSKStats.build_broker_metric_query('m0', 'provisioned-0000', 'BytesInPerSec', False, 1,
+                                                   period=pullMSKStats.AGGREGATION_DURATION_SECONDS)
+    start_time, end_time, number_of_buckets = pullMSKStats.get_series_window()
+    results = pullMSKStats.get_metric_data_results(session.client('cloudwatch'), [query], start_time, end_time)
+
+    assert api_call_stats.to_dict()['cloudwatch.GetMetricData']['calls'] > 1
+    assert len(results) == 1
+    assert results[0]['StatusCode'] == 'Complete'
+    assert len(results[0]['Timestamps']) == number_of_buckets
+    assert results[0]['Timestamps'] == sorted(results[0]['Timestamps'])
+
+
+def test_windows_end_at_the_pinned_collection_time(monkeypatch):
+    collection_time = datetime(2026, 10, 16, 9, 59, 30, tzinfo=timezone.utc)
+    monkeypatch.setattr(pullMSKStats, '_collection_time', collection_time)
+
+    start_time, end_time = pullMSKStats.get_metric_window(7)
+    assert (start_time, end_time) == (collection_time - timedelta(days=7), collection_time)
+    _, end_time = pullMSKStats.get_metric_window(7, cache=object())
+    assert end_time == datetime(2026, 10, 16, 9, tzinfo=timezone.utc)
+    start_time, end_time, number_of_buckets = pullMSKStats.get_series_window(7)
+    assert end_time == datetime(2026, 10, 16, 9, tzinfo=timezone.utc)
+    assert number_of_buckets == 7 * 24 * 3600 // pullMSKStats.AGGREGATION_DURATION_SECONDS
+
+
+@pytest.mark.parametrize('hourly', [False, True])
+def test_serverless_metric_without_topics_is_cached(tmp_path, hourly):
+    api_call_stats = ApiCallStats()
+    session = create_fleet_session(SyntheticFleet(0, 3, 1, 0), api_call_stats=api_call_stats)
+    cloudwatch_client = session.client('cloudwatch')
+    cache = MetricCache(str(tmp_path))
+    for _ in range(2):
+        value = pullMSKStats.get_cloudwatch_serverless_metric(cloudwatch_client, 'serverless-0000', 'BytesInPerSec',
+                                                              False, hourly=hourly, cache=cache)
+        assert value == 0.0
+    cache.close()
+    assert api_call_stats.to_dict()['cloudwatch.ListMetrics']['calls'] == 1
+
+
+@pytest.mark.parametrize('hourly', [False, True])
+def test_planned_serverless_cells_without_topics_are_cached(tmp_path, hourly):
+    api_call_stats = ApiCallStats()
+    session = create_fleet_session(SyntheticFleet(1, 3, 1, 0), api_call_stats=api_call_stats)
+    cache = MetricCache(str(tmp_path))
+    frames = [pullMSKStats.get_msk_cluster_data(session, 'us-east-1', hourly=hourly, cache=cache) for _ in range(2)]
+    cache.close()
+    assert frames[0].equals(frames[1])
+    assert api_call_stats.to_dict()['cloudwatch.ListMetrics']['calls'] == 1
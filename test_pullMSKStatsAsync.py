@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the async engine's clients keep assumed role credentials refreshable.
+
+Usage:
+    python -m pytest test_pullMSKStatsAsync.py
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+
+import pullMSKStats
+import pullMSKStatsAsync
+
+pytest.importorskip('aiobotocore')
+
+
+async def get_client_credentials(session):
+    async with pullMSKStatsAsync.create_async_client(session, 'cloudwatch') as client:
+        return [await client._get_credentials().get_frozen_credentials() for _ in range(3)]
+
+
+def test_assumed_role_credentials_are_refreshed_before_they_expire():
+    refreshes = []
+
+    def refresh_credentials():
+        refreshes.append(datetime.now(timezone.utc))
+        # The first credentials expire within the refresh window, the next ones in an hour
+        expiry_time = refreshes[-1] + timedelta(seconds=60 if len(refreshes) == 1 else 3600)
+        return {'access_key': f"key-{len(refreshes)}", 'secret_key': 'secret', 'token': 'token',
+                'expiry_time': expiry_time.isoformat()}
+
+    session = pullMSKStats.EndpointSession(refresh_credentials=refresh_credentials, region_name='us-east-1')
+    credentials = asyncio.run(get_client_credentials(session))
+
+    assert [frozen_credentials.access_key for frozen_credentials in credentials] == ['key-1', 'key-2', 'key-2']
+    assert len(refreshes) == 2
+
+
+def test_static_credentials_are_passed_on():
+    session = boto3.Session(aws_access_key_id='key', aws_secret_access_key='secret', region_name='us-east-1')
+    credentials = asyncio.run(get_client_credentials(session))
+
+    assert {(frozen_credentials.access_key, frozen_credentials.secret_key) for frozen_credentials in credentials} == \
+        {('key', 'secret')}
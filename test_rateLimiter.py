@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the clients of a session share their rate limiters, see rateLimiter.
+
+Usage:
+    python -m pytest test_rateLimiter.py
+"""
+
+import boto3
+
+from rateLimiter import create_rate_limited_client, get_client_rate_limiter
+
+
+def test_clients_of_a_session_share_the_limiter_of_their_region_and_service():
+    session = boto3.Session(aws_access_key_id='x', aws_secret_access_key='y', region_name='us-east-1')
+    limiter = get_client_rate_limiter(session, 'us-east-1', 'cloudwatch')
+    create_rate_limited_client(session, 'cloudwatch')
+    create_rate_limited_client(session, 'cloudwatch')
+
+    assert get_client_rate_limiter(session, 'us-east-1', 'cloudwatch') is limiter
+    assert get_client_rate_limiter(session, 'us-east-1', 'kafka') is not limiter
+    assert get_client_rate_limiter(session, 'us-west-2', 'cloudwatch') is not limiter
+    other_session = boto3.Session(aws_access_key_id='x', aws_secret_access_key='y', region_name='us-east-1')
+    assert get_client_rate_limiter(other_session, 'us-east-1', 'cloudwatch') is not limiter
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that interrupted runs are resumed from their run manifest, see runManifest.
+
+Usage:
+    python -m pytest test_runManifest.py
+"""
+
+from runManifest import RunManifest, get_unit_name
+
+
+OPTIONS = {'engine': 'threads', 'regions': ['us-east-1']}
+WINDOW = ['2026-10-09T09:59:30+00:00', '2026-10-16T09:59:30+00:00']
+NEXT_HOUR_WINDOW = ['2026-10-09T10:00:30+00:00', '2026-10-16T10:00:30+00:00']
+
+
+def test_resume_keeps_completed_units(tmp_path):
+    unit = get_unit_name('us-east-1', 'cluster-1')
+    manifest = RunManifest(tmp_path, 'account', options=OPTIONS, window=WINDOW)
+    manifest.save(unit, {'rows': [1, 2]})
+
+    resumed = RunManifest(tmp_path, 'account', resume=True, options=OPTIONS, window=WINDOW)
+    assert resumed.load(unit) == {'rows': [1, 2]}
+    assert resumed.load(get_unit_name('us-east-1')) is None
+
+
+def test_resume_across_an_hour_boundary_keeps_the_window(tmp_path):
+    unit = get_unit_name('us-east-1', 'cluster-1')
+    RunManifest(tmp_path, 'account', options=OPTIONS, window=WINDOW).save(unit, 'output')
+
+    resumed = RunManifest(tmp_path, 'account', resume=True, options=OPTIONS, window=NEXT_HOUR_WINDOW)
+    assert resumed.load(unit) == 'output'
+    assert resumed.window == WINDOW
+
+
+def test_resume_with_other_options_starts_over(tmp_path):
+    unit = get_unit_name('us-east-1', 'cluster-1')
+    RunManifest(tmp_path, 'account', options=OPTIONS, window=WINDOW).save(unit, 'output')
+
+    resumed = RunManifest(tmp_path, 'account', resume=True, options=dict(OPTIONS, engine='async'),
+                          window=NEXT_HOUR_WINDOW)
+    assert resumed.load(unit) is None
+    assert resumed.window == NEXT_HOUR_WINDOW
+    assert not (tmp_path / 'account').exists()
+
+
+def test_run_without_resume_starts_over(tmp_path):
+    unit = get_unit_name('us-east-1', 'cluster-1')
+    RunManifest(tmp_path, 'account', options=OPTIONS, window=WINDOW).save(unit, 'output')
+
+    assert RunManifest(tmp_path, 'account', options=OPTIONS, window=WINDOW).load(unit) is None
+
+
+def test_done_account_is_skipped_and_failed_units_are_kept(tmp_path):
+    unit = get_unit_name('us-east-1', 'cluster-1')
+    manifest = RunManifest(tmp_path, 'account', options=OPTIONS, window=WINDOW)
+    manifest.save(unit, 'output')
+    manifest.mark_failed(get_unit_name('us-east-1', 'cluster-2'))
+    manifest.mark_done(['account.xlsx'])
+    assert not RunManifest(tmp_path, 'account', resume=True, options=OPTIONS, window=WINDOW).is_done()
+
+    manifest = RunManifest(tmp_path, 'account', resume=True, options=OPTIONS, window=WINDOW)
+    manifest.mark_done(['account.xlsx'])
+    resumed = RunManifest(tmp_path, 'account', resume=True, options=OPTIONS, window=WINDOW)
+    assert resumed.is_done()
+    assert resumed.manifest['output_files'] == ['account.xlsx']
+
+
+def test_unreadable_unit_is_collected_again(tmp_path):
+    unit = get_unit_name('us-east-1', 'cluster-1')
+    manifest = RunManifest(tmp_path, 'account', options=OPTIONS, window=WINDOW)
+    manifest.save(unit, 'output')
+    for unit_file in (tmp_path / 'account').iterdir():
+        unit_file.write_bytes(b'truncated')
+
+    assert RunManifest(tmp_path, 'account', resume=True, options=OPTIONS, window=WINDOW).load(unit) is None